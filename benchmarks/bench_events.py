@@ -0,0 +1,59 @@
+import datetime
+import timeit
+import tracemalloc
+
+from src.irc_client import IRCMessage
+from src.irc_client_listener import IRCClientPrivateMessageEvent
+
+
+# Run from the repository root: python -m benchmarks.bench_events
+
+SAMPLE_LINE = (
+        "@badge-info=;badges=;color=#1E90FF;display-name=Viewer;emotes=;"
+        "id=b34ccfc7;mod=0;room-id=1337;subscriber=0;"
+        "tmi-sent-ts=1507246572675;turbo=0;user-id=1337;user-type= "
+        ":viewer!viewer@viewer.tmi.twitch.tv "
+        "PRIVMSG #channel :!jazzyevents")
+EVENT_COUNT = 100000
+
+
+class LegacyEvent:
+    # The Event layout this benchmark compares against: a __dict__ and a
+    # datetime per instance.
+    def __init__(self, message: object) -> None:
+        self.message = message
+        self.created_at = datetime.datetime.now()
+
+
+class LegacyIRCClientPrivateMessageEvent(LegacyEvent):
+    def __init__(self, irc_client: object, irc_message: IRCMessage) -> None:
+        super().__init__(None)
+        self.irc_client = irc_client
+        self.irc_message = irc_message
+
+
+def measure(event_type: type, irc_message: IRCMessage) -> tuple:
+    irc_client = object()
+    construct = lambda: event_type(irc_client, irc_message)
+    seconds = timeit.timeit(construct, number=EVENT_COUNT)
+    tracemalloc.start()
+    events = [construct() for _ in range(EVENT_COUNT)]
+    allocated_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del events
+    return seconds / EVENT_COUNT * 1e9, allocated_bytes / EVENT_COUNT
+
+
+def main() -> None:
+    irc_message = IRCMessage(SAMPLE_LINE)
+    for label, event_type in (
+            ("before", LegacyIRCClientPrivateMessageEvent),
+            ("after", IRCClientPrivateMessageEvent)):
+        ns_per_event, bytes_per_event = measure(event_type, irc_message)
+        print(
+                f"{label:>6}: {ns_per_event:8.1f} ns/event, "
+                f"{bytes_per_event:6.1f} bytes/event")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import re
+import time
+
+from benchmarks.corpus import load_corpus
+from src.irc_client import IRCMessage
+from src.irc_client_listener import IRC_COMMAND_EVENT_MAP
+
+
+# Run from the repository root:
+#   python -m benchmarks.bench_irc_message [--corpus PATH]
+# PATH is an event journal (main.py --record-journal) or a text file of
+# raw IRC lines.
+
+LEGACY_IRC_MESSAGE_REGEX = re.compile(
+        "^(@(?P<tags>.*?) )?(:(?P<prefix>.*?) )?(?P<command>.*?)"
+        "( (?P<parameters>.*?))?$")
+
+
+class LegacyIRCMessage:
+    # The regex parser IRCMessage replaced, kept for comparison.
+    def __init__(self, raw_message: str) -> None:
+        match = LEGACY_IRC_MESSAGE_REGEX.fullmatch(raw_message)
+        self.command = match.group("command")
+        self.tags = {}
+        if match.group("tags"):
+            for tag in match.group("tags").split(";"):
+                tag_key, tag_value = tag.split("=", 1)
+                self.tags[tag_key] = tag_value
+        self.prefix = match.group("prefix")
+        if match.group("parameters"):
+            param_colon_split = match.group("parameters").split(":")
+            self.parameters = param_colon_split[0].split()
+            if len(param_colon_split) > 1:
+                self.parameters.append(":".join(param_colon_split[1:]))
+        else:
+            self.parameters = []
+
+
+def time_per_line(parse: callable, lines: list, rounds: int) -> float:
+    best_sec = None
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        parse(lines)
+        elapsed_sec = time.perf_counter() - started_at
+        if best_sec is None or elapsed_sec < best_sec:
+            best_sec = elapsed_sec
+    return best_sec / len(lines) * 1e9
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--corpus", metavar="PATH")
+    argument_parser.add_argument("--lines", type=int, default=50000)
+    argument_parser.add_argument("--rounds", type=int, default=5)
+    arguments = argument_parser.parse_args()
+    lines = load_corpus(arguments.corpus, arguments.lines)
+    print(f"{len(lines)} lines")
+    cases = {
+            "command only": lambda x: [
+                    IRCMessage(line).command in IRC_COMMAND_EVENT_MAP
+                    for line in x],
+            "full parse": lambda x: [
+                    (y.tags, y.prefix, y.parameters)
+                    for y in map(IRCMessage, x)]}
+    for case_name, parse in cases.items():
+        legacy_ns = time_per_line(
+                lambda x: [LegacyIRCMessage(line) for line in x],
+                lines, arguments.rounds)
+        lazy_ns = time_per_line(parse, lines, arguments.rounds)
+        print(
+                f"{case_name:>12}: regex {legacy_ns:7.0f} ns/line, "
+                f"lazy {lazy_ns:7.0f} ns/line, "
+                f"{legacy_ns / lazy_ns:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.corpus import load_corpus
+from src.irc_client import IRCMessage
+
+
+# Run from the repository root:
+#   python -m benchmarks.bench_irc_tags [--corpus PATH]
+
+# The tags the chat handlers actually read from each message.
+ACCESSED_TAG_KEYS = ("display-name", "user-type", "badges")
+
+
+def legacy_tags(irc_message: IRCMessage) -> dict:
+    # How IRCMessage built tags before IRCTags: a fresh dict with fresh,
+    # still-escaped strings per message.
+    tags = {}
+    raw_tags = irc_message.raw[1:irc_message.raw.find(" ")]
+    for tag in raw_tags.split(";"):
+        tag_key, tag_value = tag.split("=", 1)
+        tags[tag_key] = tag_value
+    return tags
+
+
+def irc_tags(irc_message: IRCMessage) -> object:
+    irc_message._tags = None
+    return irc_message.tags
+
+
+def measure(build_tags: callable, irc_messages: list) -> tuple:
+    started_at = time.perf_counter()
+    for irc_message in irc_messages:
+        tags = build_tags(irc_message)
+        for tag_key in ACCESSED_TAG_KEYS:
+            tags[tag_key]
+    ns_per_message = (
+            (time.perf_counter() - started_at) / len(irc_messages) * 1e9)
+    # The raw line is held by the IRCMessage either way, so only what
+    # the tags add on top of it counts.
+    tracemalloc.start()
+    retained = [build_tags(irc_message) for irc_message in irc_messages]
+    for tags in retained:
+        for tag_key in ACCESSED_TAG_KEYS:
+            tags[tag_key]
+    retained_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del retained
+    return ns_per_message, retained_bytes / len(irc_messages)
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--corpus", metavar="PATH")
+    argument_parser.add_argument("--lines", type=int, default=50000)
+    arguments = argument_parser.parse_args()
+    irc_messages = [
+            irc_message
+            for irc_message in map(
+                    IRCMessage, load_corpus(arguments.corpus, arguments.lines))
+            if irc_message.command == "PRIVMSG"
+            and irc_message.raw.startswith("@")]
+    print(
+            f"{len(irc_messages)} tagged PRIVMSGs, reading "
+            f"{', '.join(ACCESSED_TAG_KEYS)}")
+    for label, build_tags in (("dict", legacy_tags), ("IRCTags", irc_tags)):
+        ns_per_message, bytes_per_message = measure(build_tags, irc_messages)
+        print(
+                f"{label:>8}: {ns_per_message:7.0f} ns/message, "
+                f"{bytes_per_message:7.0f} retained bytes/message")
+
+
+if __name__ == "__main__":
+    main()
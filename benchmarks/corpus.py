@@ -0,0 +1,87 @@
+import random
+
+from typing import List, Optional, Sequence
+
+from src.event_journal import (
+        RECORD_KIND_IRC_MESSAGE, EventJournalFormatError,
+        read_journal_records)
+
+
+CHAT_COMMANDS = (
+        "!jazzy", "!jazzyevents", "!jazzystandings", "!jazzygive",
+        "!jazzypromosoff", "!jazzypromoson", "!jazzybot", "!ggsjazzy")
+CHAT_WORDS = (
+        "parry", "hype", "PogChamp", "gg", "LUL", "wow", "daigo", "ken",
+        "chun-li", "that", "was", "insane", "lol", "3rd", "strike", "ó_ò")
+
+
+def synthetic_privmsg_line(
+        rng: random.Random, channel_name: str, command_ratio: float,
+        chat_commands: Sequence[str]=CHAT_COMMANDS) -> str:
+    user_name = f"viewer{rng.randrange(100000)}"
+    if rng.random() < command_ratio:
+        body = rng.choice(chat_commands)
+    else:
+        body = " ".join(
+                rng.choice(CHAT_WORDS) for _ in range(rng.randint(1, 12)))
+    tags = (
+            f"badge-info=subscriber/{rng.randint(1, 40)};"
+            f"badges=subscriber/12,premium/1;client-nonce=8f3a;"
+            f"color=#{rng.randrange(0xFFFFFF):06X};display-name={user_name};"
+            f"emotes=;first-msg=0;flags=;id={rng.getrandbits(64):016x};"
+            f"mod={int(rng.random() < .05)};returning-chatter=0;"
+            f"room-id={abs(hash(channel_name)) % 100000000};"
+            f"subscriber=1;tmi-sent-ts={1690000000000 + rng.randrange(10**9)};"
+            f"turbo=0;user-id={rng.randrange(10**9)};user-type=")
+    return (
+            f"@{tags} :{user_name}!{user_name}@{user_name}.tmi.twitch.tv "
+            f"PRIVMSG #{channel_name} :{body}")
+
+
+def synthetic_twitch_lines(
+        line_count: int, channel_count: int=20, command_ratio: float=.05,
+        seed: int=3) -> List[str]:
+    # Mostly tagged PRIVMSGs, with the occasional PING, JOIN and
+    # USERSTATE mixed in like a real Twitch connection.
+    rng = random.Random(seed)
+    channel_names = [f"channel{x}" for x in range(channel_count)]
+    lines = []
+    for _ in range(line_count):
+        channel_name = rng.choice(channel_names)
+        roll = rng.random()
+        if roll < .005:
+            lines.append("PING :tmi.twitch.tv")
+        elif roll < .02:
+            lines.append(
+                    ":viewer!viewer@viewer.tmi.twitch.tv "
+                    f"JOIN #{channel_name}")
+        elif roll < .025:
+            lines.append(
+                    "@badge-info=;badges=moderator/1;color=;"
+                    "display-name=JazzyCircuitBot;emote-sets=0;mod=1;"
+                    "subscriber=0;user-type=mod :tmi.twitch.tv USERSTATE "
+                    f"#{channel_name}")
+        else:
+            lines.append(
+                    synthetic_privmsg_line(rng, channel_name, command_ratio))
+    return lines
+
+
+def load_corpus(corpus_path: Optional[str], line_count: int) -> List[str]:
+    # A recorded corpus is either an event journal or a text file with
+    # one raw IRC line per line. Without one, a synthetic corpus is
+    # generated.
+    if corpus_path is None:
+        return synthetic_twitch_lines(line_count)
+    with open(corpus_path, "rb") as corpus_file:
+        try:
+            return [
+                    payload.decode("utf-8")
+                    for record_kind, recorded_ns, payload
+                    in read_journal_records(corpus_file)
+                    if record_kind == RECORD_KIND_IRC_MESSAGE]
+        except EventJournalFormatError:
+            corpus_file.seek(0)
+            return [
+                    line.decode("utf-8").rstrip("\r\n")
+                    for line in corpus_file if line.strip()]
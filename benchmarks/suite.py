@@ -0,0 +1,353 @@
+import argparse
+import gc
+import importlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.corpus import load_corpus
+from src.bot_state_store import BotStateStore
+from src.irc_client import IRCMessage
+from src.irc_client_listener import (
+        IRCClientListener, IRCClientPrivateMessageEvent,
+        PrivateMessagePrefilter)
+from src.streambrain import Handler, StreamBrain
+from src.twitch_chat_command_handler import (
+        TwitchChatCommandHandler, is_chat_command, twitch_chat_commands)
+
+
+# Run from the repository root:
+#   python -m benchmarks.suite [--corpus PATH] [--save-baseline]
+# Every case runs over the whole corpus: a recorded one (an event
+# journal or a text file of raw IRC lines) or, by default, a synthetic
+# one. Results are compared against benchmarks/baseline.json, and the
+# run exits non-zero if any case got slower, or its allocations peaked
+# higher, by more than the threshold. Baselines only mean something on
+# the machine that recorded them; re-record with --save-baseline after
+# changing machines.
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_REGRESSION_THRESHOLD = .25
+DISPATCH_HANDLER_COUNTS = (1, 10, 50)
+# A baseline is the median of several full measurements, so one lucky
+# run doesn't set the bar.
+BASELINE_REPEATS = 3
+
+
+class BenchmarkCase:
+    # 'prepare' turns the corpus into a context and the inputs for one
+    # round; each input is one op. 'run' processes the inputs and may
+    # return what it built; that's held until the round is measured.
+    # 'tear_down', if given, releases the context after each round.
+    def __init__(
+            self, name: str,
+            prepare: Callable[[List[str]], Tuple[object, list]],
+            run: Callable[[object, list], list],
+            tear_down: Optional[Callable[[object], None]]=None) -> None:
+        self.name = name
+        self.prepare = prepare
+        self.run = run
+        self.tear_down = tear_down
+
+
+class CorpusIRCClient:
+    # Stands in for a connected IRCClient, returning the same parsed
+    # corpus on every read.
+    def __init__(self, irc_messages: List[IRCMessage]) -> None:
+        self.irc_messages = irc_messages
+
+    def read_messages(self, block: bool=True) -> List[IRCMessage]:
+        return self.irc_messages
+
+
+class RoutingOnlyCommandHandler(TwitchChatCommandHandler):
+    # Measures how handle() picks a command, not what the commands do;
+    # the real ones call start.gg or write files. Blocking commands
+    # aren't handed to the worker pool either.
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        for chat_command in twitch_chat_commands.commands():
+            setattr(self, chat_command.method_name, self.skip_command)
+
+    def skip_command(self, channel: str, sender: str) -> None:
+        pass
+
+    def _start_blocking_command(
+            self, chat_command: object, command_method: Callable,
+            channel: str, sender: str) -> None:
+        # handle() took a worker slot for the command.
+        self._command_slots.release()
+
+
+class CountingHandler(Handler):
+    def __init__(self, irc_client: object) -> None:
+        super().__init__(
+                IRCClientPrivateMessageEvent, {"irc_client": irc_client})
+        self.handled_count = 0
+
+    def handle(self, event: IRCClientPrivateMessageEvent) -> None:
+        self.handled_count += 1
+
+
+def parse_privmsgs(lines: List[str]) -> List[IRCMessage]:
+    return [
+            x for x in map(IRCMessage, lines)
+            if x.command == "PRIVMSG" and x.raw.startswith("@")]
+
+
+def privmsg_events(lines: List[str]) -> list:
+    irc_client = object()
+    return [
+            IRCClientPrivateMessageEvent(irc_client, x)
+            for x in parse_privmsgs(lines)]
+
+
+def prepare_listener(
+        lines: List[str]) -> Tuple[IRCClientListener, List[IRCMessage]]:
+    irc_messages = [IRCMessage(x) for x in lines]
+    return IRCClientListener(CorpusIRCClient(irc_messages)), irc_messages
+
+
+def prepare_prefiltered_listener(
+        lines: List[str]) -> Tuple[IRCClientListener, List[IRCMessage]]:
+    irc_messages = [IRCMessage(x) for x in lines]
+    irc_client_listener = IRCClientListener(
+            CorpusIRCClient(irc_messages),
+            prefilter=PrivateMessagePrefilter())
+    return irc_client_listener, irc_messages
+
+
+def create_dispatch_case(handler_count: int) -> BenchmarkCase:
+    # One handler per connection, as with an IRCClient per channel
+    # group; each event matches exactly one of them.
+    def prepare(lines: List[str]) -> Tuple[StreamBrain, list]:
+        streambrain = StreamBrain()
+        irc_clients = [object() for _ in range(handler_count)]
+        for irc_client in irc_clients:
+            streambrain.activate_handler(CountingHandler(irc_client))
+        events = [
+                IRCClientPrivateMessageEvent(irc_clients[0], x)
+                for x in parse_privmsgs(lines)]
+        return streambrain, events
+
+    def run(streambrain: StreamBrain, events: list) -> list:
+        for event in events:
+            streambrain.dispatch_event(event)
+        return []
+
+    return BenchmarkCase(
+            f"streambrain_dispatch_{handler_count}_handlers", prepare, run)
+
+
+def create_command_routing_case(command_cooldowns: bool) -> BenchmarkCase:
+    # Routing alone is comparable across versions; the cooldown table
+    # is measured by a case of its own. The stubbed commands never touch
+    # the store, but each round's handler gets its own and closes it.
+    def prepare(lines: List[str]) -> Tuple[Handler, list]:
+        handler = RoutingOnlyCommandHandler(
+                CorpusIRCClient([]), BotStateStore(":memory:"), "",
+                command_cooldowns=command_cooldowns)
+        events = [x for x in privmsg_events(lines) if is_chat_command(x)]
+        # Splitting the parameters is measured by irc_message_parse.
+        for event in events:
+            event.irc_message.parameters
+        return handler, events
+
+    def run(handler: Handler, events: list) -> list:
+        for event in events:
+            handler.handle(event)
+        return []
+
+    def tear_down(handler: RoutingOnlyCommandHandler) -> None:
+        try:
+            handler.stop()
+        finally:
+            handler._bot_state.close()
+
+    if command_cooldowns:
+        case_name = "command_handler_routing_with_cooldowns"
+    else:
+        case_name = "command_handler_routing"
+    return BenchmarkCase(case_name, prepare, run, tear_down)
+
+
+def create_cases() -> Dict[str, Optional[BenchmarkCase]]:
+    # A case whose code can't be imported is reported and skipped.
+    cases = {}
+    cases["irc_message_parse"] = BenchmarkCase(
+            "irc_message_parse", lambda lines: (None, lines),
+            lambda _, lines: [
+                    (x.tags, x.prefix, x.parameters)
+                    for x in map(IRCMessage, lines)])
+    cases["listener_event_mapping"] = BenchmarkCase(
+            "listener_event_mapping", prepare_listener,
+            lambda irc_client_listener, _: irc_client_listener.listen())
+    cases["listener_prefiltered_event_mapping"] = BenchmarkCase(
+            "listener_prefiltered_event_mapping",
+            prepare_prefiltered_listener,
+            lambda irc_client_listener, _: irc_client_listener.listen())
+    try:
+        twitch_chat_private_message = importlib.import_module(
+                "src.twitch_chat_private_message")
+    except Exception as e:
+        print(f"skipping twitch_chat_private_message cases: {e!r}")
+        cases["create_private_message_object"] = None
+        cases["irc_badge_pairs_to_dict"] = None
+    else:
+        cases["create_private_message_object"] = BenchmarkCase(
+                "create_private_message_object",
+                lambda lines: (None, parse_privmsgs(lines)),
+                lambda _, irc_messages: [
+                        twitch_chat_private_message
+                        .create_private_message_object_from(x)
+                        for x in irc_messages])
+        cases["irc_badge_pairs_to_dict"] = BenchmarkCase(
+                "irc_badge_pairs_to_dict",
+                lambda lines: (None, [
+                        x.tags["badges"] for x in parse_privmsgs(lines)]),
+                lambda _, badge_strs: [
+                        twitch_chat_private_message
+                        .irc_badge_pairs_to_dict(x)
+                        for x in badge_strs])
+    for handler_count in DISPATCH_HANDLER_COUNTS:
+        case = create_dispatch_case(handler_count)
+        cases[case.name] = case
+    for command_cooldowns in (False, True):
+        case = create_command_routing_case(command_cooldowns)
+        cases[case.name] = case
+    return cases
+
+
+def measure(
+        case: BenchmarkCase, lines: List[str],
+        rounds: int) -> Dict[str, float]:
+    best_sec = None
+    for _ in range(rounds):
+        context, inputs = case.prepare(lines)
+        # As timeit does, keep collector pauses out of the timing.
+        gc.collect()
+        gc.disable()
+        try:
+            started_at = time.perf_counter()
+            case.run(context, inputs)
+            elapsed_sec = time.perf_counter() - started_at
+        finally:
+            gc.enable()
+            if case.tear_down is not None:
+                case.tear_down(context)
+        if best_sec is None or elapsed_sec < best_sec:
+            best_sec = elapsed_sec
+    # Only what 'run' allocates is traced. The peak counts temporaries
+    # freed before the round ends as well as what it keeps.
+    context, inputs = case.prepare(lines)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    result = case.run(context, inputs)
+    peak_bytes = tracemalloc.get_traced_memory()[1] - traced_before
+    tracemalloc.stop()
+    del result
+    if case.tear_down is not None:
+        case.tear_down(context)
+    op_count = max(len(inputs), 1)
+    return {
+            "ops_per_sec": op_count / best_sec,
+            "peak_bytes_per_op": peak_bytes / op_count}
+
+
+def find_regressions(
+        results: Dict[str, Dict[str, float]],
+        baseline: Dict[str, Dict[str, float]],
+        threshold: float) -> List[str]:
+    regressions = []
+    for case_name, result in results.items():
+        try:
+            baseline_result = baseline[case_name]
+        except KeyError:
+            continue
+        slowest_ops_per_sec = baseline_result["ops_per_sec"] * (1 - threshold)
+        if result["ops_per_sec"] < slowest_ops_per_sec:
+            regressions.append(
+                    f"{case_name}: {result['ops_per_sec']:.0f} ops/s is "
+                    f"below {slowest_ops_per_sec:.0f}")
+        # Small absolute differences in allocations are noise.
+        largest_peak_bytes_per_op = max(
+                baseline_result["peak_bytes_per_op"] * (1 + threshold),
+                baseline_result["peak_bytes_per_op"] + 16)
+        if result["peak_bytes_per_op"] > largest_peak_bytes_per_op:
+            regressions.append(
+                    f"{case_name}: {result['peak_bytes_per_op']:.0f} peak "
+                    f"bytes/op is above {largest_peak_bytes_per_op:.0f}")
+    return regressions
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--corpus", metavar="PATH")
+    argument_parser.add_argument("--lines", type=int, default=20000)
+    argument_parser.add_argument("--rounds", type=int, default=10)
+    argument_parser.add_argument("--only", nargs="+", metavar="CASE")
+    argument_parser.add_argument(
+            "--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    argument_parser.add_argument("--save-baseline", action="store_true")
+    argument_parser.add_argument(
+            "--baseline", default=BASELINE_PATH, metavar="PATH")
+    arguments = argument_parser.parse_args()
+
+    lines = load_corpus(arguments.corpus, arguments.lines)
+    if arguments.corpus is None:
+        corpus_name = f"synthetic-{arguments.lines}"
+    else:
+        corpus_name = os.path.basename(arguments.corpus)
+    print(f"corpus {corpus_name}: {len(lines)} lines")
+    results = {}
+    for case_name, case in create_cases().items():
+        if arguments.only and case_name not in arguments.only:
+            continue
+        if case is None:
+            print(f"{case_name:>38}: skipped")
+            continue
+        repeat_count = BASELINE_REPEATS if arguments.save_baseline else 1
+        repeated_results = sorted(
+                (
+                        measure(case, lines, arguments.rounds)
+                        for _ in range(repeat_count)),
+                key=lambda x: x["ops_per_sec"])
+        result = repeated_results[len(repeated_results) // 2]
+        results[case_name] = result
+        print(
+                f"{case_name:>38}: {result['ops_per_sec']:12.0f} ops/s "
+                f"{result['peak_bytes_per_op']:8.1f} peak bytes/op")
+
+    try:
+        with open(arguments.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+    except FileNotFoundError:
+        baselines = {}
+    if arguments.save_baseline:
+        baselines.setdefault(corpus_name, {}).update(results)
+        with open(arguments.baseline, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"saved baseline for {corpus_name}")
+        return
+    if corpus_name not in baselines:
+        print(
+                f"no baseline for {corpus_name}; record one with "
+                "--save-baseline")
+        return
+    regressions = find_regressions(
+            results, baselines[corpus_name], arguments.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions beyond {arguments.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
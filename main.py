@@ -1,3 +1,4 @@
+import argparse
 import datetime
 import http.client
 import json
@@ -8,25 +9,40 @@ import typing
 import urllib.error
 
 import src.givebutter as givebutter
-import src.startgg as startgg
 import src.irc_client_listener as irc_client_listener
+import src.streambrain as streambrain
 
 from time import sleep
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from src.bot_state_store import BotStateStore
+from src.event_journal import EventJournalWriter
 from src.givebutter_handlers import GivebutterDonationHandler
 from src.givebutter_listeners import GivebutterListener
-from src.irc_client import IRCClient
+from src.irc_client import IRCClient, JoinProgress
+from src.irc_client_pool import IRCClientPool
+from src.irc_client_writer import (
+        TWITCH_RATE_LIMIT_PROFILE, IRCRateLimitProfile)
+from src.irc_reactor import IRCReactor
 from src.irc_client_handlers import (
-        ReportTimeoutHandler, LeaveIfNotModdedHandler, PongIfPingedHandler,
+        ConfirmJoinHandler, ReportTimeoutHandler, LeaveIfNotModdedHandler,
         TwitchChatLoginFailedHandler)
+from src.startgg_cache import startgg_league_cache
 from src.streambrain import StreamBrain
+from src.streambrain_metrics import StreamBrainMetrics, start_metrics_server
 from src.twitch import (
         TwitchHTTPError, TwitchStreamData, TwitchOauthManager, get_streams)
 from src.twitch_chat_command_handler import TwitchChatCommandHandler
 
+BOT_STATE_PATH = "jazzycircuitbot_state.sqlite3"
+CHANNELS_PER_CONNECTION = 50
+CHAT_DISPATCHER_COUNT = 4
+METRICS_PORT = 9108
+# The text files bot state was kept in before BOT_STATE_PATH. They're
+# migrated into it on first start.
 CURRENT_CHANNELS_PATH = "current_channels.txt"
 EVENT_PROMO_OPTOUTS_PATH = "event_promo_optouts.txt"
+PROCESSED_GIVING_SPACE_IDS_PATH = "processed_giving_space_ids.txt"
 
 def get_twitch_streams(
         twitch_oauth_manager: TwitchOauthManager, user_ids: List[int]=[],
@@ -56,7 +72,7 @@ def get_twitch_streams(
 
 def get_startgg_league_events(
         access_token: str, league_slug: str) -> List[Dict]:
-    return startgg.get_league_events(access_token, league_slug)
+    return startgg_league_cache.get_league_events(access_token, league_slug)
 
 
 class Routine:
@@ -110,17 +126,17 @@ class JazzyEventPromoRoutine(Routine):
     def __init__(
             self, startgg_access_token: str,
             twitch_oauth_manager: TwitchOauthManager, irc_client: IRCClient,
-            interval_sec: int, delay_sec: int=0):
+            bot_state: BotStateStore, interval_sec: int, delay_sec: int=0):
         self._startgg_access_token = startgg_access_token
         self._twitch_oauth_manager = twitch_oauth_manager
         self._irc_client = irc_client
+        self._bot_state = bot_state
         self._plugged_event_ids = []
         super().__init__(interval_sec, delay_sec)
 
     def run(self):
         # This code is hideous and I'm sorry. I'm gonna refactor it.
-        with open(EVENT_PROMO_OPTOUTS_PATH) as event_promo_optouts_file:
-            optouts = event_promo_optouts_file.read().split()
+        optouts = self._bot_state.promo_optouts
         # diagnostic
         print("Getting startgg events.")
         events = get_startgg_league_events(
@@ -177,78 +193,169 @@ class JazzyEventPromoRoutine(Routine):
         self._plugged_event_ids.append(random_event_id)
  
 
-# Load credentials
-twitch_username = "botvencabot"
-with open("credentials.json") as credentials_file:
-    credentials = json.loads(credentials_file.read())
-twitch_refresh_token = credentials["twitch_refresh_token"]
-startgg_access_token = credentials["startgg_access_token"]
-twitch_client_id = credentials["twitch_client_id"]
-twitch_client_secret = credentials["twitch_client_secret"]
-givebutter_api_key = credentials["givebutter_api_key"]
-twitch_oauth_manager = TwitchOauthManager(
-        twitch_client_id, twitch_client_secret, twitch_refresh_token)
-twitch_oauth_manager.refresh()
-
-# Givebutter stuff
-with open("processed_giving_space_ids.txt") as giving_space_ids_file:
-    giving_space_id_lines = giving_space_ids_file.readlines()
-processed_giving_space_ids = [int(x.strip()) for x in giving_space_id_lines]
-
-# Set up Twitch chat
-twitch_chat = IRCClient()
-twitch_chat.connect("irc.chat.twitch.tv")
-
-# Set up listeners
-twitch_chat_listener = irc_client_listener.IRCClientListener(twitch_chat)
-givebutter_listener = GivebutterListener(
-        givebutter_api_key, processed_giving_space_ids)
-
-# Set up handlers
-twitch_chat_command_handler = TwitchChatCommandHandler(
-        twitch_chat, CURRENT_CHANNELS_PATH, EVENT_PROMO_OPTOUTS_PATH,
-        startgg_access_token)
-leave_if_not_modded_handler = LeaveIfNotModdedHandler(
-        twitch_chat, CURRENT_CHANNELS_PATH)
-pong_if_pinged_handler = PongIfPingedHandler(twitch_chat)
-twitch_chat_login_failed_handler = TwitchChatLoginFailedHandler(
-        twitch_chat, twitch_oauth_manager)
-report_timeout_handler = ReportTimeoutHandler()
-givebutter_donation_handler = GivebutterDonationHandler(
-        twitch_oauth_manager, twitch_chat, "processed_giving_space_ids.txt")
-
-# Create StreamBrain
-jazzycircuitbot_brain = StreamBrain()
-jazzycircuitbot_brain.activate_handler(twitch_chat_command_handler)
-jazzycircuitbot_brain.activate_handler(leave_if_not_modded_handler)
-jazzycircuitbot_brain.activate_handler(pong_if_pinged_handler)
-jazzycircuitbot_brain.activate_handler(twitch_chat_login_failed_handler)
-jazzycircuitbot_brain.activate_handler(report_timeout_handler)
-jazzycircuitbot_brain.activate_handler(givebutter_donation_handler)
-
-# Login to Twitch chat
-twitch_password = f"oauth:{twitch_oauth_manager.access_token}"
-twitch_chat.login(twitch_password, twitch_username, None)
-twitch_chat.request_capability("twitch.tv/tags")
-twitch_chat.request_capability("twitch.tv/membership")
-twitch_chat.request_capability("twitch.tv/commands")
-with open(CURRENT_CHANNELS_PATH) as current_channels_file:
-    raw_channel_lines = current_channels_file.readlines()
-for raw_channel_line in raw_channel_lines:
-    twitch_chat.join(raw_channel_line.strip())
-
-# Main loop
-jazzycircuitbot_brain.start_listening(twitch_chat_listener)
-jazzycircuitbot_brain.start_listening(givebutter_listener)
-routine_schedule = Schedule()
-promo_routine = JazzyEventPromoRoutine(
-        startgg_access_token, twitch_oauth_manager, twitch_chat, 1800)
-routine_schedule.routines.append(promo_routine)
-schedule_thread = threading.Thread(
-        target=routine_schedule.increment_loop, args=(1,))
-schedule_thread.start()
-input()
-jazzycircuitbot_brain.stop()
-routine_schedule.stop()
-
-# We should also save our new Twitch Refresh Token.
+def create_twitch_chat(
+        rate_limit_profile: IRCRateLimitProfile=TWITCH_RATE_LIMIT_PROFILE,
+        privmsg_prefilter: Optional[
+                irc_client_listener.PrivateMessagePrefilter]=None
+        ) -> Tuple[IRCReactor, IRCClientPool]:
+    # Channels are spread over several connections; the pool stands in
+    # for a single IRCClient everywhere, and one reactor thread reads and
+    # writes for all of its connections. Chat that isn't a command only
+    # gets past 'privmsg_prefilter' if no handler needs to see it.
+    irc_reactor = IRCReactor(privmsg_prefilter)
+    twitch_chat = IRCClientPool(
+            CHANNELS_PER_CONNECTION, IRCClient, irc_reactor,
+            rate_limit_profile)
+    return irc_reactor, twitch_chat
+
+
+def create_brain(
+        streambrain_metrics: StreamBrainMetrics,
+        event_journal: Optional[EventJournalWriter]=None) -> StreamBrain:
+    # Chat from different channels is handled in parallel; replies within
+    # a channel stay in order.
+    jazzycircuitbot_brain = StreamBrain(
+            dispatcher_count=CHAT_DISPATCHER_COUNT,
+            metrics=streambrain_metrics, journal=event_journal,
+            partition_key=streambrain.event_partition_key)
+    # The reactor thread queues every IRC event and must never wait on
+    # a full lane, or every connection's reads and PONGs stall with it.
+    # Under sustained overload, membership and state updates shed the
+    # oldest queued event, repeated chat lines merge, and timeout
+    # notices are dropped outright.
+    jazzycircuitbot_brain.set_overflow_policy(
+            irc_client_listener.IRCClientMessageEvent,
+            streambrain.OVERFLOW_DROP_OLDEST)
+    jazzycircuitbot_brain.set_overflow_policy(
+            irc_client_listener.IRCClientPrivateMessageEvent,
+            streambrain.OVERFLOW_COALESCE)
+    jazzycircuitbot_brain.set_overflow_policy(
+            irc_client_listener.IRCClientTimeoutEvent,
+            streambrain.OVERFLOW_DROP_NEWEST)
+    return jazzycircuitbot_brain
+
+
+def activate_chat_handlers(
+        jazzycircuitbot_brain: StreamBrain, twitch_chat: IRCClientPool,
+        twitch_oauth_manager: TwitchOauthManager,
+        startgg_access_token: str, bot_state: BotStateStore,
+        command_cooldowns: bool=True) -> TwitchChatCommandHandler:
+    twitch_chat_command_handler = TwitchChatCommandHandler(
+            twitch_chat, bot_state, startgg_access_token, command_cooldowns)
+    leave_if_not_modded_handler = LeaveIfNotModdedHandler(
+            twitch_chat, bot_state)
+    confirm_join_handler = ConfirmJoinHandler(twitch_chat)
+    twitch_chat_login_failed_handler = TwitchChatLoginFailedHandler(
+            twitch_chat, twitch_oauth_manager)
+    report_timeout_handler = ReportTimeoutHandler()
+    jazzycircuitbot_brain.activate_handler(twitch_chat_command_handler)
+    jazzycircuitbot_brain.activate_handler(leave_if_not_modded_handler)
+    jazzycircuitbot_brain.activate_handler(confirm_join_handler)
+    jazzycircuitbot_brain.activate_handler(twitch_chat_login_failed_handler)
+    jazzycircuitbot_brain.activate_handler(report_timeout_handler)
+    return twitch_chat_command_handler
+
+
+def log_in_to_twitch_chat(
+        twitch_chat: IRCClientPool, twitch_password: str,
+        twitch_username: str, channel_names: Iterable[str],
+        host_name: str="irc.chat.twitch.tv",
+        host_port: int=6667) -> JoinProgress:
+    twitch_chat.connect(host_name, host_port)
+    twitch_chat.login(twitch_password, twitch_username, None)
+    twitch_chat.request_capability("twitch.tv/tags")
+    twitch_chat.request_capability("twitch.tv/membership")
+    twitch_chat.request_capability("twitch.tv/commands")
+    return twitch_chat.join_many(channel_names)
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument(
+            "--record-journal", metavar="PATH",
+            help="append every incoming event to a replayable journal")
+    arguments = argument_parser.parse_args()
+
+    # Load credentials
+    twitch_username = "botvencabot"
+    with open("credentials.json") as credentials_file:
+        credentials = json.loads(credentials_file.read())
+    twitch_refresh_token = credentials["twitch_refresh_token"]
+    startgg_access_token = credentials["startgg_access_token"]
+    twitch_client_id = credentials["twitch_client_id"]
+    twitch_client_secret = credentials["twitch_client_secret"]
+    givebutter_api_key = credentials["givebutter_api_key"]
+    twitch_oauth_manager = TwitchOauthManager(
+            twitch_client_id, twitch_client_secret, twitch_refresh_token)
+    twitch_oauth_manager.refresh()
+
+    # Load bot state
+    bot_state = BotStateStore(BOT_STATE_PATH)
+    bot_state.migrate_text_files(
+            CURRENT_CHANNELS_PATH, EVENT_PROMO_OPTOUTS_PATH,
+            PROCESSED_GIVING_SPACE_IDS_PATH)
+
+    # Set up Twitch chat. Only chat commands are handled, so ordinary
+    # chat is dropped before it becomes an event, except while recording
+    # a journal: events are recorded as they're queued, and a replay
+    # should see all of the chat.
+    if arguments.record_journal:
+        privmsg_prefilter = None
+    else:
+        privmsg_prefilter = irc_client_listener.PrivateMessagePrefilter()
+    irc_reactor, twitch_chat = create_twitch_chat(
+            privmsg_prefilter=privmsg_prefilter)
+
+    # Set up listeners
+    givebutter_listener = GivebutterListener(
+            givebutter_api_key, bot_state.processed_giving_space_ids)
+
+    # Create StreamBrain and set up handlers
+    streambrain_metrics = StreamBrainMetrics()
+    if arguments.record_journal:
+        event_journal = EventJournalWriter(arguments.record_journal)
+    else:
+        event_journal = None
+    jazzycircuitbot_brain = create_brain(streambrain_metrics, event_journal)
+    if privmsg_prefilter is not None:
+        privmsg_prefilter.register_metrics(streambrain_metrics)
+    twitch_chat_command_handler = activate_chat_handlers(
+            jazzycircuitbot_brain, twitch_chat, twitch_oauth_manager,
+            startgg_access_token, bot_state)
+    givebutter_donation_handler = GivebutterDonationHandler(
+            twitch_oauth_manager, twitch_chat, bot_state)
+    jazzycircuitbot_brain.activate_handler(givebutter_donation_handler)
+
+    # Login to Twitch chat
+    twitch_password = f"oauth:{twitch_oauth_manager.access_token}"
+    log_in_to_twitch_chat(
+            twitch_chat, twitch_password, twitch_username,
+            bot_state.channels)
+
+    # Main loop
+    metrics_server = start_metrics_server(streambrain_metrics, METRICS_PORT)
+    irc_reactor.start(jazzycircuitbot_brain.queue_event)
+    jazzycircuitbot_brain.start_listening(givebutter_listener)
+    routine_schedule = Schedule()
+    promo_routine = JazzyEventPromoRoutine(
+            startgg_access_token, twitch_oauth_manager, twitch_chat,
+            bot_state, 1800)
+    routine_schedule.routines.append(promo_routine)
+    schedule_thread = threading.Thread(
+            target=routine_schedule.increment_loop, args=(1,))
+    schedule_thread.start()
+    input()
+    irc_reactor.stop()
+    jazzycircuitbot_brain.stop()
+    twitch_chat_command_handler.stop()
+    routine_schedule.stop()
+    metrics_server.shutdown()
+    bot_state.close()
+    if event_journal is not None:
+        event_journal.close()
+
+    # We should also save our new Twitch Refresh Token.
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import asyncio
+import concurrent.futures
+import time
+import traceback
+import typing
+
+from .streambrain import (
+        DEFAULT_LANE_LATENCY_BUDGETS_SEC, Event, Handler, LaneLatency,
+        Listener, SubscriptionIndex)
+
+
+class AsyncListener:
+    def __init__(self, sleep_sec: float) -> None:
+        self.sleep_sec = sleep_sec
+
+    async def listen(self) -> typing.List[Event]:
+        return []
+
+
+class AsyncHandler(Handler):
+    async def handle(self, streambrain_event: Event) -> None:
+        pass
+
+
+class ExecutorListener(AsyncListener):
+    # Runs a blocking Listener's listen() in a thread-pool executor so it
+    # can share the AsyncStreamBrain event loop.
+    def __init__(
+            self, listener: Listener,
+            executor: concurrent.futures.Executor) -> None:
+        self.listener = listener
+        self._executor = executor
+        super().__init__(listener.sleep_sec)
+
+    async def listen(self) -> typing.List[Event]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+                self._executor, self.listener.listen)
+
+
+class ExecutorHandler(AsyncHandler):
+    # Runs a blocking Handler's handle() in a thread-pool executor. The
+    # wrapped handler's subscription, filters and priority carry over.
+    def __init__(
+            self, handler: Handler,
+            executor: concurrent.futures.Executor) -> None:
+        self.handler = handler
+        self._executor = executor
+        super().__init__(handler.handles_type, priority=handler.priority)
+
+    def accepts(self, streambrain_event: Event) -> bool:
+        return self.handler.accepts(streambrain_event)
+
+    async def handle(self, streambrain_event: Event) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+                self._executor, self.handler.handle, streambrain_event)
+
+
+class AsyncStreamBrain:
+    def __init__(
+            self, max_queue_size: int=1024, executor_workers: int=4,
+            lane_latency_budgets_sec: typing.Optional[
+                    typing.Dict[int, typing.Optional[float]]]=None,
+            metrics: typing.Optional[object]=None) -> None:
+        # The asyncio counterpart of StreamBrain: one event loop runs
+        # every listener and one dispatcher task per priority lane.
+        # Sync Listeners and Handlers are adapted onto a shared
+        # thread-pool executor.
+        if lane_latency_budgets_sec is None:
+            lane_latency_budgets_sec = DEFAULT_LANE_LATENCY_BUDGETS_SEC
+        self._subscription_index = SubscriptionIndex()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+                executor_workers)
+        self._lane_queues = {
+                priority: asyncio.Queue(max_queue_size)
+                for priority in lane_latency_budgets_sec}
+        self._lane_latencies = {
+                priority: LaneLatency(budget_sec)
+                for priority, budget_sec in lane_latency_budgets_sec.items()}
+        if metrics is not None:
+            for priority, lane_queue in self._lane_queues.items():
+                metrics.queue_depth.set_source(str(priority), lane_queue.qsize)
+        self.metrics = metrics
+        self._dispatch_tasks = []
+        self._listen_tasks = []
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(x.qsize() for x in self._lane_queues.values())
+
+    def lane_latencies(self) -> typing.Dict[int, typing.Dict[str, float]]:
+        return {
+                priority: latency.snapshot()
+                for priority, latency in self._lane_latencies.items()}
+
+    def activate_handler(
+            self, handler: typing.Union[AsyncHandler, Handler]) -> None:
+        if handler.priority not in self._lane_queues:
+            raise ValueError(f"No StreamBrain lane for {handler.priority}.")
+        if not isinstance(handler, AsyncHandler):
+            handler = ExecutorHandler(handler, self._executor)
+        self._subscription_index.add(handler)
+
+    def start_listening(
+            self,
+            listener: typing.Union[AsyncListener, Listener]) -> asyncio.Task:
+        # Must be called from inside the running event loop.
+        self.start_dispatching()
+        if not isinstance(listener, AsyncListener):
+            listener = ExecutorListener(listener, self._executor)
+        listen_task = asyncio.create_task(self._listen_loop(listener))
+        self._listen_tasks.append(listen_task)
+        return listen_task
+
+    def start_dispatching(self) -> None:
+        if self._dispatch_tasks:
+            return
+        for priority, lane_queue in self._lane_queues.items():
+            self._dispatch_tasks.append(asyncio.create_task(
+                    self._dispatch_loop(priority, lane_queue)))
+
+    async def stop(self) -> None:
+        tasks = self._listen_tasks + self._dispatch_tasks
+        self._listen_tasks = []
+        self._dispatch_tasks = []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    async def queue_event(self, streambrain_event: Event) -> None:
+        loop = asyncio.get_running_loop()
+        handler_groups = self._subscription_index.handler_groups_for(
+                type(streambrain_event))
+        for priority, handlers in handler_groups:
+            await self._lane_queues[priority].put(
+                    (streambrain_event, handlers, loop.time()))
+
+    async def _listen_loop(self, listener: AsyncListener) -> None:
+        while True:
+            listen_started_at = time.perf_counter()
+            try:
+                events = await listener.listen()
+            except Exception:
+                # diagnostic
+                print(f"{type(listener).__name__} failed to listen:")
+                traceback.print_exc()
+                events = []
+            if self.metrics is not None:
+                self.metrics.observe_listen(
+                        getattr(listener, "listener", listener),
+                        time.perf_counter() - listen_started_at, len(events))
+            for streambrain_event in events:
+                await self.queue_event(streambrain_event)
+            await asyncio.sleep(listener.sleep_sec)
+
+    async def _dispatch_loop(
+            self, priority: int, lane_queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        latency = self._lane_latencies[priority]
+        while True:
+            streambrain_event, handlers, queued_at = await lane_queue.get()
+            delay_sec = loop.time() - queued_at
+            latency.observe(delay_sec)
+            metrics = self.metrics
+            if metrics is not None:
+                metrics.observe_queue_delay(
+                        type(streambrain_event), delay_sec)
+            for handler in handlers:
+                if not handler.accepts(streambrain_event):
+                    continue
+                handle_started_at = time.perf_counter()
+                try:
+                    await handler.handle(streambrain_event)
+                except Exception:
+                    # diagnostic
+                    print(
+                            f"{type(handler).__name__} failed on "
+                            f"{type(streambrain_event).__name__}:")
+                    traceback.print_exc()
+                if metrics is not None:
+                    metrics.observe_handler(
+                            getattr(handler, "handler", handler),
+                            time.perf_counter() - handle_started_at)
@@ -0,0 +1,266 @@
+import sqlite3
+import threading
+import time
+
+from typing import Iterable, List, Optional, Set
+
+
+DEFAULT_GROUP_COMMIT_SEC = .05
+# A transaction that fails is retried this many times in all, this long
+# apart, before its writes are given up; see BotStateCommitError.
+MAX_COMMIT_ATTEMPTS = 3
+COMMIT_RETRY_SEC = 1
+
+SCHEMA_STATEMENTS = (
+        "CREATE TABLE IF NOT EXISTS channels ("
+        "name TEXT PRIMARY KEY, position INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS promo_optouts (channel TEXT PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS processed_giving_spaces ("
+        "giving_space_id INTEGER PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS store_metadata ("
+        "key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+
+class BotStateCommitError(Exception):
+    # Raised by flush and close when queued writes were given up on.
+    pass
+
+
+class BotStateStore:
+    # The bot's persistent state in one SQLite database in WAL mode: the
+    # channels it sits in, in the order they were joined, the channels
+    # that opted out of event promos and the Givebutter giving spaces
+    # already thanked. Reads are served from in-memory views. Writes
+    # update the views at once and are queued for a writer thread, which
+    # commits everything queued in the last 'group_commit_sec' as one
+    # transaction.
+    def __init__(
+            self, database_path: str,
+            group_commit_sec: float=DEFAULT_GROUP_COMMIT_SEC) -> None:
+        self.database_path = database_path
+        self.group_commit_sec = group_commit_sec
+        # Only the writer thread uses the connection once it's started.
+        self._connection = sqlite3.connect(
+                database_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            for statement in SCHEMA_STATEMENTS:
+                self._connection.execute(statement)
+        self._channels = dict(self._connection.execute(
+                "SELECT name, position FROM channels ORDER BY position"))
+        self._next_channel_position = max(
+                self._channels.values(), default=0)
+        self._promo_optouts = {
+                x for x, in self._connection.execute(
+                        "SELECT channel FROM promo_optouts")}
+        self._processed_giving_space_ids = {
+                x for x, in self._connection.execute(
+                        "SELECT giving_space_id "
+                        "FROM processed_giving_spaces")}
+        self._is_migrated = self._connection.execute(
+                "SELECT 1 FROM store_metadata "
+                "WHERE key = 'migrated_text_files'").fetchone() is not None
+        self._pending_writes = []
+        # Writes committed or given up on; see _write_loop.
+        self._settled_write_count = 0
+        self._commit_error = None
+        self._queued_write_count = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._is_open = True
+        self._is_flush_requested = False
+        self._writer_thread = threading.Thread(
+                target=self._write_loop, daemon=True)
+        self._writer_thread.start()
+
+    def migrate_text_files(
+            self, channels_path: Optional[str]=None,
+            promo_optouts_path: Optional[str]=None,
+            processed_giving_spaces_path: Optional[str]=None) -> bool:
+        # Imports the text files the bot used to keep its state in, once.
+        # Missing files are skipped; the files themselves are left alone.
+        # Returns whether anything was migrated.
+        if self._is_migrated:
+            return False
+        self._is_migrated = True
+        for channel_name in _read_words(channels_path):
+            self.add_channel(channel_name)
+        for channel_name in _read_words(promo_optouts_path):
+            self.add_promo_optout(channel_name)
+        for giving_space_id in _read_words(processed_giving_spaces_path):
+            self.add_processed_giving_space(int(giving_space_id))
+        self._queue_write(
+                "INSERT OR REPLACE INTO store_metadata (key, value) "
+                "VALUES ('migrated_text_files', '1')", ())
+        self.flush()
+        # diagnostic
+        print(f"Migrated bot state text files into {self.database_path}.")
+        return True
+
+    @property
+    def channels(self) -> List[str]:
+        with self._lock:
+            return list(self._channels)
+
+    def add_channel(self, channel_name: str) -> bool:
+        with self._lock:
+            if channel_name in self._channels:
+                return False
+            self._next_channel_position += 1
+            self._channels[channel_name] = self._next_channel_position
+            self._queue_write_locked(
+                    "INSERT OR REPLACE INTO channels (name, position) "
+                    "VALUES (?, ?)",
+                    (channel_name, self._next_channel_position))
+        return True
+
+    def remove_channel(self, channel_name: str) -> bool:
+        with self._lock:
+            if self._channels.pop(channel_name, None) is None:
+                return False
+            self._queue_write_locked(
+                    "DELETE FROM channels WHERE name = ?", (channel_name,))
+        return True
+
+    @property
+    def promo_optouts(self) -> Set[str]:
+        with self._lock:
+            return self._promo_optouts.copy()
+
+    def is_promo_optout(self, channel_name: str) -> bool:
+        return channel_name in self._promo_optouts
+
+    def add_promo_optout(self, channel_name: str) -> bool:
+        with self._lock:
+            if channel_name in self._promo_optouts:
+                return False
+            self._promo_optouts.add(channel_name)
+            self._queue_write_locked(
+                    "INSERT OR IGNORE INTO promo_optouts (channel) "
+                    "VALUES (?)", (channel_name,))
+        return True
+
+    def remove_promo_optout(self, channel_name: str) -> bool:
+        with self._lock:
+            if channel_name not in self._promo_optouts:
+                return False
+            self._promo_optouts.remove(channel_name)
+            self._queue_write_locked(
+                    "DELETE FROM promo_optouts WHERE channel = ?",
+                    (channel_name,))
+        return True
+
+    @property
+    def processed_giving_space_ids(self) -> Set[int]:
+        with self._lock:
+            return self._processed_giving_space_ids.copy()
+
+    def add_processed_giving_space(self, giving_space_id: int) -> bool:
+        with self._lock:
+            if giving_space_id in self._processed_giving_space_ids:
+                return False
+            self._processed_giving_space_ids.add(giving_space_id)
+            self._queue_write_locked(
+                    "INSERT OR IGNORE INTO processed_giving_spaces "
+                    "(giving_space_id) VALUES (?)", (giving_space_id,))
+        return True
+
+    def flush(self) -> None:
+        # Blocks until every write queued so far is committed or given
+        # up on, and raises BotStateCommitError if any was given up on
+        # since the last flush.
+        with self._condition:
+            target_count = self._queued_write_count
+            self._is_flush_requested = True
+            self._condition.notify_all()
+            while (
+                    self._settled_write_count < target_count
+                    and self._writer_thread.is_alive()):
+                self._condition.wait(.1)
+            commit_error = self._commit_error
+            self._commit_error = None
+        if commit_error is not None:
+            raise BotStateCommitError(
+                    f"Bot state writes were lost: {commit_error!r}") \
+                    from commit_error
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._is_open = False
+                self._condition.notify_all()
+            self._writer_thread.join()
+            self._connection.close()
+
+    def _queue_write(self, statement: str, parameters: tuple) -> None:
+        with self._lock:
+            self._queue_write_locked(statement, parameters)
+
+    def _queue_write_locked(self, statement: str, parameters: tuple) -> None:
+        self._pending_writes.append((statement, parameters))
+        self._queued_write_count += 1
+        self._condition.notify_all()
+
+    def _write_loop(self) -> None:
+        failed_attempt_count = 0
+        while True:
+            with self._condition:
+                while self._is_open and not self._pending_writes:
+                    self._condition.wait()
+                if not self._pending_writes:
+                    return
+            # Let more writes join this transaction, unless someone is
+            # waiting on it.
+            commit_at = time.monotonic() + self.group_commit_sec
+            with self._condition:
+                while self._is_open and not self._is_flush_requested:
+                    wait_sec = commit_at - time.monotonic()
+                    if wait_sec <= 0:
+                        break
+                    self._condition.wait(wait_sec)
+                self._is_flush_requested = False
+                writes = self._pending_writes
+                self._pending_writes = []
+            try:
+                with self._connection:
+                    for statement, parameters in writes:
+                        self._connection.execute(statement, parameters)
+            except sqlite3.Error as e:
+                failed_attempt_count += 1
+                with self._condition:
+                    if (
+                            self._is_open
+                            and failed_attempt_count < MAX_COMMIT_ATTEMPTS):
+                        # diagnostic
+                        print(
+                                f"Failed to commit {len(writes)} bot state "
+                                f"writes, retrying: {e!r}")
+                        self._pending_writes[:0] = writes
+                        self._condition.wait(COMMIT_RETRY_SEC)
+                        continue
+                    # diagnostic
+                    print(
+                            f"Gave up on {len(writes)} bot state writes: "
+                            f"{e!r}")
+                    self._commit_error = e
+                    self._settled_write_count += len(writes)
+                    self._condition.notify_all()
+                failed_attempt_count = 0
+                continue
+            failed_attempt_count = 0
+            with self._condition:
+                self._settled_write_count += len(writes)
+                self._condition.notify_all()
+
+
+def _read_words(path: Optional[str]) -> Iterable[str]:
+    if path is None:
+        return []
+    try:
+        with open(path) as state_file:
+            return state_file.read().split()
+    except FileNotFoundError:
+        return []
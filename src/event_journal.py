@@ -0,0 +1,199 @@
+import dataclasses
+import json
+import struct
+import threading
+import time
+
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from src.givebutter import GivingSpace, Transaction
+from src.givebutter_listeners import GivebutterDonationEvent
+from src.irc_client import IRCClient, IRCMessage, JoinProgress
+from src.irc_client_listener import (
+        IRC_COMMAND_EVENT_MAP, IRCClientMessageEvent, IRCClientTimeoutEvent)
+from src.streambrain import Event, Listener
+
+
+# A journal is JOURNAL_MAGIC followed by records. Each record is a
+# RECORD_HEADER (kind, time.monotonic_ns() when recorded, payload size)
+# and its payload. A session record starts every recording run, so
+# replay never waits across the gap between two runs.
+JOURNAL_MAGIC = b"SBJ1"
+RECORD_HEADER = struct.Struct("<BQI")
+RECORD_KIND_SESSION = 0
+RECORD_KIND_IRC_MESSAGE = 1
+RECORD_KIND_IRC_TIMEOUT = 2
+RECORD_KIND_GIVEBUTTER_DONATION = 3
+# Unpaced replay hands events over in batches of this size.
+REPLAY_BATCH_SIZE = 256
+
+
+class EventJournalFormatError(Exception):
+    pass
+
+
+def _encode_event(streambrain_event: Event) -> Optional[Tuple[int, bytes]]:
+    if isinstance(streambrain_event, IRCClientMessageEvent):
+        return (
+                RECORD_KIND_IRC_MESSAGE,
+                streambrain_event.irc_message.raw.encode("utf-8"))
+    if isinstance(streambrain_event, IRCClientTimeoutEvent):
+        return RECORD_KIND_IRC_TIMEOUT, b""
+    if isinstance(streambrain_event, GivebutterDonationEvent):
+        transaction_dict = dataclasses.asdict(streambrain_event.message)
+        return (
+                RECORD_KIND_GIVEBUTTER_DONATION,
+                json.dumps(transaction_dict, separators=(",", ":")).encode())
+    return None
+
+
+def _decode_event(
+        record_kind: int, payload: bytes,
+        irc_client: IRCClient) -> Optional[Event]:
+    if record_kind == RECORD_KIND_IRC_MESSAGE:
+        irc_message = IRCMessage(payload.decode("utf-8"))
+        event_type = IRC_COMMAND_EVENT_MAP.get(irc_message.command)
+        if event_type is None:
+            return None
+        return event_type(irc_client, irc_message)
+    if record_kind == RECORD_KIND_IRC_TIMEOUT:
+        return IRCClientTimeoutEvent(irc_client)
+    if record_kind == RECORD_KIND_GIVEBUTTER_DONATION:
+        transaction_dict = json.loads(payload)
+        giving_space = GivingSpace(**transaction_dict["giving_space"])
+        return GivebutterDonationEvent(
+                Transaction(transaction_dict["currency"], giving_space))
+    return None
+
+
+class EventJournalWriter:
+    def __init__(self, journal_path: str) -> None:
+        self._journal_file = open(journal_path, "ab")
+        self._lock = threading.Lock()
+        if self._journal_file.tell() == 0:
+            self._journal_file.write(JOURNAL_MAGIC)
+        self._write_record(RECORD_KIND_SESSION, b"")
+
+    def _write_record(self, record_kind: int, payload: bytes) -> None:
+        header = RECORD_HEADER.pack(
+                record_kind, time.monotonic_ns(), len(payload))
+        with self._lock:
+            self._journal_file.write(header + payload)
+
+    def record(self, streambrain_event: Event) -> None:
+        encoded = _encode_event(streambrain_event)
+        if encoded is not None:
+            self._write_record(*encoded)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._journal_file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._journal_file.close()
+
+
+def read_journal_records(
+        journal_file: BinaryIO) -> Iterator[Tuple[int, int, bytes]]:
+    if journal_file.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+        raise EventJournalFormatError("Not a StreamBrain event journal.")
+    while True:
+        header = journal_file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            # A truncated tail is what a crash mid-write leaves behind.
+            return
+        record_kind, recorded_ns, payload_size = RECORD_HEADER.unpack(header)
+        payload = journal_file.read(payload_size)
+        if len(payload) < payload_size:
+            return
+        yield record_kind, recorded_ns, payload
+
+
+class ReplayIRCClient(IRCClient):
+    # Stands in for a connected IRCClient during replay. Outgoing
+    # commands are kept in 'sent_lines' instead of hitting the network.
+    def __init__(self, channels: Optional[List[str]]=None) -> None:
+        super().__init__()
+        self.channels = list(channels or [])
+        self.sent_lines = []
+
+    def join(self, channel_name: str) -> None:
+        self.sent_lines.append(f"JOIN #{channel_name}")
+        if channel_name not in self.channels:
+            self.channels.append(channel_name)
+
+    def join_many(
+            self, channel_names: Iterable[str],
+            join_progress: Optional[JoinProgress]=None) -> JoinProgress:
+        channel_names = list(channel_names)
+        for channel_name in channel_names:
+            self.join(channel_name)
+        if join_progress is None:
+            join_progress = JoinProgress(channel_names)
+        return join_progress
+
+    def part(self, channel_name: str) -> None:
+        self.sent_lines.append(f"PART #{channel_name}")
+        try:
+            self.channels.remove(channel_name)
+        except ValueError:
+            pass
+
+    def pong(self, parameters: List[str]) -> None:
+        self.sent_lines.append(f"PONG {' '.join(parameters)}")
+
+    def private_message(self, channel_name: str, message_str: str) -> None:
+        self.sent_lines.append(f"PRIVMSG #{channel_name} :{message_str}")
+
+
+class JournalReplayListener(Listener):
+    def __init__(
+            self, journal_path: str, irc_client: IRCClient,
+            speed: Optional[float]=1.0, sleep_sec: float=.001) -> None:
+        # 'speed' scales the recorded gaps between events: 1.0 replays
+        # in real time, 10.0 ten times faster, and None as fast as the
+        # brain will take them.
+        self._journal_file = open(journal_path, "rb")
+        self._records = read_journal_records(self._journal_file)
+        self._irc_client = irc_client
+        self._speed = speed
+        self._next_record = None
+        self._session_recorded_ns = None
+        self._session_replayed_ns = None
+        self.replayed_count = 0
+        self.is_finished = False
+        super().__init__(sleep_sec)
+
+    def _due_ns(self, recorded_ns: int) -> int:
+        recorded_gap_ns = recorded_ns - self._session_recorded_ns
+        return self._session_replayed_ns + int(recorded_gap_ns / self._speed)
+
+    def listen(self) -> List[Event]:
+        events = []
+        while not self.is_finished:
+            if self._next_record is None:
+                try:
+                    self._next_record = next(self._records)
+                except StopIteration:
+                    self.is_finished = True
+                    self._journal_file.close()
+                    break
+            record_kind, recorded_ns, payload = self._next_record
+            now_ns = time.monotonic_ns()
+            if record_kind == RECORD_KIND_SESSION \
+                    or self._session_recorded_ns is None:
+                self._session_recorded_ns = recorded_ns
+                self._session_replayed_ns = now_ns
+            elif self._speed is not None \
+                    and self._due_ns(recorded_ns) > now_ns:
+                break
+            self._next_record = None
+            streambrain_event = _decode_event(
+                    record_kind, payload, self._irc_client)
+            if streambrain_event is not None:
+                events.append(streambrain_event)
+                self.replayed_count += 1
+            if self._speed is None and len(events) >= REPLAY_BATCH_SIZE:
+                break
+        return events
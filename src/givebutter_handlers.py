@@ -1,10 +1,11 @@
 from typing import List
 
+from src.bot_state_store import BotStateStore
 from src.givebutter import Transaction
 from src.givebutter_listeners import GivebutterDonationEvent
 from src.irc_client import IRCClient
 from src.safe_web_api_call import safe_web_api_call
-from src.streambrain import Handler
+from src.streambrain import PRIORITY_BACKGROUND, Handler
 from src.twitch import (
         TwitchHTTPError, TwitchStreamData, TwitchOauthManager, get_streams)
 
@@ -47,13 +48,12 @@ def build_thank_you_message(transaction: Transaction) -> str:
 class GivebutterDonationHandler(Handler):
     def __init__(
             self, twitch_oauth_manager: TwitchOauthManager,
-            irc_client: IRCClient,
-            processed_giving_space_ids_path: str) -> None:
+            irc_client: IRCClient, bot_state: BotStateStore) -> None:
         self._twitch_oauth_manager = twitch_oauth_manager
         self._irc_client = irc_client
-        self._processed_giving_space_ids_path = (
-                processed_giving_space_ids_path)
-        super().__init__(GivebutterDonationEvent)
+        self._bot_state = bot_state
+        super().__init__(
+                GivebutterDonationEvent, priority=PRIORITY_BACKGROUND)
 
     def handle(
             self,
@@ -63,7 +63,7 @@ class GivebutterDonationHandler(Handler):
         transaction = givebutter_donation_event.message
         self.send_thank_you_messages(transaction)
         giving_space_id = transaction.giving_space.giving_space_id
-        self.update_processed_giving_space_ids_file(giving_space_id)
+        self._bot_state.add_processed_giving_space(giving_space_id)
 
     def send_thank_you_messages(self, transaction):
         print("Checking if Twitch streams are online.")
@@ -73,7 +73,3 @@ class GivebutterDonationHandler(Handler):
         for stream in live_jazzybot_streams:
             self._irc_client.private_message(
                     stream.user_login, thank_you_message)
-
-    def update_processed_giving_space_ids_file(self, giving_space_id):
-        with open(self._processed_giving_space_ids_path, "a") as f:
-            f.write(f"{str(giving_space_id)}\n")
@@ -1,6 +1,6 @@
 import src.givebutter as givebutter
 
-from typing import List
+from typing import Iterable, List
 
 from src.safe_web_api_call import safe_web_api_call
 from src.streambrain import Event, Listener
@@ -12,16 +12,16 @@ def get_givebutter_transactions(
 
 
 class GivebutterDonationEvent(Event):
-    pass
+    __slots__ = ()
 
 
 class GivebutterListener(Listener):
     def __init__(
             self, givebutter_api_key: str,
-            processed_giving_space_ids: List[int],
+            processed_giving_space_ids: Iterable[int],
             sleep_sec: int = 10) -> None:
         self._givebutter_api_key = givebutter_api_key
-        self._processed_giving_space_ids = processed_giving_space_ids
+        self._processed_giving_space_ids = set(processed_giving_space_ids)
         super().__init__(sleep_sec)
 
     def listen(self) -> List[Event]:
@@ -33,5 +33,5 @@ class GivebutterListener(Listener):
             giving_space_id = transaction.giving_space.giving_space_id
             if giving_space_id not in self._processed_giving_space_ids:
                 new_donations.append(transaction)
-                self._processed_giving_space_ids.append(giving_space_id)
+                self._processed_giving_space_ids.add(giving_space_id)
         return [GivebutterDonationEvent(x) for x in new_donations]
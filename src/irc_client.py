@@ -1,18 +1,51 @@
-import re
+import collections
+import collections.abc
+import concurrent.futures
+import errno
+import itertools
 import socket
+import threading
 import time
 
-from typing import List, Optional
-
-
-IRC_MESSAGE_REGEX = re.compile(
-        "^(@(?P<tags>.*?) )?(:(?P<prefix>.*?) )?(?P<command>.*?)"
-        "( (?P<parameters>.*?))?$")
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.irc_client_writer import (
+        SEND_PRIORITY_MEMBERSHIP, SEND_PRIORITY_MESSAGE, SEND_PRIORITY_PONG,
+        SEND_PRIORITY_REGISTRATION, TWITCH_RATE_LIMIT_PROFILE,
+        IRCOutboundWriter, IRCRateLimitProfile, IRCRateLimits)
+
+
+# Values of these tags come from a small vocabulary and repeat on every
+# message, so one shared copy of each is kept, as it is for tag keys and
+# channel names. Per-user values such as 'color' or 'badge-info' would
+# only crowd the cache. The cache is bounded; past the limit, new strings
+# are simply not shared.
+INTERNED_TAG_VALUE_KEYS = frozenset((
+        "badges", "emote-only", "first-msg", "mod", "msg-id",
+        "returning-chatter", "subscriber", "turbo", "user-type", "vip"))
+MAX_INTERNED_STRINGS = 65536
+IRC_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+DEFAULT_RECEIVE_BUFFER_SIZE = 65536
+IRC_LINE_SEPARATOR = b"\r\n"
+MAX_IRC_LINE_BYTES = 512
+
+# The client PINGs the server on this interval and treats the connection
+# as dead once a PING goes unanswered for the timeout, which is far
+# sooner than TCP would notice.
+DEFAULT_PING_INTERVAL_SEC = 30
+DEFAULT_PING_TIMEOUT_SEC = 10
+RTT_WINDOW_SIZE = 256
+PING_TOKEN_PREFIX = "rtt-"
 
 DISCONNECTION_OSERROR_ERRNOS = {
         10053: "ConnectionAbortedError",
         10054: "ConnectionResetError",
-        10065: "A socket operation was attempted to an unreachable host."}
+        10065: "A socket operation was attempted to an unreachable host.",
+        errno.EPIPE: "BrokenPipeError",
+        errno.ECONNABORTED: "ConnectionAbortedError",
+        errno.ECONNRESET: "ConnectionResetError",
+        errno.ENOTCONN: "The socket was shut down as unresponsive."}
 
 
 class IRCClientAlreadyConnectedError(Exception):
@@ -95,6 +128,7 @@ def method_reconnect_and_retry(to_decorate: callable) -> callable:
     def decorated(self, *args, **kwargs):
         while True:
             error_message = _create_retry_error_message_for(self)
+            failed_connection = self._connection
             try:
                 return_value = to_decorate(self, *args, **kwargs)
             except IRCClientDisconnectedError:
@@ -102,47 +136,395 @@ def method_reconnect_and_retry(to_decorate: callable) -> callable:
                 print(error_message)
                 time.sleep(self.retry_seconds)
                 self.retry_seconds = self.retry_seconds * 2
-                self.disconnect()
-                self.connect(
-                        self.saved_host_name, self.saved_host_port,
-                        self.saved_timeout_seconds)
-                self.login(
-                        self.saved_password, self.saved_nickname,
-                        self.saved_username)
-                for capability_name in self.requested_capabilities:
-                    self.request_capability(capability_name)
-                for channel_name in self.channels:
-                    self.join(channel_name)
+                self.reconnect(failed_connection)
             else:
                 self.retry_seconds = self.default_retry_seconds
                 return return_value
     return decorated
 
 
+_interned_strings = {}
+_tag_needles = {}
+
+
+def _intern(string: str) -> str:
+    try:
+        return _interned_strings[string]
+    except KeyError:
+        if len(_interned_strings) < MAX_INTERNED_STRINGS:
+            _interned_strings[string] = string
+        return string
+
+
+def unescape_tag_value(escaped_value: str) -> str:
+    # IRCv3 message-tags escaping: '\:' is ';', '\s' is a space, and a
+    # backslash before any other character is dropped.
+    if "\\" not in escaped_value:
+        return escaped_value
+    unescaped_chars = []
+    chars = iter(escaped_value)
+    for char in chars:
+        if char == "\\":
+            escaped_char = next(chars, "")
+            unescaped_chars.append(
+                    IRC_TAG_ESCAPES.get(escaped_char, escaped_char))
+        else:
+            unescaped_chars.append(char)
+    return "".join(unescaped_chars)
+
+
+class IRCTags(collections.abc.Mapping):
+    # A read-only mapping view over the tag section of a raw line. No
+    # per-tag strings are built up front; a lookup searches the raw line
+    # for the key and unescapes just that value. Values of the keys in
+    # INTERNED_TAG_VALUE_KEYS are shared between messages.
+    __slots__ = ("_raw", "_start", "_end")
+
+    def __init__(
+            self, raw: str, start: int=0, end: Optional[int]=None) -> None:
+        self._raw = raw
+        self._start = start
+        self._end = len(raw) if end is None else end
+
+    def __getitem__(self, tag_key: str) -> str:
+        value_start = self._find_value_start(tag_key)
+        if value_start < 0:
+            raise KeyError(tag_key)
+        value_end = self._raw.find(";", value_start, self._end)
+        if value_end < 0:
+            value_end = self._end
+        tag_value = self._raw[value_start:value_end]
+        if "\\" in tag_value:
+            tag_value = unescape_tag_value(tag_value)
+        if tag_key in INTERNED_TAG_VALUE_KEYS:
+            tag_value = _intern(tag_value)
+        return tag_value
+
+    def __contains__(self, tag_key: object) -> bool:
+        return isinstance(tag_key, str) \
+                and self._find_value_start(tag_key) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        if self._start >= self._end:
+            return iter(())
+        return iter([
+                _intern(tag.partition("=")[0])
+                for tag in self._raw[self._start:self._end].split(";")])
+
+    def __len__(self) -> int:
+        if self._start >= self._end:
+            return 0
+        return self._raw.count(";", self._start, self._end) + 1
+
+    def __repr__(self) -> str:
+        return f"IRCTags({dict(self)!r})"
+
+    def _find_value_start(self, tag_key: str) -> int:
+        # Any tag but the first is found by searching for ';key='. The
+        # first tag, and tags without a value, need a closer look.
+        try:
+            needle = _tag_needles[tag_key]
+        except KeyError:
+            needle = _tag_needles.setdefault(tag_key, f";{tag_key}=")
+        index = self._raw.find(needle, self._start, self._end)
+        if index >= 0:
+            return index + len(needle)
+        return self._find_value_start_slowly(tag_key)
+
+    def _find_value_start_slowly(self, tag_key: str) -> int:
+        # A key matches at the start of the tags or right after a ';',
+        # followed by '=' or by the end of that tag.
+        raw = self._raw
+        start = self._start
+        end = self._end
+        key_end = start + len(tag_key)
+        if raw.startswith(tag_key, start, end) \
+                and (key_end == end or raw[key_end] in "=;"):
+            return _tag_value_start(raw, key_end, end)
+        needle = f";{tag_key}"
+        index = raw.find(needle, start, end)
+        while index >= 0:
+            key_end = index + len(needle)
+            if key_end == end or raw[key_end] in "=;":
+                return _tag_value_start(raw, key_end, end)
+            index = raw.find(needle, key_end, end)
+        return -1
+
+
+def _tag_value_start(raw: str, key_end: int, end: int) -> int:
+    # A tag without '=' has an empty value.
+    if key_end < end and raw[key_end] == "=":
+        return key_end + 1
+    return key_end
+
+
 class IRCMessage:
+    # Parsing is index-based and lazy: the constructor only finds the
+    # command and where the tags, prefix and parameters start. Each of
+    # those is materialized the first time it is read, so lines that are
+    # dropped by command are never split any further.
+    __slots__ = (
+            "raw", "command", "_tags_end", "_prefix_start", "_prefix_end",
+            "_parameters_start", "_tags", "_parameters")
+
     def __init__(self, raw_message: str) -> None:
-        match = IRC_MESSAGE_REGEX.fullmatch(raw_message)
-        self.command = match.group("command")
-        self.tags = {}
-        if match.group("tags"):
-            for tag in match.group("tags").split(";"):
-                tag_key, tag_value = tag.split("=", 1)
-                self.tags[tag_key] = tag_value
-        self.prefix = match.group("prefix")
-        if match.group("parameters"):
-            param_colon_split = match.group("parameters").split(":")
-            self.parameters = param_colon_split[0].split()
-            if len(param_colon_split) > 1:
-                self.parameters.append(":".join(param_colon_split[1:]))
+        self.raw = raw_message
+        self._tags = None
+        self._parameters = None
+        index = 0
+        if raw_message.startswith("@"):
+            index = _find_space_or_end(raw_message, 1)
+            self._tags_end = index
+            index = _skip_spaces(raw_message, index)
+        else:
+            self._tags_end = 0
+        if raw_message.startswith(":", index):
+            self._prefix_start = index + 1
+            index = _find_space_or_end(raw_message, index)
+            self._prefix_end = index
+            index = _skip_spaces(raw_message, index)
         else:
-            self.parameters = []
+            self._prefix_start = None
+            self._prefix_end = None
+        command_end = _find_space_or_end(raw_message, index)
+        self.command = raw_message[index:command_end]
+        self._parameters_start = command_end
+
+    @property
+    def tags(self) -> IRCTags:
+        if self._tags is None:
+            self._tags = IRCTags(self.raw, 1, max(self._tags_end, 1))
+        return self._tags
+
+    @property
+    def prefix(self) -> Optional[str]:
+        if self._prefix_start is None:
+            return None
+        return self.raw[self._prefix_start:self._prefix_end]
+
+    @property
+    def parameters(self) -> List[str]:
+        if self._parameters is None:
+            self._parameters = _parse_parameters(
+                    self.raw, self._parameters_start)
+        return self._parameters
+
+    def trailing_starts_with(self, text: str) -> bool:
+        # Checks the trailing parameter without splitting the parameters.
+        # Middle parameters can't contain ' :', so the first one after
+        # the command starts the trailing parameter.
+        parameters = self._parameters
+        if parameters is None:
+            trailing_start = self.raw.find(" :", self._parameters_start)
+            if trailing_start >= 0:
+                return self.raw.startswith(text, trailing_start + 2)
+            parameters = self.parameters
+        return bool(parameters) and parameters[-1].startswith(text)
+
+
+def _find_space_or_end(raw_message: str, start: int) -> int:
+    space_index = raw_message.find(" ", start)
+    return space_index if space_index >= 0 else len(raw_message)
+
+
+def _skip_spaces(raw_message: str, index: int) -> int:
+    while raw_message.startswith(" ", index):
+        index += 1
+    return index
+
+
+def _parse_parameters(raw_message: str, index: int) -> List[str]:
+    # Middle parameters are space-separated; the first one starting with
+    # ':' is the trailing parameter and runs to the end of the line,
+    # colons and spaces included.
+    parameters = []
+    message_length = len(raw_message)
+    while True:
+        index = _skip_spaces(raw_message, index)
+        if index >= message_length:
+            return parameters
+        if raw_message[index] == ":":
+            parameters.append(raw_message[index + 1:])
+            return parameters
+        parameter_end = _find_space_or_end(raw_message, index)
+        parameter = raw_message[index:parameter_end]
+        # Channel names repeat on every message; share them.
+        if parameter.startswith("#"):
+            parameter = _intern(parameter)
+        parameters.append(parameter)
+        index = parameter_end
+
+
+class IRCLineBuffer:
+    # Receives into one preallocated buffer and keeps any partial line
+    # until the rest of it arrives. Only complete lines are decoded, so
+    # a multibyte character split across two reads decodes correctly.
+    def __init__(
+            self,
+            receive_buffer_size: int=DEFAULT_RECEIVE_BUFFER_SIZE) -> None:
+        self._receive_buffer = bytearray(receive_buffer_size)
+        self._receive_view = memoryview(self._receive_buffer)
+        self._pending = bytearray()
+
+    def receive_from(self, connection: socket.socket) -> int:
+        received_count = connection.recv_into(self._receive_view)
+        if received_count:
+            self._pending += self._receive_view[:received_count]
+        return received_count
+
+    def pop_lines(self) -> List[str]:
+        last_separator_index = self._pending.rfind(IRC_LINE_SEPARATOR)
+        if last_separator_index < 0:
+            return []
+        complete_lines = self._pending[:last_separator_index]
+        del self._pending[:last_separator_index + len(IRC_LINE_SEPARATOR)]
+        return [
+                line.decode("utf-8", "replace")
+                for line in complete_lines.split(IRC_LINE_SEPARATOR)
+                if line]
+
+    def clear(self) -> None:
+        self._pending.clear()
+
+
+class JoinProgress:
+    # Tracks a bulk join until every channel's JOIN has been echoed back.
+    def __init__(self, channel_names: Iterable[str]) -> None:
+        self.channel_names = list(channel_names)
+        self.pending_channels = set(self.channel_names)
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        if not self.pending_channels:
+            self._finish()
+
+    @property
+    def is_finished(self) -> bool:
+        return self._finished.is_set()
+
+    @property
+    def time_to_joined_sec(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def confirm(self, channel_name: str) -> None:
+        with self._lock:
+            if channel_name not in self.pending_channels:
+                return
+            self.pending_channels.remove(channel_name)
+            if self.pending_channels:
+                return
+        self._finish()
+
+    def wait(self, timeout_sec: Optional[float]=None) -> bool:
+        return self._finished.wait(timeout_sec)
+
+    def _finish(self) -> None:
+        self.finished_at = time.monotonic()
+        self._finished.set()
+        # diagnostic
+        print(
+                f"Joined {len(self.channel_names)} channels in "
+                f"{self.time_to_joined_sec:.2f}s.")
+
+
+class ConnectionHealth:
+    # Round trips of the client's own PINGs over a rolling window, and
+    # when anything was last received.
+    def __init__(
+            self, ping_interval_sec: Optional[float],
+            ping_timeout_sec: float,
+            rtt_window_size: int=RTT_WINDOW_SIZE) -> None:
+        self.ping_interval_sec = ping_interval_sec
+        self.ping_timeout_sec = ping_timeout_sec
+        self.rtts_sec = collections.deque(maxlen=rtt_window_size)
+        self.missed_ping_count = 0
+        self._ping_tokens = (
+                f"{PING_TOKEN_PREFIX}{x}" for x in itertools.count())
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        # A new connection starts with nothing outstanding.
+        with self._lock:
+            self.last_received_at = time.monotonic()
+            self.last_ping_at = self.last_received_at
+            self._pending_pings = {}
+
+    def observe_received(self, now: float) -> None:
+        self.last_received_at = now
+
+    def start_ping(self, now: float) -> str:
+        with self._lock:
+            token = next(self._ping_tokens)
+            self._pending_pings[token] = now
+            self.last_ping_at = now
+        return token
+
+    def observe_pong(self, token: str, now: float) -> bool:
+        with self._lock:
+            sent_at = self._pending_pings.pop(token, None)
+            if sent_at is None:
+                return False
+            self.rtts_sec.append(now - sent_at)
+        return True
+
+    def is_dead(self, now: float) -> bool:
+        with self._lock:
+            if not self._pending_pings:
+                return False
+            oldest_sent_at = min(self._pending_pings.values())
+        if now - oldest_sent_at < self.ping_timeout_sec:
+            return False
+        self.missed_ping_count += 1
+        return True
+
+    def next_ping_in_sec(self, now: float) -> Optional[float]:
+        if self.ping_interval_sec is None:
+            return None
+        return max(0.0, self.last_ping_at + self.ping_interval_sec - now)
+
+    def rtt_percentile_sec(self, percentile: float) -> Optional[float]:
+        rtts_sec = sorted(self.rtts_sec)
+        if not rtts_sec:
+            return None
+        index = min(len(rtts_sec) - 1, int(len(rtts_sec) * percentile))
+        return rtts_sec[index]
+
+    @property
+    def p50_rtt_sec(self) -> Optional[float]:
+        return self.rtt_percentile_sec(.5)
+
+    @property
+    def p99_rtt_sec(self) -> Optional[float]:
+        return self.rtt_percentile_sec(.99)
+
+    @property
+    def seconds_since_received(self) -> float:
+        return time.monotonic() - self.last_received_at
 
 
 class IRCClient:
-    def __init__(self, default_retry_seconds: float=.5) -> None:
+    def __init__(
+            self, default_retry_seconds: float=.5,
+            receive_buffer_size: int=DEFAULT_RECEIVE_BUFFER_SIZE,
+            rate_limit_profile: IRCRateLimitProfile=(
+                    TWITCH_RATE_LIMIT_PROFILE),
+            ping_interval_sec: Optional[float]=DEFAULT_PING_INTERVAL_SEC,
+            ping_timeout_sec: float=DEFAULT_PING_TIMEOUT_SEC,
+            rate_limits: Optional[IRCRateLimits]=None) -> None:
         self.default_retry_seconds = default_retry_seconds
         self.retry_seconds = default_retry_seconds
         self._connection = None
+        self._line_buffer = IRCLineBuffer(receive_buffer_size)
+        # Every command only queues its line; the writer thread sends it
+        # when the rate limits allow. Clients logged in as the same
+        # account pass the same 'rate_limits', which overrides
+        # 'rate_limit_profile'.
+        self._writer = IRCOutboundWriter(
+                self.send_raw, rate_limit_profile, rate_limits)
         self.saved_host_name = None
         self.saved_host_port = None
         self.saved_timeout_seconds = None
@@ -151,6 +533,21 @@ class IRCClient:
         self.saved_username = None
         self.requested_capabilities = []
         self.channels = []
+        self._join_progresses = []
+        # Channels whose JOIN is queued but not yet written. A reconnect
+        # leaves these to the writer rather than queueing them twice.
+        self._queued_join_channels = set()
+        # Set when an external event loop such as IRCReactor owns the
+        # socket; see attach_output_buffer. Each buffered line's future
+        # waits in '_unflushed_writes' with the buffered byte count at the
+        # line's end, until mark_flushed has seen that many bytes written.
+        self._output_buffer = None
+        self._unflushed_writes = collections.deque()
+        self._buffered_byte_count = 0
+        self._flushed_byte_count = 0
+        self.health = ConnectionHealth(ping_interval_sec, ping_timeout_sec)
+        self._keepalive_thread = None
+        self._reconnect_lock = threading.RLock()
 
     @method_require_not_connected
     def connect(
@@ -159,25 +556,168 @@ class IRCClient:
         self.saved_host_name = host_name
         self.saved_host_port = host_port
         self.saved_timeout_seconds = timeout_seconds
+        self._line_buffer.clear()
         self._connection = socket.create_connection((host_name, host_port))
         if timeout_seconds is not None:
             self._connection.settimeout(timeout_seconds)
+        self.health.reset()
+        # Nothing but registration goes out until login.
+        self._writer.hold_for_registration()
+        if self._output_buffer is None:
+            self._writer.start()
+            self._start_keepalive_thread()
+        else:
+            # A partial line from the old connection must not lead the
+            # new one.
+            self._output_buffer.clear()
+            self._fail_unflushed_writes()
+
+    @property
+    def connection(self) -> Optional[socket.socket]:
+        return self._connection
+
+    def reconnect(
+            self, failed_connection: Optional[socket.socket]=None) -> None:
+        # Reader and writer may both notice the same failure; whichever
+        # gets here second finds it already handled.
+        with self._reconnect_lock:
+            if (
+                    failed_connection is not None
+                    and self._connection is not None
+                    and self._connection is not failed_connection):
+                return
+            if self._connection is not None:
+                self.disconnect()
+            self.connect(
+                    self.saved_host_name, self.saved_host_port,
+                    self.saved_timeout_seconds)
+            self.login(
+                    self.saved_password, self.saved_nickname,
+                    self.saved_username)
+            for capability_name in self.requested_capabilities:
+                self.request_capability(capability_name)
+            self._rejoin_channels()
+
+    def check_keepalive(self, now: Optional[float]=None) -> Optional[float]:
+        # PINGs the server when one is due. A connection whose PING has
+        # gone unanswered is shut down, so whoever reads it sees it close
+        # and reconnects. Returns seconds until the next check is due.
+        connection = self._connection
+        if connection is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        if self.health.is_dead(now):
+            # diagnostic
+            print(
+                    f"{self} missed a PING for "
+                    f"{self.health.ping_timeout_sec}s. Dropping connection.")
+            self.health.reset()
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return None
+        next_ping_in_sec = self.health.next_ping_in_sec(now)
+        if next_ping_in_sec == 0:
+            self.ping(self.health.start_ping(now))
+            return min(
+                    self.health.ping_interval_sec,
+                    self.health.ping_timeout_sec)
+        return next_ping_in_sec
+
+    def _start_keepalive_thread(self) -> None:
+        if self._keepalive_thread is not None:
+            return
+        if self.health.ping_interval_sec is None:
+            return
+        self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop, daemon=True)
+        self._keepalive_thread.start()
+
+    def _keepalive_loop(self) -> None:
+        while True:
+            delay_sec = self.check_keepalive()
+            if delay_sec is None:
+                delay_sec = self.health.ping_interval_sec
+            time.sleep(delay_sec)
+
+    def attach_output_buffer(self, on_enqueue: callable) -> bytearray:
+        # Hands writing over to an external event loop. Instead of a
+        # writer thread sending to the socket, write_queued moves lines
+        # into the returned buffer as the rate limits allow, and the loop
+        # flushes it. 'on_enqueue' is called whenever a line is queued.
+        self._writer.stop()
+        self._writer.on_enqueue = on_enqueue
+        self._writer.on_buffered = self._track_buffered_write
+        self._output_buffer = bytearray()
+        return self._output_buffer
+
+    def write_queued(self) -> Optional[float]:
+        # Returns seconds until more queued lines may go, or None.
+        return self._writer.write_ready()
+
+    def mark_flushed(self, byte_count: int) -> None:
+        # Called by the event loop after writing 'byte_count' bytes from
+        # the front of the output buffer. Resolves the futures of every
+        # line now fully written.
+        self._flushed_byte_count += byte_count
+        unflushed_writes = self._unflushed_writes
+        while (
+                unflushed_writes
+                and unflushed_writes[0][0] <= self._flushed_byte_count):
+            unflushed_writes.popleft()[1].set_result(None)
+
+    def _track_buffered_write(
+            self,
+            buffered_lines: List[Tuple[int, concurrent.futures.Future]]
+            ) -> None:
+        for byte_count, future in buffered_lines:
+            self._buffered_byte_count += byte_count
+            self._unflushed_writes.append(
+                    (self._buffered_byte_count, future))
+
+    def _fail_unflushed_writes(self) -> None:
+        # The output buffer was dropped with the connection it was for.
+        unflushed_writes = self._unflushed_writes
+        self._unflushed_writes = collections.deque()
+        self._buffered_byte_count = 0
+        self._flushed_byte_count = 0
+        for _, future in unflushed_writes:
+            future.set_exception(IRCClientDisconnectedError(self))
 
-    @method_retry_on_disconnect
-    @method_raise_disconnected_error
     @method_require_connection
     def login(
             self, password: Optional[str], nickname: Optional[str],
             username: Optional[str]) -> None:
+        # Queued ahead of everything else, and releases what connect held
+        # back.
         self.saved_password = password
         self.saved_nickname = nickname
         self.saved_username = username
         if password is not None:
-            self._connection.send(f"PASS {password}\r\n".encode())
+            self._writer.enqueue(
+                    f"PASS {password}", SEND_PRIORITY_REGISTRATION)
         if nickname is not None:
-            self._connection.send(f"NICK {nickname}\r\n".encode())
+            self._writer.enqueue(
+                    f"NICK {nickname}", SEND_PRIORITY_REGISTRATION)
         if username is not None:
-            self._connection.send(f"USER {username}\r\n".encode())
+            self._writer.enqueue(
+                    f"USER {username}", SEND_PRIORITY_REGISTRATION)
+        self._writer.finish_registration()
+
+    def change_password(self, password: str) -> None:
+        # Logs in again with 'password'. The connection is shut down, as
+        # an unresponsive one is, and whoever reads it reconnects with the
+        # new password; reconnecting here would race that reader.
+        self.saved_password = password
+        connection = self._connection
+        if connection is None:
+            return
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     @method_require_connection
     def disconnect(self) -> None:
@@ -185,18 +725,37 @@ class IRCClient:
         self._connection = None
         connection.close()
 
-    @method_reconnect_and_retry
-    @method_raise_disconnected_error
     @method_require_connection
-    def request_capability(self, capability_name: str) -> None:
-        self._connection.send(f"CAP REQ :{capability_name}\r\n".encode())
+    def request_capability(
+            self, capability_name: str) -> concurrent.futures.Future:
         if capability_name not in self.requested_capabilities:
             self.requested_capabilities.append(capability_name)
+        return self._writer.enqueue(
+                f"CAP REQ :{capability_name}", SEND_PRIORITY_REGISTRATION)
 
-    @method_reconnect_and_retry
     @method_raise_disconnected_error
     @method_require_connection
-    def pong(self, parameters: List[str]) -> None:
+    def send_raw(self, data: bytes) -> None:
+        # Only the outbound writer calls this. Under an event loop the
+        # data just joins its output buffer, and the lines' futures wait
+        # for mark_flushed; otherwise 'sendall' keeps writing through
+        # partial sends. A failed write isn't retried here: the writer
+        # keeps the lines, and whoever reads the connection reconnects
+        # it, so they follow the new connection's registration.
+        if self._output_buffer is not None:
+            self._output_buffer += data
+            return
+        self._connection.sendall(data)
+
+    def set_channel_moderator(
+            self, channel_name: str, is_moderator: bool) -> None:
+        # Channels where the bot moderates get the higher message limits.
+        self._writer.set_channel_moderator(channel_name, is_moderator)
+
+    def ping(self, token: str) -> concurrent.futures.Future:
+        return self._writer.enqueue(f"PING :{token}", SEND_PRIORITY_PONG)
+
+    def pong(self, parameters: List[str]) -> concurrent.futures.Future:
         parameters_str = ""
         for parameter in parameters:
             if not parameter.count(" "):
@@ -206,45 +765,127 @@ class IRCClient:
                     parameters_str += f" :{parameter}"
             else:
                 parameters_str += f" :{parameter}"
-        self._connection.send(f"PONG {parameters_str}\r\n".encode())
+        return self._writer.enqueue(
+                f"PONG {parameters_str}", SEND_PRIORITY_PONG)
 
-    @method_reconnect_and_retry
-    @method_raise_disconnected_error
-    @method_require_connection
-    def join(self, channel_name: str) -> None:
-        self._connection.send(f"JOIN #{channel_name}\r\n".encode())
+    def join(self, channel_name: str) -> concurrent.futures.Future:
         if channel_name not in self.channels:
             self.channels.append(channel_name)
-
-    @method_reconnect_and_retry
-    @method_raise_disconnected_error
-    @method_require_connection
-    def part(self, channel_name: str) -> None:
-        self._connection.send(f"PART #{channel_name}\r\n".encode())
+        return self._queue_joins([channel_name])[0]
+
+    def join_many(
+            self, channel_names: Iterable[str],
+            join_progress: Optional[JoinProgress]=None) -> JoinProgress:
+        # Packs the channels into as few JOIN lines as the line length
+        # and the JOIN rate limit allow. The returned JoinProgress
+        # finishes once confirm_join has seen every channel.
+        channel_names = list(dict.fromkeys(channel_names))
+        if join_progress is None:
+            join_progress = JoinProgress(channel_names)
+        self._join_progresses.append(join_progress)
+        for channel_name in channel_names:
+            if channel_name not in self.channels:
+                self.channels.append(channel_name)
+        self._queue_joins(channel_names)
+        return join_progress
+
+    def confirm_join(self, channel_name: str) -> None:
+        # Called when the server echoes our own JOIN for 'channel_name'.
+        for join_progress in list(self._join_progresses):
+            join_progress.confirm(channel_name)
+            if join_progress.is_finished:
+                try:
+                    self._join_progresses.remove(join_progress)
+                except ValueError:
+                    pass
+
+    def _rejoin_channels(self) -> None:
+        # A fresh connection has no memberships, so every channel is
+        # joined again, except those still waiting in the writer's queue.
+        # Unfinished JoinProgresses carry over and finish on the new
+        # connection's confirmations.
+        self._queue_joins([
+                x for x in self.channels
+                if x not in self._queued_join_channels])
+
+    def _queue_joins(
+            self, channel_names: List[str]) -> List[concurrent.futures.Future]:
+        # No line carries more channels than the JOIN bucket holds, or it
+        # could never be sent.
+        max_channels_per_line = self._writer.profile.joins
+        futures = []
+        line_channels = []
+        line_length = len("JOIN \r\n")
+        for channel_name in channel_names:
+            target_length = len(channel_name.encode()) + 2
+            if line_channels and (
+                    line_length + target_length > MAX_IRC_LINE_BYTES
+                    or len(line_channels) == max_channels_per_line):
+                futures.append(self._queue_join_line(line_channels))
+                line_channels = []
+                line_length = len("JOIN \r\n")
+            line_channels.append(channel_name)
+            line_length += target_length
+        if line_channels:
+            futures.append(self._queue_join_line(line_channels))
+        return futures
+
+    def _queue_join_line(
+            self, channel_names: List[str]) -> concurrent.futures.Future:
+        self._queued_join_channels.update(channel_names)
+        future = self._writer.enqueue(
+                "JOIN " + ",".join(f"#{x}" for x in channel_names),
+                SEND_PRIORITY_MEMBERSHIP, join_count=len(channel_names))
+        future.add_done_callback(
+                lambda _: self._queued_join_channels.difference_update(
+                        channel_names))
+        return future
+
+    def part(self, channel_name: str) -> concurrent.futures.Future:
         try:
             self.channels.remove(channel_name)
         except ValueError:
             pass
+        return self._writer.enqueue(
+                f"PART #{channel_name}", SEND_PRIORITY_MEMBERSHIP)
 
-    @method_reconnect_and_retry
-    @method_raise_disconnected_error
-    @method_require_connection
     def private_message(
-            self, channel_name: str, message_str: str) -> None:
-        irc_message = f"PRIVMSG #{channel_name} :{message_str}\r\n"
-        self._connection.send(irc_message.encode())
+            self, channel_name: str,
+            message_str: str) -> concurrent.futures.Future:
+        return self._writer.enqueue(
+                f"PRIVMSG #{channel_name} :{message_str}",
+                SEND_PRIORITY_MESSAGE, channel_name)
 
     @method_reconnect_and_retry
     @method_raise_disconnected_error
     @method_require_connection
-    def read_messages(self) -> List[IRCMessage]:
-        recv_str = ""
-        while True:
-            recv_bytes = self._connection.recv(1024)
-            recv_str += recv_bytes.decode("utf-8", "replace")
-            if recv_str.endswith("\r\n"):
+    def read_messages(self, block: bool=True) -> List[IRCMessage]:
+        # Returns as soon as at least one complete line is available,
+        # leaving any trailing partial line buffered for the next call.
+        # With 'block' False, receives at most once and may return [].
+        raw_messages = self._line_buffer.pop_lines()
+        while not raw_messages:
+            if not self._line_buffer.receive_from(self._connection):
+                raise RemoteConnectionClosedError
+            raw_messages = self._line_buffer.pop_lines()
+            if not block:
                 break
-        if recv_str == "":
-            raise RemoteConnectionClosed
-        raw_messages = [line for line in recv_str.split("\r\n") if line]
-        return [IRCMessage(raw_message) for raw_message in raw_messages]
+        return self._parse_received(raw_messages)
+
+    @method_require_connection
+    def read_available_messages(self) -> List[IRCMessage]:
+        # Receives once, for callers that already know the socket is
+        # readable. Unlike read_messages, a closed connection is raised
+        # as RemoteConnectionClosedError and nothing is retried.
+        if not self._line_buffer.receive_from(self._connection):
+            raise RemoteConnectionClosedError
+        return self._parse_received(self._line_buffer.pop_lines())
+
+    def _parse_received(self, raw_messages: List[str]) -> List[IRCMessage]:
+        now = time.monotonic()
+        self.health.observe_received(now)
+        irc_messages = [IRCMessage(x) for x in raw_messages]
+        for irc_message in irc_messages:
+            if irc_message.command == "PONG" and irc_message.parameters:
+                self.health.observe_pong(irc_message.parameters[-1], now)
+        return irc_messages
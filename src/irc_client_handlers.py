@@ -1,17 +1,47 @@
+from src.bot_state_store import BotStateStore
 from src.irc_client import IRCClient
 from src.irc_client_listener import (
-        IRCClientNoticeEvent, IRCClientUserstateEvent, IRCClientPingEvent,
-        IRCClientTimeoutEvent)
-from src.streambrain import Handler
+        IRCClientJoinEvent, IRCClientNoticeEvent, IRCClientUserstateEvent,
+        IRCClientPingEvent, IRCClientTimeoutEvent)
+from src.streambrain import (
+        PRIORITY_BACKGROUND, PRIORITY_CRITICAL, Handler)
 from src.twitch import TwitchOauthManager
 
 
 FAILED_LOGIN_IRC_PARAMS = ["*", "Login authentication failed"]
 
 
+def is_login_failed_notice(
+        irc_client_notice_event: IRCClientNoticeEvent) -> bool:
+    notice_parameters = irc_client_notice_event.irc_message.parameters
+    return notice_parameters == FAILED_LOGIN_IRC_PARAMS
+
+
+def is_own_join(irc_client_join_event: IRCClientJoinEvent) -> bool:
+    nickname = irc_client_join_event.irc_client.saved_nickname
+    prefix = irc_client_join_event.irc_message.prefix
+    if nickname is None or prefix is None:
+        return False
+    return prefix.split("!", 1)[0].lower() == nickname.lower()
+
+
+class ConfirmJoinHandler(Handler):
+    # Feeds the server's echo of our own JOINs back to the client, which
+    # is how a join_many batch knows it has finished.
+    def __init__(self, irc_client: IRCClient) -> None:
+        super().__init__(
+                IRCClientJoinEvent, {"irc_client": irc_client},
+                is_own_join, PRIORITY_CRITICAL)
+        self._irc_client = irc_client
+
+    def handle(self, irc_client_join_event: IRCClientJoinEvent) -> None:
+        self._irc_client.confirm_join(irc_client_join_event.channel)
+
+
 class ReportTimeoutHandler(Handler):
     def __init__(self) -> None:
-        super().__init__(IRCClientTimeoutEvent)
+        super().__init__(
+                IRCClientTimeoutEvent, priority=PRIORITY_BACKGROUND)
 
     def handle(
             self, irc_client_timeout_event: IRCClientTimeoutEvent) -> None:
@@ -20,22 +50,22 @@ class ReportTimeoutHandler(Handler):
 
 class LeaveIfNotModdedHandler(Handler):
     def __init__(
-            self, irc_client: IRCClient,
-            current_channels_path: str) -> None:
-        super().__init__(IRCClientUserstateEvent)
+            self, irc_client: IRCClient, bot_state: BotStateStore) -> None:
+        super().__init__(
+                IRCClientUserstateEvent, {"irc_client": irc_client})
         self._irc_client = irc_client
-        self._current_channels_path = current_channels_path
+        self._bot_state = bot_state
 
     def handle(self, userstate_event: IRCClientUserstateEvent) -> None:
-        if userstate_event.irc_client is not self._irc_client:
-            return
         user = userstate_event.irc_message.tags["display-name"]
         channel = userstate_event.irc_message.parameters[0][1:]
         user_type = userstate_event.irc_message.tags["user-type"]
+        if user == "JazzyCircuitBot":
+            self._irc_client.set_channel_moderator(
+                    channel, user_type == "mod")
         if user == "JazzyCircuitBot" and user_type != "mod":
             self._irc_client.part(channel)
-            with open(self._current_channels_path, "w") as channels_file:
-                channels_file.write("\n".join(self._irc_client.channels))
+            self._bot_state.remove_channel(channel)
             self._irc_client.private_message(
                     channel,
                     "I need to be a mod so that my messages aren't rate-"
@@ -45,13 +75,16 @@ class LeaveIfNotModdedHandler(Handler):
 
 
 class PongIfPingedHandler(Handler):
+    # For an IRCClientListener reading a bare IRCClient. IRCReactor and
+    # IRCClientPool answer PINGs as they read them and never queue them,
+    # so this isn't activated alongside either.
     def __init__(self, irc_client: IRCClient) -> None:
-        super().__init__(IRCClientPingEvent)
+        super().__init__(
+                IRCClientPingEvent, {"irc_client": irc_client},
+                priority=PRIORITY_CRITICAL)
         self._irc_client = irc_client
 
     def handle(self, irc_client_ping_event: IRCClientPingEvent) -> None:
-        if irc_client_ping_event.irc_client is not self._irc_client:
-            return
         # diagnostic
         print("Got ping. Sending pong.")
         self._irc_client.pong(irc_client_ping_event.irc_message.parameters)
@@ -61,31 +94,18 @@ class TwitchChatLoginFailedHandler(Handler):
     def __init__(
             self, irc_client: IRCClient,
             twitch_oauth_manager: TwitchOauthManager) -> None:
-        super().__init__(IRCClientNoticeEvent)
+        super().__init__(
+                IRCClientNoticeEvent, {"irc_client": irc_client},
+                is_login_failed_notice, PRIORITY_CRITICAL)
         self._irc_client = irc_client
         self._twitch_oauth_manager = twitch_oauth_manager
 
     def handle(self, irc_client_notice_event: IRCClientNoticeEvent) -> None:
-        notice_client = irc_client_notice_event.irc_client
-        notice_parameters = irc_client_notice_event.irc_message.parameters
-        login_failed = notice_parameters == FAILED_LOGIN_IRC_PARAMS
-        if notice_client is not self._irc_client or not login_failed:
-            return
         new_password = f"oauth:{self._twitch_oauth_manager.access_token}"
         if self._irc_client.saved_password == new_password:
             self._twitch_oauth_manager.refresh()
             access_token = self._twitch_oauth_manager.access_token
             new_password = f"oauth:{access_token}"
-        self.relogin_with_new_password(up_to_date_password)
-
-    def relogin_with_new_password(self, new_password: str):
-        self._irc_client.disconnect()
-        self._irc_client.connect(
-                self._irc_client.saved_host_name,
-                self._irc_client.saved_host_port,
-                self._irc_client.saved_timeout_seconds)
-        self._irc_client.login(
-                new_password, self._irc_client.saved_nickname,
-                self._irc_client.saved_username)
-        for channel_name in self._irc_client.channels:
-            self._irc_client.join(channel_name)
+        # Whoever reads the connection logs in again with it, so this
+        # lane isn't held up by the handshake.
+        self._irc_client.change_password(new_password)
@@ -1,49 +1,82 @@
 from socket import timeout as SocketTimeoutError
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 
 from .streambrain import Event, Listener
+from .streambrain_metrics import GaugeFamily
 from .irc_client import IRCMessage, IRCClient
+from .twitch_chat_private_message import TwitchPrivateMessage
 
 
 class IRCClientMessageEvent(Event):
+    __slots__ = ("irc_client", "irc_message")
+
     def __init__(
             self, irc_client: IRCClient, irc_message: IRCMessage) -> None:
         super().__init__(None)
         self.irc_client = irc_client
         self.irc_message = irc_message
 
+    @property
+    def command(self) -> str:
+        return self.irc_message.command
+
+    @property
+    def channel(self) -> Optional[str]:
+        parameters = self.irc_message.parameters
+        if parameters and parameters[0].startswith("#"):
+            return parameters[0][1:]
+        return None
+
+    def partition_key(self) -> Optional[str]:
+        parameters = self.irc_message.parameters
+        return parameters[0] if parameters else None
+
 
 class IRCClientPrivateMessageEvent(IRCClientMessageEvent):
-    def __init__(
-            self, irc_client: IRCClient, irc_message: IRCMessage) -> None:
-        super().__init__(irc_client, irc_message)
+    __slots__ = ("_private_message",)
+
+    @property
+    def private_message(self) -> TwitchPrivateMessage:
+        # Built on first use; its fields are decoded lazily in turn.
+        try:
+            return self._private_message
+        except AttributeError:
+            self._private_message = TwitchPrivateMessage(self.irc_message)
+            return self._private_message
+
+    def coalesce_key(self) -> Optional[Tuple[int, str, Optional[str], str]]:
+        # The same chat line sent to the same channel by the same user,
+        # e.g. someone spamming '!jazzyevents', only needs one reply.
+        # Lines from different users never merge: commands like
+        # '!jazzybot' act on whoever sent them.
+        parameters = self.irc_message.parameters
+        if len(parameters) < 2:
+            return None
+        chat_message_body = parameters[1].strip().lower()
+        return (
+                id(self.irc_client), parameters[0], self.irc_message.prefix,
+                chat_message_body)
 
 
 class IRCClientPingEvent(IRCClientMessageEvent):
-    def __init__(
-            self, irc_client: IRCClient, irc_message: IRCMessage) -> None:
-        super().__init__(irc_client, irc_message)
+    __slots__ = ()
 
 
 class IRCClientJoinEvent(IRCClientMessageEvent):
-    def __init__(
-            self, irc_client: IRCClient, irc_message: IRCMessage) -> None:
-        super().__init__(irc_client, irc_message)
+    __slots__ = ()
 
 
 class IRCClientUserstateEvent(IRCClientMessageEvent):
-    def __init__(
-            self, irc_client: IRCClient, irc_message: IRCMessage) -> None:
-        super().__init__(irc_client, irc_message)
+    __slots__ = ()
 
 
 class IRCClientNoticeEvent(IRCClientMessageEvent):
-    def __init__(
-            self, irc_client: IRCClient, irc_message: IRCMessage) -> None:
-        super().__init__(irc_client, irc_message)
+    __slots__ = ()
 
 
 class IRCClientTimeoutEvent(Event):
+    __slots__ = ("irc_client",)
+
     def __init__(self, irc_client: IRCClient) -> None:
         super().__init__(None)
         self.irc_client = irc_client
@@ -55,11 +88,43 @@ IRC_COMMAND_EVENT_MAP = {
         "NOTICE": IRCClientNoticeEvent}
 
 
+class PrivateMessagePrefilter:
+    # Decides, before any event is built, whether a PRIVMSG is worth
+    # dispatching: only those whose body starts with 'prefix' are. Other
+    # messages always pass. Only the start of the trailing parameter is
+    # looked at, so ordinary chat is dropped without being split.
+    def __init__(self, prefix: str="!") -> None:
+        self.prefix = prefix
+        self.filtered_count = 0
+        self.passed_count = 0
+
+    def __call__(self, irc_message: IRCMessage) -> bool:
+        if irc_message.command != "PRIVMSG":
+            return True
+        if irc_message.trailing_starts_with(self.prefix):
+            self.passed_count += 1
+            return True
+        self.filtered_count += 1
+        return False
+
+    def register_metrics(self, metrics: object) -> None:
+        # Reported as gauges read at scrape time, to keep the per-message
+        # cost to an integer increment.
+        privmsg_prefilter = GaugeFamily(
+                "irc_privmsg_prefilter_messages", "outcome",
+                "PRIVMSGs dropped or passed on by the prefilter.")
+        privmsg_prefilter.set_source("filtered", lambda: self.filtered_count)
+        privmsg_prefilter.set_source("passed", lambda: self.passed_count)
+        metrics.add_family(privmsg_prefilter)
+
+
 class IRCClientListener(Listener):
     def __init__(
-            self, irc_client: IRCClient, sleep_sec: int = 0) -> None:
+            self, irc_client: IRCClient, sleep_sec: int = 0,
+            prefilter: Optional[Callable[[IRCMessage], bool]]=None) -> None:
         super().__init__(sleep_sec)
         self._irc_client = irc_client
+        self._prefilter = prefilter
 
     def listen(self) -> List[Event]:
         try:
@@ -67,11 +132,13 @@ class IRCClientListener(Listener):
         except SocketTimeoutError as e:
             return [IRCClientTimeoutEvent(self._irc_client)]
         events = []
+        prefilter = self._prefilter
         for irc_message in new_messages:
             try:
                 event_type = IRC_COMMAND_EVENT_MAP[irc_message.command]
             except KeyError:
                 continue
-            else:
-                events.append(event_type(self._irc_client, irc_message))
+            if prefilter is not None and not prefilter(irc_message):
+                continue
+            events.append(event_type(self._irc_client, irc_message))
         return events
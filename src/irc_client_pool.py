@@ -0,0 +1,326 @@
+import concurrent.futures
+import queue
+import threading
+import traceback
+
+from socket import timeout as SocketTimeoutError
+from typing import (
+        TYPE_CHECKING, Callable, Dict, Iterable, List, Optional)
+
+from src.irc_client import IRCClient, IRCMessage, JoinProgress
+from src.irc_client_writer import (
+        TWITCH_RATE_LIMIT_PROFILE, IRCRateLimitProfile, IRCRateLimits)
+
+
+# Twitch doesn't publish a hard cap on channels per connection, but
+# spreading channels keeps each socket's read load and the blast radius of
+# a disconnect small.
+DEFAULT_CHANNELS_PER_CONNECTION = 50
+# A connection is merged into the others once they have room for its
+# channels plus this share of a connection to spare, so a pool hovering
+# around a connection boundary doesn't keep opening and merging one.
+MERGE_SPARE_CONNECTION_SHARE = .5
+
+
+if TYPE_CHECKING:
+    from src.irc_reactor import IRCReactor
+
+
+class IRCClientPool:
+    # Spreads channels across several IRCClient connections while looking
+    # like a single IRCClient to listeners and handlers. Each connection
+    # has its own reader thread; IRCClientListener(pool) receives what they
+    # read through 'read_messages' and tags every event with the pool.
+    # Given an IRCReactor, the connections are serviced by its thread
+    # instead, and the reactor queues their events directly. Connections
+    # are opened without holding the pool's lock, since connecting and
+    # logging in block. Twitch rate-limits the account rather than each
+    # connection, so 'create_client' is passed one IRCRateLimits that
+    # every connection shares.
+    def __init__(
+            self,
+            channels_per_connection: int=DEFAULT_CHANNELS_PER_CONNECTION,
+            create_client: Callable[..., IRCClient]=IRCClient,
+            reactor: Optional["IRCReactor"]=None,
+            rate_limit_profile: IRCRateLimitProfile=(
+                    TWITCH_RATE_LIMIT_PROFILE)) -> None:
+        self.channels_per_connection = channels_per_connection
+        self._create_client = create_client
+        self._reactor = reactor
+        self.rate_limits = IRCRateLimits(rate_limit_profile)
+        self.saved_host_name = None
+        self.saved_host_port = None
+        self.saved_timeout_seconds = None
+        self.saved_password = None
+        self.saved_nickname = None
+        self.saved_username = None
+        self.requested_capabilities = []
+        self.channels = []
+        self.connections = []
+        self._owners = {}
+        self._inbound = queue.Queue()
+        self._lock = threading.RLock()
+
+    def connect(
+            self, host_name: str, host_port: int=6667,
+            timeout_seconds: Optional[float]=None) -> None:
+        # Connections are opened as channels need them.
+        self.saved_host_name = host_name
+        self.saved_host_port = host_port
+        self.saved_timeout_seconds = timeout_seconds
+
+    def login(
+            self, password: Optional[str], nickname: Optional[str],
+            username: Optional[str]) -> None:
+        with self._lock:
+            self.saved_password = password
+            self.saved_nickname = nickname
+            self.saved_username = username
+            for irc_client in self.connections:
+                irc_client.login(password, nickname, username)
+
+    def change_password(self, password: str) -> None:
+        # Every connection logs in again with 'password', and later ones
+        # use it from the start; see IRCClient.change_password.
+        with self._lock:
+            self.saved_password = password
+            connections = list(self.connections)
+        for irc_client in connections:
+            irc_client.change_password(password)
+
+    def request_capability(self, capability_name: str) -> None:
+        with self._lock:
+            if capability_name not in self.requested_capabilities:
+                self.requested_capabilities.append(capability_name)
+            for irc_client in self.connections:
+                irc_client.request_capability(capability_name)
+
+    def disconnect(self) -> None:
+        # Closes every connection but remembers the channels, so they can
+        # be joined again after the next login.
+        with self._lock:
+            connections = self.connections
+            self.connections = []
+            self._owners.clear()
+        for irc_client in connections:
+            self._close_connection(irc_client)
+
+    def owner_of(self, channel_name: str) -> Optional[IRCClient]:
+        return self._owners.get(channel_name)
+
+    def join(self, channel_name: str) -> concurrent.futures.Future:
+        while True:
+            with self._lock:
+                if channel_name not in self.channels:
+                    self.channels.append(channel_name)
+                irc_client = self._owners.get(channel_name)
+                if irc_client is None:
+                    irc_client = self._least_loaded_connection()
+                if irc_client is not None:
+                    self._owners[channel_name] = irc_client
+                    return irc_client.join(channel_name)
+            self._add_connection()
+
+    def join_many(self, channel_names: Iterable[str]) -> JoinProgress:
+        # One JoinProgress covers the whole batch, whichever connections
+        # the channels land on.
+        channel_names = list(dict.fromkeys(channel_names))
+        join_progress = JoinProgress(channel_names)
+        unassigned_channel_names = channel_names
+        while True:
+            channel_names_by_client = {}
+            with self._lock:
+                for channel_name in unassigned_channel_names:
+                    if channel_name not in self.channels:
+                        self.channels.append(channel_name)
+                unassigned_channel_names = self._assign_channels(
+                        unassigned_channel_names, channel_names_by_client)
+                for irc_client, client_channel_names in (
+                        channel_names_by_client.items()):
+                    irc_client.join_many(client_channel_names, join_progress)
+            if not unassigned_channel_names:
+                return join_progress
+            self._add_connection()
+
+    def confirm_join(self, channel_name: str) -> None:
+        irc_client = self._owners.get(channel_name)
+        if irc_client is not None:
+            irc_client.confirm_join(channel_name)
+
+    def part(self, channel_name: str) -> concurrent.futures.Future:
+        with self._lock:
+            try:
+                self.channels.remove(channel_name)
+            except ValueError:
+                pass
+            irc_client = self._owners.pop(channel_name, None)
+            if irc_client is None:
+                future = concurrent.futures.Future()
+                future.set_result(None)
+                return future
+            part_future = irc_client.part(channel_name)
+            if not irc_client.channels and len(self.connections) > 1:
+                # Later joins fill the remaining connections first, so an
+                # emptied connection is simply closed once the PART is out.
+                self.connections.remove(irc_client)
+                part_future.add_done_callback(
+                        lambda _: self._close_connection(irc_client))
+            else:
+                self._merge_least_loaded_connection()
+            return part_future
+
+    def private_message(
+            self, channel_name: str,
+            message_str: str) -> concurrent.futures.Future:
+        # A channel the pool isn't in, such as a new channel's first
+        # greeting, is written to over any existing connection; the
+        # message doesn't need a membership.
+        while True:
+            with self._lock:
+                irc_client = self._owners.get(channel_name)
+                if irc_client is None and self.connections:
+                    irc_client = min(
+                            self.connections, key=lambda x: len(x.channels))
+            if irc_client is not None:
+                return irc_client.private_message(channel_name, message_str)
+            self._add_connection()
+
+    def set_channel_moderator(
+            self, channel_name: str, is_moderator: bool) -> None:
+        # Shared by every connection, so it survives a channel moving.
+        self.rate_limits.set_channel_moderator(channel_name, is_moderator)
+
+    def read_messages(self, block: bool=True) -> List[IRCMessage]:
+        # Returns whatever any connection has read since the last call.
+        # A read timeout on one connection is raised here, as IRCClient
+        # would raise it.
+        try:
+            batch = self._inbound.get(block)
+        except queue.Empty:
+            return []
+        irc_messages = []
+        while True:
+            if isinstance(batch, Exception):
+                if irc_messages:
+                    self._inbound.put(batch)
+                    return irc_messages
+                raise batch
+            irc_messages.extend(batch)
+            try:
+                batch = self._inbound.get_nowait()
+            except queue.Empty:
+                return irc_messages
+
+    def _least_loaded_connection(self) -> Optional[IRCClient]:
+        # The emptiest connection with room for another channel, if any.
+        # Called with the lock held.
+        open_connections = [
+                x for x in self.connections
+                if len(x.channels) < self.channels_per_connection]
+        if open_connections:
+            return min(open_connections, key=lambda x: len(x.channels))
+        return None
+
+    def _assign_channels(
+            self, channel_names: List[str],
+            channel_names_by_client: Dict[IRCClient, List[str]]
+            ) -> List[str]:
+        # Gives each channel without an owner the emptiest connection
+        # with room, adding it to 'channel_names_by_client'. Returns the
+        # channels there was no room for. Called with the lock held.
+        unassigned_channel_names = []
+        for channel_name in channel_names:
+            irc_client = self._owners.get(channel_name)
+            if irc_client is None:
+                irc_client = self._least_loaded_connection()
+                if irc_client is None:
+                    unassigned_channel_names.append(channel_name)
+                    continue
+                self._owners[channel_name] = irc_client
+                # Claim the slot now so the next channel sees it.
+                irc_client.channels.append(channel_name)
+            channel_names_by_client.setdefault(irc_client, []).append(
+                    channel_name)
+        return unassigned_channel_names
+
+    def _merge_least_loaded_connection(self) -> None:
+        # Moves the channels of the emptiest connection onto the others
+        # and closes it, once they have room to spare. Called with the
+        # lock held.
+        if len(self.connections) < 2:
+            return
+        donor = min(self.connections, key=lambda x: len(x.channels))
+        receivers = [x for x in self.connections if x is not donor]
+        spare_channel_count = sum(
+                self.channels_per_connection - len(x.channels)
+                for x in receivers)
+        if spare_channel_count < len(donor.channels) + int(
+                self.channels_per_connection * MERGE_SPARE_CONNECTION_SHARE):
+            return
+        self.connections.remove(donor)
+        moved_channel_names = list(donor.channels)
+        for channel_name in moved_channel_names:
+            del self._owners[channel_name]
+        # The old connection is closed straight away: were it kept until
+        # the new JOINs land, both would deliver the moved channels' chat
+        # and commands in between would be answered twice.
+        self._close_connection(donor)
+        channel_names_by_client = {}
+        self._assign_channels(moved_channel_names, channel_names_by_client)
+        for irc_client, client_channel_names in (
+                channel_names_by_client.items()):
+            irc_client.join_many(client_channel_names)
+
+    def _add_connection(self) -> IRCClient:
+        # Connects and logs in without the lock held, so other channels'
+        # replies and joins aren't held up behind the handshake. Two
+        # callers short of room at once may both add a connection; the
+        # spare one is filled by later joins.
+        irc_client = self._create_client(rate_limits=self.rate_limits)
+        if self._reactor is not None:
+            self._reactor.register(irc_client, self)
+        irc_client.connect(
+                self.saved_host_name, self.saved_host_port,
+                self.saved_timeout_seconds)
+        irc_client.login(
+                self.saved_password, self.saved_nickname,
+                self.saved_username)
+        for capability_name in self.requested_capabilities:
+            irc_client.request_capability(capability_name)
+        with self._lock:
+            self.connections.append(irc_client)
+        if self._reactor is None:
+            reader_thread = threading.Thread(
+                    target=self._read_loop, args=(irc_client,), daemon=True)
+            reader_thread.start()
+        return irc_client
+
+    def _close_connection(self, irc_client: IRCClient) -> None:
+        if self._reactor is not None:
+            self._reactor.unregister(irc_client)
+        irc_client.disconnect()
+
+    def _read_loop(self, irc_client: IRCClient) -> None:
+        while irc_client in self.connections:
+            try:
+                irc_messages = irc_client.read_messages()
+            except SocketTimeoutError as e:
+                self._inbound.put(e)
+                continue
+            except Exception:
+                if irc_client not in self.connections:
+                    return
+                # diagnostic
+                print("IRC client pool connection failed to read:")
+                traceback.print_exc()
+                continue
+            batch = []
+            for irc_message in irc_messages:
+                # Keepalive belongs to the connection, not the pool, so
+                # each connection answers its own PINGs.
+                if irc_message.command == "PING":
+                    irc_client.pong(irc_message.parameters)
+                else:
+                    batch.append(irc_message)
+            if batch:
+                self._inbound.put(batch)
@@ -0,0 +1,335 @@
+import collections
+import concurrent.futures
+import dataclasses
+import threading
+import time
+import traceback
+
+from typing import Callable, Optional
+
+
+# Outbound lines are sent in priority order. Registration (PASS, NICK,
+# USER and CAP REQ) comes first on every connection. PONGs jump every
+# other queue and ignore the rate limits, since a late PONG gets the
+# connection dropped.
+SEND_PRIORITY_REGISTRATION = 0
+SEND_PRIORITY_PONG = 1
+SEND_PRIORITY_MEMBERSHIP = 2
+SEND_PRIORITY_MESSAGE = 3
+
+# Twitch closes the connection if one write carries too much at once;
+# coalesced writes stop adding lines past this size.
+MAX_COALESCED_WRITE_BYTES = 8192
+# After a failed write, the writer thread waits this long, or until more
+# is queued, before trying the lines again.
+WRITE_RETRY_SEC = 1
+
+
+@dataclasses.dataclass(frozen=True)
+class IRCRateLimitProfile:
+    # Each limit is a number of commands per period. Messages count
+    # against 'messages' everywhere, and additionally against the
+    # non-moderator limits in channels where the bot isn't a moderator.
+    messages: int
+    messages_period_sec: float
+    non_moderator_messages: int
+    non_moderator_messages_period_sec: float
+    non_moderator_channel_messages: int
+    non_moderator_channel_messages_period_sec: float
+    joins: int
+    joins_period_sec: float
+
+
+TWITCH_RATE_LIMIT_PROFILE = IRCRateLimitProfile(
+        messages=100, messages_period_sec=30,
+        non_moderator_messages=20, non_moderator_messages_period_sec=30,
+        non_moderator_channel_messages=1,
+        non_moderator_channel_messages_period_sec=1,
+        joins=20, joins_period_sec=10)
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, period_sec: float) -> None:
+        self.capacity = capacity
+        self.refill_per_sec = capacity / period_sec
+        self.tokens = float(capacity)
+        self._refilled_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed_sec = now - self._refilled_at
+        if elapsed_sec <= 0:
+            return
+        self.tokens = min(
+                self.capacity, self.tokens + elapsed_sec * self.refill_per_sec)
+        self._refilled_at = now
+
+    def delay_sec(self, now: float, token_count: int=1) -> float:
+        # Seconds until 'token_count' tokens are available; 0 if now.
+        self._refill(now)
+        missing_tokens = min(token_count, self.capacity) - self.tokens
+        if missing_tokens <= 0:
+            return 0.0
+        return missing_tokens / self.refill_per_sec
+
+    def take(self, token_count: int=1) -> None:
+        self.tokens -= token_count
+
+
+class IRCRateLimits:
+    # The token buckets one Twitch account's commands are counted
+    # against. Twitch limits the account, not the connection, so every
+    # connection of a pool shares one IRCRateLimits; writers take 'lock'
+    # before touching the buckets.
+    def __init__(
+            self,
+            profile: IRCRateLimitProfile=TWITCH_RATE_LIMIT_PROFILE) -> None:
+        self.profile = profile
+        self.moderated_channels = set()
+        self.message_bucket = TokenBucket(
+                profile.messages, profile.messages_period_sec)
+        self.non_moderator_message_bucket = TokenBucket(
+                profile.non_moderator_messages,
+                profile.non_moderator_messages_period_sec)
+        self._channel_buckets = {}
+        self.join_bucket = TokenBucket(
+                profile.joins, profile.joins_period_sec)
+        self.lock = threading.Lock()
+
+    def set_channel_moderator(
+            self, channel_name: str, is_moderator: bool) -> None:
+        with self.lock:
+            if is_moderator:
+                self.moderated_channels.add(channel_name)
+            else:
+                self.moderated_channels.discard(channel_name)
+
+    def channel_bucket_for(self, channel_name: str) -> TokenBucket:
+        # Called with the lock held.
+        try:
+            return self._channel_buckets[channel_name]
+        except KeyError:
+            bucket = TokenBucket(
+                    self.profile.non_moderator_channel_messages,
+                    self.profile.non_moderator_channel_messages_period_sec)
+            self._channel_buckets[channel_name] = bucket
+            return bucket
+
+    def message_delay_sec(self, channel_name: str, now: float) -> float:
+        # Called with the lock held.
+        delay_sec = self.message_bucket.delay_sec(now)
+        if channel_name not in self.moderated_channels:
+            delay_sec = max(
+                    delay_sec,
+                    self.non_moderator_message_bucket.delay_sec(now),
+                    self.channel_bucket_for(channel_name).delay_sec(now))
+        return delay_sec
+
+    def take_message_tokens(self, channel_name: str) -> None:
+        # Called with the lock held.
+        self.message_bucket.take()
+        if channel_name not in self.moderated_channels:
+            self.non_moderator_message_bucket.take()
+            self.channel_bucket_for(channel_name).take()
+
+
+@dataclasses.dataclass
+class OutboundLine:
+    data: bytes
+    priority: int
+    future: concurrent.futures.Future
+    channel_name: Optional[str] = None
+    join_count: int = 0
+
+
+class IRCOutboundWriter:
+    def __init__(
+            self, send: Callable[[bytes], None],
+            profile: IRCRateLimitProfile=TWITCH_RATE_LIMIT_PROFILE,
+            rate_limits: Optional[IRCRateLimits]=None) -> None:
+        # 'send' writes bytes to the connection; see IRCClient.send_raw.
+        # Writers for the same account should share 'rate_limits'; a
+        # writer without one gets its own, built from 'profile'.
+        self._send = send
+        if rate_limits is None:
+            rate_limits = IRCRateLimits(profile)
+        self.rate_limits = rate_limits
+        self.profile = rate_limits.profile
+        self._queues = {
+                SEND_PRIORITY_REGISTRATION: collections.deque(),
+                SEND_PRIORITY_PONG: collections.deque(),
+                SEND_PRIORITY_MEMBERSHIP: collections.deque(),
+                SEND_PRIORITY_MESSAGE: collections.deque()}
+        self._condition = threading.Condition()
+        self._writer_thread = None
+        self._is_writing = False
+        # While set, only registration lines are written; see
+        # hold_for_registration.
+        self._is_registering = False
+        # Called after every enqueue, for writers driven by an event loop
+        # rather than their own thread.
+        self.on_enqueue = None
+        # Set by writers driven by an event loop, where 'send' only
+        # buffers: called with the byte count and future of each line
+        # buffered, in order, and resolves the futures once the lines are
+        # actually written. Otherwise the futures resolve after 'send'.
+        self.on_buffered = None
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self._queues.values())
+
+    def set_channel_moderator(
+            self, channel_name: str, is_moderator: bool) -> None:
+        self.rate_limits.set_channel_moderator(channel_name, is_moderator)
+
+    def hold_for_registration(self) -> None:
+        # Holds everything but registration lines until
+        # finish_registration, so lines queued for a connection that's
+        # being replaced can't reach the new one before its PASS and NICK.
+        with self._condition:
+            self._is_registering = True
+
+    def finish_registration(self) -> None:
+        with self._condition:
+            self._is_registering = False
+            self._condition.notify_all()
+        if self.on_enqueue is not None:
+            self.on_enqueue()
+
+    def enqueue(
+            self, line: str, priority: int,
+            channel_name: Optional[str]=None,
+            join_count: int=0) -> concurrent.futures.Future:
+        # Never blocks. The future resolves once the line is written, or
+        # holds the exception if writing failed.
+        future = concurrent.futures.Future()
+        outbound_line = OutboundLine(
+                f"{line}\r\n".encode(), priority, future, channel_name,
+                join_count)
+        with self._condition:
+            self._queues[priority].append(outbound_line)
+            self._condition.notify_all()
+        if self.on_enqueue is not None:
+            self.on_enqueue()
+        return future
+
+    def _collect_ready_lines(self, now: float) -> tuple:
+        # Returns the lines that may be written now, in priority order,
+        # and how long until the next held-back line may go.
+        with self.rate_limits.lock:
+            return self._collect_ready_lines_locked(now)
+
+    def _collect_ready_lines_locked(self, now: float) -> tuple:
+        rate_limits = self.rate_limits
+        ready_lines = []
+        ready_bytes = 0
+        next_delay_sec = None
+        for priority, queue in sorted(self._queues.items()):
+            if self._is_registering and (
+                    priority != SEND_PRIORITY_REGISTRATION):
+                break
+            blocked_channels = set()
+            held_lines = collections.deque()
+            while queue and ready_bytes < MAX_COALESCED_WRITE_BYTES:
+                outbound_line = queue.popleft()
+                if outbound_line.join_count:
+                    delay_sec = rate_limits.join_bucket.delay_sec(
+                            now, outbound_line.join_count)
+                elif priority == SEND_PRIORITY_MESSAGE:
+                    if outbound_line.channel_name in blocked_channels:
+                        # Keep messages to one channel in order.
+                        held_lines.append(outbound_line)
+                        continue
+                    delay_sec = rate_limits.message_delay_sec(
+                            outbound_line.channel_name, now)
+                else:
+                    delay_sec = 0.0
+                if delay_sec:
+                    held_lines.append(outbound_line)
+                    if next_delay_sec is None or delay_sec < next_delay_sec:
+                        next_delay_sec = delay_sec
+                    if priority != SEND_PRIORITY_MESSAGE:
+                        break
+                    blocked_channels.add(outbound_line.channel_name)
+                    continue
+                if outbound_line.join_count:
+                    rate_limits.join_bucket.take(outbound_line.join_count)
+                elif priority == SEND_PRIORITY_MESSAGE:
+                    rate_limits.take_message_tokens(
+                            outbound_line.channel_name)
+                ready_lines.append(outbound_line)
+                ready_bytes += len(outbound_line.data)
+            held_lines.extend(queue)
+            queue.clear()
+            queue.extend(held_lines)
+        return ready_lines, next_delay_sec
+
+    def write_ready(self) -> Optional[float]:
+        # Writes every line that is allowed out right now in a single
+        # send. Returns seconds until more can go, or None if idle.
+        with self._condition:
+            ready_lines, next_delay_sec = self._collect_ready_lines(
+                    time.monotonic())
+            if self._has_sendable_lines() and next_delay_sec is None:
+                next_delay_sec = 0.0
+        if ready_lines:
+            data = b"".join(x.data for x in ready_lines)
+            try:
+                self._send(data)
+            except Exception as e:
+                # The lines go out again on the next connection, except
+                # registration, which the next login queues afresh.
+                with self._condition:
+                    for outbound_line in reversed(ready_lines):
+                        if outbound_line.priority == (
+                                SEND_PRIORITY_REGISTRATION):
+                            outbound_line.future.set_exception(e)
+                        else:
+                            self._queues[outbound_line.priority].appendleft(
+                                    outbound_line)
+                raise
+            if self.on_buffered is not None:
+                self.on_buffered([
+                        (len(x.data), x.future) for x in ready_lines])
+            else:
+                for outbound_line in ready_lines:
+                    outbound_line.future.set_result(None)
+        return next_delay_sec
+
+    def _has_sendable_lines(self) -> bool:
+        # Called with the condition held.
+        if self._is_registering:
+            return bool(self._queues[SEND_PRIORITY_REGISTRATION])
+        return any(self._queues.values())
+
+    def start(self) -> None:
+        if self._writer_thread is not None:
+            return
+        self._is_writing = True
+        self._writer_thread = threading.Thread(
+                target=self._write_loop, daemon=True)
+        self._writer_thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._is_writing = False
+            self._condition.notify_all()
+        if self._writer_thread is not None:
+            self._writer_thread.join()
+            self._writer_thread = None
+
+    def _write_loop(self) -> None:
+        while self._is_writing:
+            try:
+                next_delay_sec = self.write_ready()
+            except Exception:
+                # diagnostic
+                print("IRC outbound writer failed to write:")
+                traceback.print_exc()
+                next_delay_sec = WRITE_RETRY_SEC
+            with self._condition:
+                if not self._is_writing:
+                    return
+                if next_delay_sec is None and not self._has_sendable_lines():
+                    self._condition.wait()
+                elif next_delay_sec:
+                    self._condition.wait(next_delay_sec)
@@ -0,0 +1,264 @@
+import selectors
+import socket
+import threading
+import time
+import traceback
+
+from typing import Callable, Dict, Optional
+
+from src.irc_client import (
+        IRCClient, IRCClientNotConnectedError, IRCMessage,
+        RemoteConnectionClosedError)
+from src.irc_client_listener import IRC_COMMAND_EVENT_MAP
+from src.streambrain import Event
+
+
+class ReactorConnection:
+    __slots__ = (
+            "irc_client", "event_source", "output_buffer", "socket",
+            "reconnect_thread")
+
+    def __init__(
+            self, irc_client: IRCClient, event_source: object,
+            output_buffer: bytearray) -> None:
+        self.irc_client = irc_client
+        self.event_source = event_source
+        self.output_buffer = output_buffer
+        self.socket = None
+        self.reconnect_thread = None
+
+
+class IRCReactor:
+    # Services any number of IRCClient connections from one thread. Read
+    # readiness, write readiness, the outbound writers' rate-limit delays
+    # and the clients' keepalive PINGs all come out of a single selector
+    # poll, and every message read is queued on StreamBrain as the usual
+    # IRCClient*Event. A message 'prefilter' rejects never becomes one.
+    # The 'process_event' given to start runs on the reactor thread and
+    # must not block; see create_brain in main.py for the overflow
+    # policies that keep StreamBrain.queue_event from blocking.
+    def __init__(
+            self,
+            prefilter: Optional[Callable[[IRCMessage], bool]]=None) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._connections: Dict[IRCClient, ReactorConnection] = {}
+        self._connections_lock = threading.Lock()
+        self._wake_receiver, self._wake_sender = socket.socketpair()
+        self._wake_receiver.setblocking(False)
+        self._wake_sender.setblocking(False)
+        self._selector.register(self._wake_receiver, selectors.EVENT_READ)
+        self._prefilter = prefilter
+        self._process_event = None
+        self._reactor_thread = None
+        self._is_running = False
+
+    def register(
+            self, irc_client: IRCClient,
+            event_source: Optional[object]=None) -> None:
+        # Events read from 'irc_client' name 'event_source' as their
+        # irc_client, so an IRCClientPool can stand in for its members.
+        output_buffer = irc_client.attach_output_buffer(self.wake)
+        reactor_connection = ReactorConnection(
+                irc_client, event_source or irc_client, output_buffer)
+        with self._connections_lock:
+            self._connections[irc_client] = reactor_connection
+        self.wake()
+
+    def unregister(self, irc_client: IRCClient) -> None:
+        with self._connections_lock:
+            self._connections.pop(irc_client, None)
+        self.wake()
+
+    def wake(self) -> None:
+        try:
+            self._wake_sender.send(b"\0")
+        except BlockingIOError:
+            # A wake-up is already pending.
+            pass
+
+    def start(self, process_event: Callable[[Event], None]) -> None:
+        self._process_event = process_event
+        self._is_running = True
+        self._reactor_thread = threading.Thread(
+                target=self._run, daemon=True)
+        self._reactor_thread.start()
+
+    def stop(self) -> None:
+        self._is_running = False
+        self.wake()
+        if self._reactor_thread is not None:
+            self._reactor_thread.join()
+            self._reactor_thread = None
+
+    def _run(self) -> None:
+        while self._is_running:
+            try:
+                timeout_sec = self._run_once()
+                self._service_ready(self._selector.select(timeout_sec))
+            except Exception:
+                # diagnostic
+                print("IRC reactor failed an iteration:")
+                traceback.print_exc()
+                time.sleep(.1)
+
+    def _service_ready(self, ready: list) -> None:
+        for selector_key, event_mask in ready:
+            reactor_connection = selector_key.data
+            if reactor_connection is None:
+                self._drain_wake_receiver()
+                continue
+            if event_mask & selectors.EVENT_READ:
+                self._read(reactor_connection)
+            # Reading may have found the connection closed.
+            if (
+                    event_mask & selectors.EVENT_WRITE
+                    and reactor_connection.socket is not None):
+                self._flush(reactor_connection)
+
+    def _run_once(self) -> Optional[float]:
+        # Brings selector registrations in line with the connections,
+        # moves rate-limited lines into the output buffers and checks
+        # keepalives. Returns how long the poll may block.
+        now = time.monotonic()
+        timeout_sec = None
+        registered = {
+                x.data.irc_client: x.data
+                for x in self._selector.get_map().values()
+                if x.data is not None}
+        with self._connections_lock:
+            reactor_connections = list(self._connections.values())
+        for irc_client, reactor_connection in registered.items():
+            if self._connections.get(irc_client) is not reactor_connection:
+                self._selector.unregister(reactor_connection.socket)
+                reactor_connection.socket = None
+        for reactor_connection in reactor_connections:
+            for delay_sec in (
+                    self._sync_registration(reactor_connection, now),
+                    self._service_keepalive(reactor_connection, now)):
+                if delay_sec is not None and (
+                        timeout_sec is None or delay_sec < timeout_sec):
+                    timeout_sec = delay_sec
+        return timeout_sec
+
+    def _sync_registration(
+            self, reactor_connection: ReactorConnection,
+            now: float) -> Optional[float]:
+        irc_client = reactor_connection.irc_client
+        reconnect_thread = reactor_connection.reconnect_thread
+        if reconnect_thread is not None and reconnect_thread.is_alive():
+            return None
+        reactor_connection.reconnect_thread = None
+        connection = irc_client.connection
+        if connection is not reactor_connection.socket:
+            if reactor_connection.socket is not None:
+                self._selector.unregister(reactor_connection.socket)
+                reactor_connection.socket = None
+            if connection is None:
+                return None
+            connection.setblocking(False)
+            self._selector.register(
+                    connection, selectors.EVENT_READ, reactor_connection)
+            reactor_connection.socket = connection
+        if connection is None:
+            return None
+        delay_sec = irc_client.write_queued()
+        if reactor_connection.output_buffer:
+            self._flush(reactor_connection)
+            if reactor_connection.socket is None:
+                return None
+        event_mask = selectors.EVENT_READ
+        if reactor_connection.output_buffer:
+            event_mask |= selectors.EVENT_WRITE
+        if self._selector.get_key(connection).events != event_mask:
+            self._selector.modify(connection, event_mask, reactor_connection)
+        return delay_sec
+
+    def _service_keepalive(
+            self, reactor_connection: ReactorConnection,
+            now: float) -> Optional[float]:
+        # An unresponsive connection is shut down by check_keepalive; the
+        # poll then reports it readable at EOF and _read reconnects it.
+        if reactor_connection.socket is None:
+            return None
+        return reactor_connection.irc_client.check_keepalive(now)
+
+    def _read(self, reactor_connection: ReactorConnection) -> None:
+        irc_client = reactor_connection.irc_client
+        try:
+            irc_messages = irc_client.read_available_messages()
+        except (BlockingIOError, IRCClientNotConnectedError):
+            return
+        except (OSError, RemoteConnectionClosedError) as e:
+            if irc_client.connection is reactor_connection.socket:
+                # diagnostic
+                print(f"{irc_client} lost its connection: {e!r}")
+                self._start_reconnect(reactor_connection)
+            return
+        prefilter = self._prefilter
+        for irc_message in irc_messages:
+            if irc_message.command == "PING":
+                irc_client.pong(irc_message.parameters)
+                continue
+            try:
+                event_type = IRC_COMMAND_EVENT_MAP[irc_message.command]
+            except KeyError:
+                continue
+            if prefilter is not None and not prefilter(irc_message):
+                continue
+            self._process_event(
+                    event_type(reactor_connection.event_source, irc_message))
+
+    def _flush(self, reactor_connection: ReactorConnection) -> None:
+        # Writes as much of the output buffer as the socket takes now.
+        if reactor_connection.socket is None:
+            return
+        output_buffer = reactor_connection.output_buffer
+        try:
+            sent_byte_count = reactor_connection.socket.send(output_buffer)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # diagnostic
+            print(f"{reactor_connection.irc_client} failed to write: {e!r}")
+            self._start_reconnect(reactor_connection)
+            return
+        del output_buffer[:sent_byte_count]
+        reactor_connection.irc_client.mark_flushed(sent_byte_count)
+
+    def _start_reconnect(self, reactor_connection: ReactorConnection) -> None:
+        # Connecting and logging in block, so they happen off the reactor
+        # thread; the connection is picked up again once it's back.
+        if reactor_connection.socket is not None:
+            self._selector.unregister(reactor_connection.socket)
+            reactor_connection.socket = None
+        reactor_connection.reconnect_thread = threading.Thread(
+                target=self._reconnect, args=(reactor_connection,),
+                daemon=True)
+        reactor_connection.reconnect_thread.start()
+
+    def _reconnect(self, reactor_connection: ReactorConnection) -> None:
+        irc_client = reactor_connection.irc_client
+        while self._is_running and irc_client in self._connections:
+            time.sleep(irc_client.retry_seconds)
+            try:
+                irc_client.reconnect()
+            except OSError:
+                # diagnostic
+                print(f"{irc_client} failed to reconnect:")
+                traceback.print_exc()
+                irc_client.retry_seconds = irc_client.retry_seconds * 2
+            else:
+                irc_client.retry_seconds = irc_client.default_retry_seconds
+                # This thread is still alive when the reactor wakes, so
+                # clear it first or the new connection waits for a poll
+                # that may never come.
+                reactor_connection.reconnect_thread = None
+                self.wake()
+                return
+
+    def _drain_wake_receiver(self) -> None:
+        try:
+            while self._wake_receiver.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
@@ -91,6 +91,7 @@ def get_league_standings(access_token: str, league_slug: str):
         standings_data = query_response["data"]["league"]["standings"]
         standings.extend(standings_data["nodes"])
         total_pages = standings_data["pageInfo"]["totalPages"]
-        if current_page == total_pages:
+        if current_page >= total_pages:
             break
+        current_page += 1
     return standings
@@ -0,0 +1,164 @@
+import concurrent.futures
+import threading
+import time
+import traceback
+
+import src.startgg as startgg
+
+from typing import Callable, Dict, Hashable, List, Optional
+
+from src.safe_web_api_call import safe_web_api_call
+
+
+DEFAULT_LEAGUE_EVENTS_TTL_SEC = 300
+DEFAULT_LEAGUE_STANDINGS_TTL_SEC = 300
+# How long past its TTL a response may still be served while a fresh one
+# is fetched in the background.
+DEFAULT_STALE_WHILE_REVALIDATE_SEC = 3600
+# After a background refresh fails, the stale response is served this
+# long before another refresh is tried.
+REFRESH_RETRY_SEC = 30
+
+
+class CachedResponse:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(
+            self, value: object, fresh_until: float,
+            stale_until: float) -> None:
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class ResponseCache:
+    # Remembers the results of slow calls by key. A fresh response is
+    # returned as is. A stale one is returned too, while one background
+    # thread fetches its replacement. Without a usable response the
+    # caller fetches it, and any other caller asking for the same key in
+    # the meantime waits on that same fetch instead of starting another.
+    # Cached values are shared between callers and mustn't be modified.
+    def __init__(
+            self,
+            stale_while_revalidate_sec: float=(
+                    DEFAULT_STALE_WHILE_REVALIDATE_SEC),
+            clock: Callable[[], float]=time.monotonic) -> None:
+        self.stale_while_revalidate_sec = stale_while_revalidate_sec
+        self._clock = clock
+        self._responses: Dict[Hashable, CachedResponse] = {}
+        self._in_flight: Dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def get(
+            self, key: Hashable, fetch: Callable[[], object],
+            ttl_sec: float) -> object:
+        now = self._clock()
+        with self._lock:
+            cached_response = self._responses.get(key)
+            if cached_response is not None:
+                if now < cached_response.fresh_until:
+                    return cached_response.value
+                if now < cached_response.stale_until:
+                    if key not in self._in_flight:
+                        future = concurrent.futures.Future()
+                        self._in_flight[key] = future
+                        threading.Thread(
+                                target=self._refresh,
+                                args=(key, fetch, ttl_sec, future),
+                                daemon=True).start()
+                    return cached_response.value
+            future = self._in_flight.get(key)
+            if future is None:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+                is_fetching = True
+            else:
+                is_fetching = False
+        if is_fetching:
+            self._fetch(key, fetch, ttl_sec, future)
+        return future.result()
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._responses.pop(key, None)
+
+    def _fetch(
+            self, key: Hashable, fetch: Callable[[], object],
+            ttl_sec: float, future: concurrent.futures.Future) -> None:
+        # Resolves 'future', the one in _in_flight[key]. The response is
+        # stored before the key leaves _in_flight, so no caller can miss
+        # both.
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+                cached_response = self._responses.get(key)
+                if cached_response is not None:
+                    # Hold off the next refresh, but never past the
+                    # point where the response is too stale to serve.
+                    cached_response.fresh_until = min(
+                            self._clock() + REFRESH_RETRY_SEC,
+                            cached_response.stale_until)
+            future.set_exception(e)
+            return
+        fetched_at = self._clock()
+        with self._lock:
+            self._responses[key] = CachedResponse(
+                    value, fetched_at + ttl_sec,
+                    fetched_at + ttl_sec + self.stale_while_revalidate_sec)
+            del self._in_flight[key]
+        future.set_result(value)
+
+    def _refresh(
+            self, key: Hashable, fetch: Callable[[], object],
+            ttl_sec: float, future: concurrent.futures.Future) -> None:
+        self._fetch(key, fetch, ttl_sec, future)
+        exception = future.exception()
+        if exception is not None:
+            # diagnostic
+            print(f"Non-critical: failed to refresh {key!r}:")
+            traceback.print_exception(
+                    type(exception), exception, exception.__traceback__)
+
+
+@safe_web_api_call
+def _fetch_league_events(
+        access_token: str, league_slug: str) -> List[Dict]:
+    return startgg.get_league_events(access_token, league_slug)
+
+
+@safe_web_api_call
+def _fetch_league_standings(
+        access_token: str, league_slug: str) -> List[Dict]:
+    return startgg.get_league_standings(access_token, league_slug)
+
+
+class StartggLeagueCache:
+    # start.gg league queries, cached by query and league slug. Event
+    # lists and standings change a few times an hour at most, so chat
+    # commands and promos can share one copy.
+    def __init__(
+            self, events_ttl_sec: float=DEFAULT_LEAGUE_EVENTS_TTL_SEC,
+            standings_ttl_sec: float=DEFAULT_LEAGUE_STANDINGS_TTL_SEC,
+            response_cache: Optional[ResponseCache]=None) -> None:
+        self.events_ttl_sec = events_ttl_sec
+        self.standings_ttl_sec = standings_ttl_sec
+        self.response_cache = response_cache or ResponseCache()
+
+    def get_league_events(
+            self, access_token: str, league_slug: str) -> List[Dict]:
+        return self.response_cache.get(
+                ("league_events", league_slug),
+                lambda: _fetch_league_events(access_token, league_slug),
+                self.events_ttl_sec)
+
+    def get_league_standings(
+            self, access_token: str, league_slug: str) -> List[Dict]:
+        return self.response_cache.get(
+                ("league_standings", league_slug),
+                lambda: _fetch_league_standings(access_token, league_slug),
+                self.standings_ttl_sec)
+
+
+startgg_league_cache = StartggLeagueCache()
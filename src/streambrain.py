@@ -1,13 +1,72 @@
+import collections
 import datetime
+import itertools
 import threading
 import time
+import traceback
 import typing
 
 
+# Events are stamped with the cheap monotonic clock. This offset, taken
+# once at import, turns a stamp back into wall-clock time on demand.
+MONOTONIC_TO_WALL_CLOCK_NS = time.time_ns() - time.monotonic_ns()
+
+
 class Event:
+    # Subclasses should declare __slots__ too, or every instance gets a
+    # __dict__ again.
+    __slots__ = ("message", "created_ns")
+
     def __init__(self, message: object) -> None:
         self.message = message
-        self.created_at = datetime.datetime.now()
+        self.created_ns = time.monotonic_ns()
+
+    @property
+    def created_at(self) -> datetime.datetime:
+        created_wall_clock_ns = self.created_ns + MONOTONIC_TO_WALL_CLOCK_NS
+        return datetime.datetime.fromtimestamp(created_wall_clock_ns / 1e9)
+
+    def coalesce_key(self) -> typing.Optional[typing.Hashable]:
+        # Queued events with equal, non-None keys are duplicates that an
+        # overloaded queue may merge into one.
+        return None
+
+    def partition_key(self) -> typing.Optional[typing.Hashable]:
+        # Events with equal partition keys are handled in order, one at
+        # a time, when StreamBrain dispatches by partition.
+        return None
+
+
+def event_partition_key(streambrain_event: Event) \
+        -> typing.Optional[typing.Hashable]:
+    return streambrain_event.partition_key()
+
+
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+# Handlers that keep the connection alive (PONGs, re-logins) get their
+# own lane, so they never wait behind network-bound chat commands.
+DEFAULT_LANE_LATENCY_BUDGETS_SEC = {
+        PRIORITY_CRITICAL: .5, PRIORITY_NORMAL: 5,
+        PRIORITY_BACKGROUND: None}
+
+
+# What an EventQueue does with an event once it is full: make the
+# producer wait, shed the incoming event, shed the oldest queued event,
+# or shed the incoming event only if an equal one is already queued.
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_POLICIES = (
+        OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST,
+        OVERFLOW_COALESCE)
+
+
+class EventQueueClosedError(Exception):
+    pass
 
 
 class Listener:
@@ -21,17 +80,31 @@ class Listener:
 
 
 class ListenThread(threading.Thread):
-    def __init__(self, listener: Listener, process_event: callable) -> None:
+    def __init__(
+            self, listener: Listener, process_event: callable,
+            metrics: typing.Optional[object]=None) -> None:
         self.listener = listener
         self.process_event = process_event
+        self.metrics = metrics
         self._is_listening = False
         super().__init__()
 
     def run(self) -> None:
         self._is_listening = True
         while self._is_listening:
-            for event in self.listener.listen():
-                self.process_event(event)
+            listen_started_at = time.perf_counter()
+            events = self.listener.listen()
+            if self.metrics is not None:
+                self.metrics.observe_listen(
+                        self.listener,
+                        time.perf_counter() - listen_started_at,
+                        len(events))
+            for event in events:
+                try:
+                    self.process_event(event)
+                except EventQueueClosedError:
+                    self._is_listening = False
+                    break
             time.sleep(self.listener.sleep_sec)
 
     def stop(self) -> None:
@@ -39,52 +112,475 @@ class ListenThread(threading.Thread):
 
 
 class Handler:
-    def __init__(self, handles_type: typing.Type[Event]) -> None:
+    def __init__(
+            self, handles_type: typing.Type[Event],
+            event_filters: typing.Optional[typing.Dict[str, object]]=None,
+            predicate: typing.Optional[callable]=None,
+            priority: int=PRIORITY_NORMAL) -> None:
+        # 'handles_type' matches subclasses too. 'event_filters' maps
+        # event attribute names to the values they must equal, e.g.
+        # {"irc_client": irc_client}, and 'predicate' is an optional
+        # last check, so handle() only sees events it will act on.
+        # 'priority' picks the StreamBrain lane the handler runs on.
         self.handles_type = handles_type
+        self.event_filters = tuple((event_filters or {}).items())
+        self.predicate = predicate
+        self.priority = priority
+
+    def accepts(self, streambrain_event: Event) -> bool:
+        for attribute_name, required_value in self.event_filters:
+            event_value = getattr(streambrain_event, attribute_name, None)
+            if event_value != required_value:
+                return False
+        return self.predicate is None or self.predicate(streambrain_event)
 
     def handle(self, streambrain_event: Event) -> None:
         pass
 
 
-class StreamBrain:
+class SubscriptionIndex:
     def __init__(self) -> None:
-        self._event_handler_map = {}
-        self._event_queue = []
-        self._is_processing_event_queue = False
+        self._handlers = ()
+        self._groups_by_type = {}
+        self._lock = threading.Lock()
+
+    def add(self, handler: Handler) -> None:
+        with self._lock:
+            self._handlers = self._handlers + (handler,)
+            self._groups_by_type = {}
+
+    def remove(self, handler: Handler) -> None:
+        with self._lock:
+            self._handlers = tuple(
+                    x for x in self._handlers if x is not handler)
+            self._groups_by_type = {}
+
+    def handler_groups_for(
+            self, event_type: typing.Type[Event]) \
+                    -> typing.Tuple[typing.Tuple[int, typing.Tuple[Handler]]]:
+        # Lookups read an immutable snapshot without locking. Misses
+        # resolve the type hierarchy once and publish a new copy of the
+        # index, so dispatching never copies handler lists per event.
+        # Handlers are grouped by priority, in activation order.
+        try:
+            return self._groups_by_type[event_type]
+        except KeyError:
+            pass
+        with self._lock:
+            handlers_by_priority = {}
+            for handler in self._handlers:
+                if issubclass(event_type, handler.handles_type):
+                    handlers_by_priority.setdefault(
+                            handler.priority, []).append(handler)
+            type_groups = tuple(
+                    (priority, tuple(handlers))
+                    for priority, handlers
+                    in sorted(handlers_by_priority.items()))
+            groups_by_type = self._groups_by_type.copy()
+            groups_by_type[event_type] = type_groups
+            self._groups_by_type = groups_by_type
+        return type_groups
+
+
+class EventQueue:
+    def __init__(
+            self, max_size: int=1024,
+            default_overflow_policy: str=OVERFLOW_BLOCK,
+            on_shed: typing.Optional[callable]=None,
+            key_function: typing.Optional[callable]=None,
+            max_in_flight_keys: typing.Optional[int]=None) -> None:
+        # Entries are tuples whose first item is the queued Event. Once
+        # 'max_size' entries are waiting, the overflow policy for the
+        # incoming event's type decides what happens to it.
+        # With a 'key_function', entries that share a key are taken one
+        # at a time, in order: a key is in flight from take() until
+        # done(), and keys waiting for a dispatcher take turns.
+        self.max_size = max_size
+        self.default_overflow_policy = default_overflow_policy
+        self.key_function = key_function
+        self.max_in_flight_keys = max_in_flight_keys
+        self.shed_counts = collections.Counter()
+        self._on_shed = on_shed
+        self._overflow_policies = {}
+        self._resolved_overflow_policies = {}
+        self._size = 0
+        self._sequence = itertools.count()
+        # Invariant: a key has a deque while it has entries or is in
+        # flight, and is in '_ready_keys' while it has entries and is
+        # not in flight.
+        self._entries_by_key = {}
+        self._ready_keys = collections.deque()
+        self._in_flight_keys = set()
+        self._queued_coalesce_keys = collections.Counter()
+        self._is_closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def in_flight_key_count(self) -> int:
+        return len(self._in_flight_keys)
+
+    def set_overflow_policy(
+            self, event_type: typing.Type[Event], policy: str) -> None:
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}.")
+        with self._condition:
+            self._overflow_policies[event_type] = policy
+            self._resolved_overflow_policies = {}
+
+    def overflow_policy_for(self, event_type: typing.Type[Event]) -> str:
+        # Policies apply to subclasses; the nearest configured type wins.
+        try:
+            return self._resolved_overflow_policies[event_type]
+        except KeyError:
+            pass
+        policy = self.default_overflow_policy
+        for base_type in event_type.__mro__:
+            if base_type in self._overflow_policies:
+                policy = self._overflow_policies[base_type]
+                break
+        self._resolved_overflow_policies[event_type] = policy
+        return policy
+
+    def _shed(self, streambrain_event: Event) -> None:
+        event_type_name = type(streambrain_event).__name__
+        self.shed_counts[event_type_name] += 1
+        if self._on_shed is not None:
+            self._on_shed(streambrain_event)
+
+    def _forget_coalesce_key(
+            self, coalesce_key: typing.Optional[typing.Hashable]) -> None:
+        if coalesce_key is not None:
+            self._queued_coalesce_keys[coalesce_key] -= 1
+            if not self._queued_coalesce_keys[coalesce_key]:
+                del self._queued_coalesce_keys[coalesce_key]
+
+    def _pop_oldest(self) -> tuple:
+        # Only used for shedding, so a scan over the waiting keys is
+        # fine here.
+        oldest_key = min(
+                (x for x, entries in self._entries_by_key.items() if entries),
+                key=lambda x: self._entries_by_key[x][0][0])
+        entries = self._entries_by_key[oldest_key]
+        sequence, entry, coalesce_key = entries.popleft()
+        self._size -= 1
+        self._forget_coalesce_key(coalesce_key)
+        if not entries and oldest_key not in self._in_flight_keys:
+            self._ready_keys.remove(oldest_key)
+            del self._entries_by_key[oldest_key]
+        return entry
+
+    def put(self, entry: tuple) -> bool:
+        # Returns False if the entry was shed instead of queued.
+        streambrain_event = entry[0]
+        policy = self.overflow_policy_for(type(streambrain_event))
+        if policy == OVERFLOW_COALESCE:
+            coalesce_key = streambrain_event.coalesce_key()
+        else:
+            coalesce_key = None
+        if self.key_function is not None:
+            key = self.key_function(streambrain_event)
+        else:
+            key = None
+        with self._condition:
+            if self._size >= self.max_size:
+                if policy == OVERFLOW_BLOCK:
+                    while self._size >= self.max_size \
+                            and not self._is_closed:
+                        self._condition.wait()
+                elif policy == OVERFLOW_DROP_NEWEST or (
+                        coalesce_key is not None
+                        and coalesce_key in self._queued_coalesce_keys):
+                    self._shed(streambrain_event)
+                    return False
+                else:
+                    # Drop-oldest, and coalesce with nothing to merge
+                    # into, both make room by shedding the oldest entry.
+                    self._shed(self._pop_oldest()[0])
+            if self._is_closed:
+                raise EventQueueClosedError
+            entries = self._entries_by_key.get(key)
+            if entries is None:
+                entries = self._entries_by_key[key] = collections.deque()
+            if not entries and key not in self._in_flight_keys:
+                self._ready_keys.append(key)
+            entries.append((next(self._sequence), entry, coalesce_key))
+            self._size += 1
+            if coalesce_key is not None:
+                self._queued_coalesce_keys[coalesce_key] += 1
+            self._condition.notify_all()
+            return True
+
+    def _can_take(self) -> bool:
+        if not self._ready_keys:
+            return False
+        return self.max_in_flight_keys is None \
+                or len(self._in_flight_keys) < self.max_in_flight_keys
+
+    def take(self) -> typing.Tuple[typing.Hashable, tuple]:
+        # Returns the entry's key along with it; pass the key to done()
+        # once the entry has been handled.
+        with self._condition:
+            while not self._can_take() and not self._is_closed:
+                self._condition.wait()
+            if not self._can_take():
+                raise EventQueueClosedError
+            key = self._ready_keys[0]
+            entries = self._entries_by_key[key]
+            sequence, entry, coalesce_key = entries.popleft()
+            self._size -= 1
+            self._forget_coalesce_key(coalesce_key)
+            if self.key_function is not None:
+                self._ready_keys.popleft()
+                self._in_flight_keys.add(key)
+            elif not entries:
+                self._ready_keys.popleft()
+                del self._entries_by_key[key]
+            self._condition.notify_all()
+            return key, entry
+
+    def done(self, key: typing.Hashable) -> None:
+        if self.key_function is None:
+            return
+        with self._condition:
+            self._in_flight_keys.discard(key)
+            if self._entries_by_key[key]:
+                self._ready_keys.append(key)
+            else:
+                del self._entries_by_key[key]
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+
+
+class LaneLatency:
+    def __init__(self, budget_sec: typing.Optional[float]=None) -> None:
+        self.budget_sec = budget_sec
+        self.count = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+        self.over_budget_count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, delay_sec: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total_sec += delay_sec
+            if delay_sec > self.max_sec:
+                self.max_sec = delay_sec
+            if self.budget_sec is not None and delay_sec > self.budget_sec:
+                self.over_budget_count += 1
+
+    def snapshot(self) -> typing.Dict[str, float]:
+        with self._lock:
+            mean_sec = self.total_sec / self.count if self.count else 0.0
+            return {
+                    "count": self.count, "mean_sec": mean_sec,
+                    "max_sec": self.max_sec,
+                    "over_budget_count": self.over_budget_count}
+
+
+class DispatchLane:
+    def __init__(
+            self, priority: int, max_queue_size: int,
+            dispatcher_count: int,
+            latency_budget_sec: typing.Optional[float]=None,
+            metrics: typing.Optional[object]=None,
+            partition_key: typing.Optional[callable]=None,
+            max_in_flight_keys: typing.Optional[int]=None) -> None:
+        # 'max_in_flight_keys' caps how many partition keys are handled at
+        # once, and defaults to one per dispatcher.
+        self.priority = priority
+        self.dispatcher_count = dispatcher_count
+        if metrics is not None:
+            on_shed = metrics.observe_shed
+        else:
+            on_shed = None
+        if max_in_flight_keys is None:
+            max_in_flight_keys = dispatcher_count
+        self.event_queue = EventQueue(
+                max_queue_size, on_shed=on_shed, key_function=partition_key,
+                max_in_flight_keys=max_in_flight_keys)
+        self.latency = LaneLatency(latency_budget_sec)
+        self.metrics = metrics
+        self._dispatch_threads = []
+
+    def put(
+            self, streambrain_event: Event,
+            handlers: typing.Tuple[Handler]) -> None:
+        self.event_queue.put((streambrain_event, handlers, time.monotonic()))
+
+    def dispatch(self, entry: tuple) -> None:
+        streambrain_event, handlers, queued_at = entry
+        delay_sec = time.monotonic() - queued_at
+        self.latency.observe(delay_sec)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.observe_queue_delay(type(streambrain_event), delay_sec)
+        budget_sec = self.latency.budget_sec
+        if budget_sec is not None and delay_sec > budget_sec:
+            # diagnostic
+            print(
+                    f"Lane {self.priority} dispatched "
+                    f"{type(streambrain_event).__name__} {delay_sec:.3f} "
+                    f"seconds after it was queued.")
+        for handler in handlers:
+            if not handler.accepts(streambrain_event):
+                continue
+            handle_started_at = time.perf_counter()
+            try:
+                handler.handle(streambrain_event)
+            except Exception:
+                # diagnostic
+                print(
+                        f"{type(handler).__name__} failed on "
+                        f"{type(streambrain_event).__name__}:")
+                traceback.print_exc()
+            if metrics is not None:
+                metrics.observe_handler(
+                        handler, time.perf_counter() - handle_started_at)
+
+    def start(self) -> None:
+        while len(self._dispatch_threads) < self.dispatcher_count:
+            dispatch_thread = DispatchThread(self.event_queue, self.dispatch)
+            self._dispatch_threads.append(dispatch_thread)
+            dispatch_thread.start()
+
+    def stop(self) -> None:
+        self.event_queue.close()
+        while self._dispatch_threads:
+            self._dispatch_threads.pop().join()
+
+
+class DispatchThread(threading.Thread):
+    def __init__(self, event_queue: EventQueue, dispatch: callable) -> None:
+        self.event_queue = event_queue
+        self.dispatch = dispatch
+        super().__init__(daemon=True)
+
+    def run(self) -> None:
+        while True:
+            try:
+                key, entry = self.event_queue.take()
+            except EventQueueClosedError:
+                return
+            try:
+                self.dispatch(entry)
+            finally:
+                self.event_queue.done(key)
+
+
+class StreamBrain:
+    def __init__(
+            self, max_queue_size: int=1024, dispatcher_count: int=1,
+            lane_latency_budgets_sec: typing.Optional[
+                    typing.Dict[int, typing.Optional[float]]]=None,
+            metrics: typing.Optional[object]=None,
+            journal: typing.Optional[object]=None,
+            partition_key: typing.Optional[callable]=None,
+            max_in_flight_keys: typing.Optional[int]=None) -> None:
+        # Each priority gets its own lane: a bounded queue drained by
+        # its own dispatchers. 'dispatcher_count' applies to the normal
+        # lane; critical and background lanes get one dispatcher each.
+        # 'metrics' is an optional StreamBrainMetrics to record into,
+        # and 'journal' an optional EventJournalWriter that records
+        # every queued event for later replay.
+        # With a 'partition_key' function (e.g. event_partition_key),
+        # the normal lane handles events with the same key in order and
+        # different keys in parallel, up to 'max_in_flight_keys' at once
+        # ('dispatcher_count' if not given).
+        if lane_latency_budgets_sec is None:
+            lane_latency_budgets_sec = DEFAULT_LANE_LATENCY_BUDGETS_SEC
+        self._subscription_index = SubscriptionIndex()
+        self._lanes = {}
+        for priority, budget_sec in lane_latency_budgets_sec.items():
+            lane_dispatcher_count = (
+                    dispatcher_count if priority == PRIORITY_NORMAL else 1)
+            if priority == PRIORITY_NORMAL:
+                lane = DispatchLane(
+                        priority, max_queue_size, lane_dispatcher_count,
+                        budget_sec, metrics, partition_key,
+                        max_in_flight_keys)
+            else:
+                lane = DispatchLane(
+                        priority, max_queue_size, lane_dispatcher_count,
+                        budget_sec, metrics)
+            self._lanes[priority] = lane
+            if metrics is not None:
+                metrics.queue_depth.set_source(
+                        str(priority), lane.event_queue.__len__)
+        self.metrics = metrics
+        self.journal = journal
         self._listen_threads = []
 
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(lane.event_queue) for lane in self._lanes.values())
+
+    def set_overflow_policy(
+            self, event_type: typing.Type[Event], policy: str) -> None:
+        for lane in self._lanes.values():
+            lane.event_queue.set_overflow_policy(event_type, policy)
+
+    def shed_counts(self) -> typing.Dict[str, int]:
+        total_shed_counts = collections.Counter()
+        for lane in self._lanes.values():
+            total_shed_counts.update(lane.event_queue.shed_counts)
+        return dict(total_shed_counts)
+
+    def lane_latencies(self) -> typing.Dict[int, typing.Dict[str, float]]:
+        return {
+                priority: lane.latency.snapshot()
+                for priority, lane in self._lanes.items()}
+
     def start_listening(self, listener: Listener) -> ListenThread:
-        listen_thread = ListenThread(listener, self.queue_event)
+        self.start_dispatching()
+        listen_thread = ListenThread(
+                listener, self.queue_event, self.metrics)
         self._listen_threads.append(listen_thread)
         listen_thread.start()
         return listen_thread
 
+    def start_dispatching(self) -> None:
+        for lane in self._lanes.values():
+            lane.start()
+
     def stop(self) -> None:
         while self._listen_threads:
             self._listen_threads.pop().stop()
+        for lane in self._lanes.values():
+            lane.stop()
 
-    def activate_handler(self, handler) -> None:
-        if handler.handles_type not in self._event_handler_map:
-            self._event_handler_map[handler.handles_type] = []
-        self._event_handler_map[handler.handles_type].append(handler)
+    def activate_handler(self, handler: Handler) -> None:
+        if handler.priority not in self._lanes:
+            raise ValueError(f"No StreamBrain lane for {handler.priority}.")
+        self._subscription_index.add(handler)
+
+    def deactivate_handler(self, handler: Handler) -> None:
+        self._subscription_index.remove(handler)
 
     def queue_event(
             self, streambrain_event: Event) -> None:
-        self._event_queue.append(streambrain_event)
-        if not self._is_processing_event_queue:
-            self.process_event_queue()
-
-    def process_event_queue(self) -> None:
-        self._is_processing_event_queue = True
-        while self._event_queue:
-            queued_event = self._event_queue.pop(0)
-            event_type = type(queued_event)
-            try:
-                handlers_snapshot = (
-                        self._event_handler_map[event_type].copy())
-            except KeyError:
-                # No handlers for this type of event.
-                continue
-            for handler in handlers_snapshot:
-                handler.handle(queued_event)
-        self._is_processing_event_queue = False
+        # Called from listener threads: only enqueue, never handle here,
+        # so a slow handler can't stall the listener that produced the
+        # event.
+        if self.journal is not None:
+            self.journal.record(streambrain_event)
+        handler_groups = self._subscription_index.handler_groups_for(
+                type(streambrain_event))
+        for priority, handlers in handler_groups:
+            self._lanes[priority].put(streambrain_event, handlers)
+
+    def dispatch_event(self, streambrain_event: Event) -> None:
+        # Runs every lane's handlers for the event inline, in priority
+        # order, on the calling thread.
+        handler_groups = self._subscription_index.handler_groups_for(
+                type(streambrain_event))
+        for priority, handlers in handler_groups:
+            self._lanes[priority].dispatch(
+                    (streambrain_event, handlers, time.monotonic()))
@@ -0,0 +1,239 @@
+import bisect
+import http.server
+import json
+import threading
+import typing
+
+
+DEFAULT_LATENCY_BUCKETS_SEC = (
+        .0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(
+            self,
+            bucket_bounds: typing.Sequence[float]=DEFAULT_LATENCY_BUCKETS_SEC
+            ) -> None:
+        self.bucket_bounds = tuple(bucket_bounds)
+        # One extra bucket for observations above the largest bound.
+        self.bucket_counts = [0] * (len(self.bucket_bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        bucket_index = bisect.bisect_left(self.bucket_bounds, value)
+        with self._lock:
+            self.bucket_counts[bucket_index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> typing.Dict[str, object]:
+        with self._lock:
+            bucket_counts = self.bucket_counts.copy()
+            count = self.count
+            total = self.sum
+        cumulative_buckets = []
+        running_count = 0
+        for bound, bucket_count in zip(self.bucket_bounds, bucket_counts):
+            running_count += bucket_count
+            cumulative_buckets.append((bound, running_count))
+        return {"buckets": cumulative_buckets, "count": count, "sum": total}
+
+
+class HistogramFamily:
+    # Histograms of one metric, keyed by a single label value.
+    def __init__(
+            self, name: str, label_name: str, help_str: str,
+            bucket_bounds: typing.Sequence[float]=DEFAULT_LATENCY_BUCKETS_SEC
+            ) -> None:
+        self.name = name
+        self.label_name = label_name
+        self.help_str = help_str
+        self.bucket_bounds = bucket_bounds
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        try:
+            histogram = self._histograms[label_value]
+        except KeyError:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                        label_value, Histogram(self.bucket_bounds))
+        histogram.observe(value)
+
+    def snapshot(self) -> typing.Dict[str, typing.Dict[str, object]]:
+        return {
+                label_value: histogram.snapshot()
+                for label_value, histogram
+                in list(self._histograms.items())}
+
+    def render_prometheus(self) -> typing.List[str]:
+        lines = [
+                f"# HELP {self.name} {self.help_str}",
+                f"# TYPE {self.name} histogram"]
+        for label_value, snapshot in self.snapshot().items():
+            label = f'{self.label_name}="{_escape_label(label_value)}"'
+            for bound, count in snapshot["buckets"]:
+                lines.append(
+                        f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(
+                    f'{self.name}_bucket{{{label},le="+Inf"}} '
+                    f'{snapshot["count"]}')
+            lines.append(f'{self.name}_sum{{{label}}} {snapshot["sum"]}')
+            lines.append(f'{self.name}_count{{{label}}} {snapshot["count"]}')
+        return lines
+
+
+class CounterFamily:
+    def __init__(self, name: str, label_name: str, help_str: str) -> None:
+        self.name = name
+        self.label_name = label_name
+        self.help_str = help_str
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def increment(self, label_value: str, amount: int=1) -> None:
+        with self._lock:
+            self._counts[label_value] = (
+                    self._counts.get(label_value, 0) + amount)
+
+    def snapshot(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return self._counts.copy()
+
+    def render_prometheus(self) -> typing.List[str]:
+        lines = [
+                f"# HELP {self.name} {self.help_str}",
+                f"# TYPE {self.name} counter"]
+        for label_value, count in self.snapshot().items():
+            label = f'{self.label_name}="{_escape_label(label_value)}"'
+            lines.append(f"{self.name}{{{label}}} {count}")
+        return lines
+
+
+class GaugeFamily:
+    # Gauges are read from callables when a snapshot is taken, so the
+    # hot path never has to update them.
+    def __init__(self, name: str, label_name: str, help_str: str) -> None:
+        self.name = name
+        self.label_name = label_name
+        self.help_str = help_str
+        self._sources = {}
+
+    def set_source(self, label_value: str, source: callable) -> None:
+        self._sources[label_value] = source
+
+    def snapshot(self) -> typing.Dict[str, float]:
+        return {
+                label_value: source()
+                for label_value, source in list(self._sources.items())}
+
+    def render_prometheus(self) -> typing.List[str]:
+        lines = [
+                f"# HELP {self.name} {self.help_str}",
+                f"# TYPE {self.name} gauge"]
+        for label_value, value in self.snapshot().items():
+            label = f'{self.label_name}="{_escape_label(label_value)}"'
+            lines.append(f"{self.name}{{{label}}} {value}")
+        return lines
+
+
+class StreamBrainMetrics:
+    def __init__(self) -> None:
+        self.queue_delay = HistogramFamily(
+                "streambrain_queue_delay_seconds", "event_type",
+                "Time from queue_event() until dispatch.")
+        self.handler_duration = HistogramFamily(
+                "streambrain_handler_duration_seconds", "handler",
+                "Time spent in Handler.handle().")
+        self.listen_duration = HistogramFamily(
+                "streambrain_listen_duration_seconds", "listener",
+                "Time spent in Listener.listen().")
+        self.listen_events = CounterFamily(
+                "streambrain_listen_events_total", "listener",
+                "Events returned by Listener.listen().")
+        self.shed_events = CounterFamily(
+                "streambrain_shed_events_total", "event_type",
+                "Events dropped or coalesced by an overflowing queue.")
+        self.queue_depth = GaugeFamily(
+                "streambrain_queue_depth", "lane",
+                "Events waiting in a dispatch lane.")
+        self._families = [
+                self.queue_delay, self.handler_duration, self.listen_duration,
+                self.listen_events, self.shed_events, self.queue_depth]
+
+    def add_family(self, family: object) -> None:
+        self._families.append(family)
+
+    def observe_queue_delay(
+            self, event_type: type, delay_sec: float) -> None:
+        self.queue_delay.observe(event_type.__name__, delay_sec)
+
+    def observe_handler(self, handler: object, duration_sec: float) -> None:
+        self.handler_duration.observe(type(handler).__name__, duration_sec)
+
+    def observe_listen(
+            self, listener: object, duration_sec: float,
+            event_count: int) -> None:
+        listener_name = type(listener).__name__
+        self.listen_duration.observe(listener_name, duration_sec)
+        self.listen_events.increment(listener_name, event_count)
+
+    def observe_shed(self, streambrain_event: object) -> None:
+        self.shed_events.increment(type(streambrain_event).__name__)
+
+    def snapshot(self) -> typing.Dict[str, dict]:
+        return {family.name: family.snapshot() for family in self._families}
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for family in self._families:
+            lines.extend(family.render_prometheus())
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(label_value: str) -> str:
+    return (
+            str(label_value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self) -> None:
+        if self.path == "/metrics":
+            body = self.metrics.render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/snapshot":
+            body = json.dumps(self.metrics.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Scrapes are frequent; don't print a line for each one.
+        pass
+
+
+def start_metrics_server(
+        metrics: StreamBrainMetrics, port: int=9108,
+        host: str="127.0.0.1") -> http.server.ThreadingHTTPServer:
+    # Serves Prometheus text at /metrics and JSON at /snapshot from a
+    # daemon thread. Call shutdown() on the returned server to stop it.
+    request_handler = type(
+            "BoundMetricsRequestHandler", (MetricsRequestHandler,),
+            {"metrics": metrics})
+    server = http.server.ThreadingHTTPServer((host, port), request_handler)
+    server_thread = threading.Thread(
+            target=server.serve_forever, daemon=True)
+    server_thread.start()
+    return server
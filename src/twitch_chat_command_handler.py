@@ -1,66 +1,336 @@
-import src.startgg as startgg
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+import traceback
 
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
 
+from src.bot_state_store import BotStateStore
 from src.irc_client import IRCClient
 from src.irc_client_listener import IRCClientPrivateMessageEvent
-from src.safe_web_api_call import safe_web_api_call
+from src.startgg_cache import startgg_league_cache
 from src.streambrain import Handler
 
 
-@safe_web_api_call
 def get_startgg_league_events(
         access_token: str, league_slug: str) -> List[Dict]:
-    return startgg.get_league_events(access_token, league_slug)
+    return startgg_league_cache.get_league_events(access_token, league_slug)
 
 
-@safe_web_api_call
 def get_startgg_league_standings(
         access_token: str, league_slug: str) -> List[Dict]:
-    return startgg.get_league_standings(access_token, league_slug)
+    return startgg_league_cache.get_league_standings(
+            access_token, league_slug)
+
+
+def is_chat_command(
+        irc_client_event: IRCClientPrivateMessageEvent) -> bool:
+    return irc_client_event.irc_message.trailing_starts_with("!")
+
+
+DEFAULT_COMMAND_WORKER_COUNT = 4
+# Blocking commands that may wait for a worker, per worker; any more are
+# dropped.
+MAX_QUEUED_COMMANDS_PER_WORKER = 4
+DEFAULT_BLOCKING_COMMAND_TIMEOUT_SEC = 10
+DEFAULT_TIMEOUT_REPLY = (
+        "start.gg is taking a while to answer. Try again in a minute!")
+DEFAULT_FAILURE_REPLY = (
+        "Something went wrong looking that up. Try again later!")
+
+
+class ChatCommand:
+    # A command's method and how often it may run. A cooldown of 0 means
+    # that scope isn't limited. 'user_cooldown_sec' applies to a sender
+    # across every channel. A 'blocking' command runs on a worker thread
+    # and returns its reply instead of sending it; if it takes longer
+    # than 'timeout_sec', 'timeout_reply' is sent in its place, and if it
+    # raises, 'failure_reply' is.
+    __slots__ = (
+            "name", "method_name", "global_cooldown_sec",
+            "channel_cooldown_sec", "user_cooldown_sec", "blocking",
+            "timeout_sec", "timeout_reply", "failure_reply")
+
+    def __init__(
+            self, name: str, method_name: str,
+            global_cooldown_sec: float=0, channel_cooldown_sec: float=0,
+            user_cooldown_sec: float=0, blocking: bool=False,
+            timeout_sec: float=DEFAULT_BLOCKING_COMMAND_TIMEOUT_SEC,
+            timeout_reply: str=DEFAULT_TIMEOUT_REPLY,
+            failure_reply: str=DEFAULT_FAILURE_REPLY) -> None:
+        self.name = name
+        self.method_name = method_name
+        self.global_cooldown_sec = global_cooldown_sec
+        self.channel_cooldown_sec = channel_cooldown_sec
+        self.user_cooldown_sec = user_cooldown_sec
+        self.blocking = blocking
+        self.timeout_sec = timeout_sec
+        self.timeout_reply = timeout_reply
+        self.failure_reply = failure_reply
+
+
+class ChatCommandRegistry:
+    # Maps a chat message's first word, lowercased, to its ChatCommand.
+    # Methods register themselves with the 'command' decorator.
+    def __init__(self) -> None:
+        self._commands: Dict[str, ChatCommand] = {}
+
+    def command(
+            self, name: str, *aliases: str, global_cooldown_sec: float=0,
+            channel_cooldown_sec: float=0, user_cooldown_sec: float=0,
+            blocking: bool=False,
+            timeout_sec: float=DEFAULT_BLOCKING_COMMAND_TIMEOUT_SEC,
+            timeout_reply: str=DEFAULT_TIMEOUT_REPLY,
+            failure_reply: str=DEFAULT_FAILURE_REPLY
+            ) -> Callable[[Callable], Callable]:
+        def register(method: Callable) -> Callable:
+            chat_command = ChatCommand(
+                    name, method.__name__, global_cooldown_sec,
+                    channel_cooldown_sec, user_cooldown_sec, blocking,
+                    timeout_sec, timeout_reply, failure_reply)
+            for command_word in (name, *aliases):
+                if command_word in self._commands:
+                    raise ValueError(
+                            f"'{command_word}' is already registered.")
+                self._commands[command_word] = chat_command
+            return method
+        return register
+
+    def get(self, command_word: str) -> Optional[ChatCommand]:
+        return self._commands.get(command_word)
+
+    def commands(self) -> List[ChatCommand]:
+        # Each command once, however many aliases it has.
+        return list({id(x): x for x in self._commands.values()}.values())
+
+
+class ChatCommandCooldowns:
+    # When each command last ran, per scope. A command on cooldown in any
+    # of its scopes doesn't run, so a burst of the same command collapses
+    # into the one reply that started the cooldown.
+    MAX_TRACKED_KEYS = 10000
+
+    def __init__(self) -> None:
+        self._ready_at: Dict[object, float] = {}
+        self._lock = threading.Lock()
+
+    def try_start(
+            self, chat_command: ChatCommand, channel: str, sender: str,
+            now: Optional[float]=None) -> bool:
+        # Returns whether 'chat_command' may run now, and if so starts
+        # its cooldowns. Commands mostly have a single scope, so the keys
+        # are built directly rather than collected first.
+        global_cooldown_sec = chat_command.global_cooldown_sec
+        channel_cooldown_sec = chat_command.channel_cooldown_sec
+        user_cooldown_sec = chat_command.user_cooldown_sec
+        if not (
+                global_cooldown_sec or channel_cooldown_sec
+                or user_cooldown_sec):
+            return True
+        name = chat_command.name
+        channel_key = (name, "#", channel) if channel_cooldown_sec else None
+        user_key = (name, "@", sender) if user_cooldown_sec else None
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            ready_at = self._ready_at
+            if global_cooldown_sec and ready_at.get(name, 0) > now:
+                return False
+            if channel_key and ready_at.get(channel_key, 0) > now:
+                return False
+            if user_key and ready_at.get(user_key, 0) > now:
+                return False
+            if len(ready_at) >= self.MAX_TRACKED_KEYS:
+                ready_at = self._forget_expired(now)
+            if global_cooldown_sec:
+                ready_at[name] = now + global_cooldown_sec
+            if channel_key:
+                ready_at[channel_key] = now + channel_cooldown_sec
+            if user_key:
+                ready_at[user_key] = now + user_cooldown_sec
+        return True
+
+    def _forget_expired(self, now: float) -> Dict[object, float]:
+        self._ready_at = {
+                key: ready_at for key, ready_at in self._ready_at.items()
+                if ready_at > now}
+        return self._ready_at
+
+
+class PendingReply:
+    # The one chat message a blocking command gets to send: its reply or
+    # its timeout fallback, whichever is ready first.
+    __slots__ = ("irc_client", "channel", "_lock", "_is_sent")
+
+    def __init__(self, irc_client: IRCClient, channel: str) -> None:
+        self.irc_client = irc_client
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._is_sent = False
+
+    def send(self, message: str) -> None:
+        with self._lock:
+            if self._is_sent:
+                return
+            self._is_sent = True
+        self.irc_client.private_message(self.channel, message)
+
+
+class ReplyTimeouts:
+    # Sends the timeout fallbacks of every waiting blocking command from
+    # one thread. A reply that was already sent makes its fallback a
+    # no-op, so finished commands don't need to be removed.
+    def __init__(self) -> None:
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(
+            self, timeout_sec: float, pending_reply: PendingReply,
+            timeout_reply: str) -> None:
+        deadline = time.monotonic() + timeout_sec
+        with self._condition:
+            heapq.heappush(
+                    self._deadlines,
+                    (deadline, next(self._sequence), pending_reply,
+                            timeout_reply))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                        target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._deadlines:
+                    self._condition.wait()
+                wait_sec = self._deadlines[0][0] - time.monotonic()
+                if wait_sec > 0:
+                    self._condition.wait(wait_sec)
+                    continue
+                _, _, pending_reply, timeout_reply = heapq.heappop(
+                        self._deadlines)
+            pending_reply.send(timeout_reply)
+
+
+twitch_chat_commands = ChatCommandRegistry()
 
 
 class TwitchChatCommandHandler(Handler):
+    # The commands this handler answers; subclasses may swap in their
+    # own registry.
+    chat_commands = twitch_chat_commands
+
     def __init__(
-            self, irc_client: IRCClient, current_channels_path: str,
-            event_promo_optouts_path: str,
-            startgg_access_token: str) -> None:
-        super().__init__(IRCClientPrivateMessageEvent)
+            self, irc_client: IRCClient, bot_state: BotStateStore,
+            startgg_access_token: str,
+            command_cooldowns: bool=True,
+            command_worker_count: int=DEFAULT_COMMAND_WORKER_COUNT) -> None:
+        super().__init__(
+                IRCClientPrivateMessageEvent, {"irc_client": irc_client},
+                is_chat_command)
         self._irc_client = irc_client
-        self._current_channels_path = current_channels_path
-        self._event_promo_optouts_path = event_promo_optouts_path
+        self._bot_state = bot_state
         self._startgg_access_token = startgg_access_token
+        if command_cooldowns:
+            self.cooldowns = ChatCommandCooldowns()
+        else:
+            self.cooldowns = None
+        self._command_workers = concurrent.futures.ThreadPoolExecutor(
+                command_worker_count, "chat_command_worker")
+        self._command_slots = threading.BoundedSemaphore(
+                command_worker_count * MAX_QUEUED_COMMANDS_PER_WORKER)
+        self._reply_timeouts = ReplyTimeouts()
 
     def handle(
             self, irc_client_event: IRCClientPrivateMessageEvent) -> None:
-        if irc_client_event.irc_client is not self._irc_client:
+        irc_parameters = irc_client_event.irc_message.parameters
+        if len(irc_parameters) < 2:
+            return
+        # Only the first word matters; don't split the rest of the body.
+        chat_message_words = irc_parameters[1].split(maxsplit=1)
+        if not chat_message_words:
+            return
+        chat_command = self.chat_commands.get(
+                chat_message_words[0].lower())
+        if chat_command is None:
             return
         irc_tags = irc_client_event.irc_message.tags
-        irc_parameters = irc_client_event.irc_message.parameters
         # is this really who 'sender' is? Check IRC protocol
         sender = irc_tags["display-name"].lower().strip()
         channel = irc_parameters[0][1:]
-        chat_message_body = irc_parameters[1]
-        first_word = chat_message_body.lower().split()[0]
-        if first_word == "!jazzyevents":
-            self.command_jazzyevents(channel)
-        elif first_word == "!jazzybot":
-            self.command_jazzybot(channel, sender)
-        elif first_word == "!ggsjazzy":
-            self.command_ggsjazzy(channel, sender)
-        elif first_word == "!jazzy":
-            self.command_jazzy(channel)
-        elif first_word == "!jazzypromosoff":
-            self.command_jazzypromosoff(channel, sender)
-        elif first_word == "!jazzypromoson":
-            self.command_jazzypromoson(channel, sender)
-        elif first_word == "!jazzystandings":
-            self.command_jazzystandings(channel)
-        elif first_word == "!jazzygive":
-            self.command_jazzygive(channel)
-
-    def command_jazzyevents(self, channel: str) -> None:
+        # A blocking command takes its worker slot before its cooldown
+        # starts, so a command dropped for lack of workers doesn't also
+        # silence the next attempt.
+        if chat_command.blocking and not self._command_slots.acquire(
+                blocking=False):
+            # diagnostic
+            print(
+                    f"Dropped {chat_command.name} in {channel}: every chat "
+                    "command worker is busy.")
+            return
+        if self.cooldowns is not None and not self.cooldowns.try_start(
+                chat_command, channel, sender):
+            if chat_command.blocking:
+                self._command_slots.release()
+            return
+        command_method = getattr(self, chat_command.method_name)
+        if chat_command.blocking:
+            self._start_blocking_command(
+                    chat_command, command_method, channel, sender)
+        else:
+            command_method(channel, sender)
+
+    def stop(self) -> None:
+        self._command_workers.shutdown(wait=False)
+
+    def _start_blocking_command(
+            self, chat_command: ChatCommand,
+            command_method: Callable[[str, str], Optional[str]],
+            channel: str, sender: str) -> None:
+        # Keeps the dispatch thread free while the command waits on the
+        # network. The reply is sent from the worker when it's ready. The
+        # caller has already taken one of the command slots.
+        pending_reply = PendingReply(self._irc_client, channel)
+        try:
+            future = self._command_workers.submit(
+                    command_method, channel, sender)
+        except RuntimeError:
+            # The handler has been stopped.
+            self._command_slots.release()
+            return
+        self._reply_timeouts.add(
+                chat_command.timeout_sec, pending_reply,
+                chat_command.timeout_reply)
+        future.add_done_callback(
+                lambda x: self._finish_blocking_command(
+                        chat_command, x, pending_reply))
+
+    def _finish_blocking_command(
+            self, chat_command: ChatCommand,
+            future: concurrent.futures.Future,
+            pending_reply: PendingReply) -> None:
+        self._command_slots.release()
+        exception = future.exception()
+        if exception is not None:
+            # diagnostic
+            print(f"{chat_command.name} in {pending_reply.channel} failed:")
+            traceback.print_exception(
+                    type(exception), exception, exception.__traceback__)
+            pending_reply.send(chat_command.failure_reply)
+            return
+        reply = future.result()
+        if reply is not None:
+            pending_reply.send(reply)
+
+    @twitch_chat_commands.command(
+            "!jazzyevents", channel_cooldown_sec=30, blocking=True)
+    def command_jazzyevents(self, channel: str, sender: str) -> str:
         events = get_startgg_league_events(
                 self._startgg_access_token, "the-jazzy-circuit-4")
         now = datetime.now().timestamp()
@@ -83,13 +353,13 @@ class TwitchChatCommandHandler(Handler):
                 f"events in Jazzy Season 4 with a total of {registrations} "
                 "registrations. Learn more and sign up at "
                 "start.gg/thejazzycircuit/schedule !")
-        self._irc_client.private_message(channel, reply_str)
+        return reply_str
 
+    @twitch_chat_commands.command("!jazzybot", user_cooldown_sec=10)
     def command_jazzybot(self, channel: str, sender: str) -> None:
         if sender not in self._irc_client.channels:
             self._irc_client.join(sender)
-            with open(self._current_channels_path, "w") as channels_file:
-                channels_file.write("\n".join(self._irc_client.channels))
+            self._bot_state.add_channel(sender)
             self._irc_client.private_message(
                     channel,
                     f"@{sender} I joined your chat! If I don't respond "
@@ -104,43 +374,35 @@ class TwitchChatCommandHandler(Handler):
                     "believe! If I'm not responding there, let Vencabot "
                     "know so he can have a look! 💪")
 
+    @twitch_chat_commands.command("!ggsjazzy", user_cooldown_sec=10)
     def command_ggsjazzy(self, channel: str, sender: str) -> None:
         if sender in self._irc_client.channels:
             self._irc_client.private_message(channel, "GGs!")
             self._irc_client.part(sender)
-            with open(self._current_channels_path, "w") as channels_file:
-                channels_file.write("\n".join(self._irc_client.channels))
+            self._bot_state.remove_channel(sender)
 
-    def command_jazzy(self, channel: str) -> None:
+    @twitch_chat_commands.command("!jazzy", channel_cooldown_sec=15)
+    def command_jazzy(self, channel: str, sender: str) -> None:
         self._irc_client.private_message(
                 channel,
                 "Love 3rd Strike? Follow twitter.com/thejazzycircuit and "
                 "get info about upcoming events and more at "
                 "http://jazzycircuit.org !")
 
+    @twitch_chat_commands.command(
+            "!jazzypromosoff", user_cooldown_sec=10)
     def command_jazzypromosoff(self, channel: str, sender: str) -> None:
-        with open(self._event_promo_optouts_path) as optouts_file:
-            optouts = optouts_file.read().split()
-        if sender not in optouts:
-            optouts.append(sender)
-            with open(self._event_promo_optouts_path, "w") as optouts_file:
-                optouts_file.write("\n".join(optouts))
+        self._bot_state.add_promo_optout(sender)
         self._irc_client.private_message(
                 channel,
                 "Automatic upcoming event promos will no longer be sent to "
                 f"the {sender} chat. Use !jazzypromoson to receive them "
                 "again.")
 
+    @twitch_chat_commands.command(
+            "!jazzypromoson", user_cooldown_sec=10)
     def command_jazzypromoson(self, channel: str, sender: str) -> None:
-        with open(self._event_promo_optouts_path) as optouts_file:
-            optouts = optouts_file.read().split()
-        try:
-            optouts.remove(sender)
-        except ValueError:
-            pass
-        else:
-            with open(self._event_promo_optouts_path, "w") as optouts_file:
-                optouts_file.write("\n".join(optouts))
+        self._bot_state.remove_promo_optout(sender)
         self._irc_client.private_message(
                 channel,
                 "Automatic upcoming event promos will now be sent to the "
@@ -149,7 +411,9 @@ class TwitchChatCommandHandler(Handler):
                 "invite JazzyCircuitBot to your channel's chat (must be "
                 "modded first).")
 
-    def command_jazzystandings(self, channel: str) -> None:
+    @twitch_chat_commands.command(
+            "!jazzystandings", channel_cooldown_sec=30, blocking=True)
+    def command_jazzystandings(self, channel: str, sender: str) -> str:
         standings = get_startgg_league_standings(
                 self._startgg_access_token, "the-jazzy-circuit-4")
         top_players = []
@@ -173,9 +437,10 @@ class TwitchChatCommandHandler(Handler):
             elif player_index == len(top_players) - 2:
                 top_players_str += ", and "
         top_players_str += " -- but only the TOP 5 players will compete in the Jazzy Finale! See more at start.gg/thejazzycircuit/standings ."
-        self._irc_client.private_message(channel, top_players_str)
+        return top_players_str
 
-    def command_jazzygive(self, channel: str) -> None:
+    @twitch_chat_commands.command("!jazzygive", channel_cooldown_sec=15)
+    def command_jazzygive(self, channel: str, sender: str) -> None:
         self._irc_client.private_message(
                 channel,
                 "Enjoying Jazzy and want to help keep the lights on? We're "
@@ -1,97 +1,46 @@
-OPTIONAL_PRIVMSG_TAGS = [
-        "bits", "reply_parent_msg_id", "reply_parent_user_login",
-        "reply_parent_display_name", "reply_parent_msg_body", "vip"]
+import datetime
 
+from typing import Callable, Dict, Optional, Tuple
 
-class TwitchPrivateMessage:
+from src.irc_client import IRCMessage, IRCTags
+
+
+class DecodedTag:
+    # A TwitchPrivateMessage attribute decoded from one IRC tag the first
+    # time it's read. The result is cached in a slot of the same name with
+    # a leading underscore; until then the slot is simply unset, so
+    # building a TwitchPrivateMessage costs nothing per field. A missing
+    # or empty tag reads as 'default', or as a new object from
+    # 'default_factory' for mutable defaults, which mustn't be shared
+    # between messages.
     def __init__(
-            self,
-            badge_info: dict,           # 'Badge' : 'badge info' pairs
-            badges: dict,               # Also 'badge' : 'badge info' pairs
-            color: Optional[str],       # User-set name color, if they did
-            display_name: str,          # Username including capitalization
-            emotes: str,   # FIX THIS   # Character range : image name pairs
-            first_msg: bool,            # Is this a first-time chatter?
-            message_id: str,            # No clue how this is used
-            mod: bool,                  # Is a moderator (not broadcaster)?
-            returning_chatter: bool,    # Is this a second-time chatter?
-            room_id: int,               # No clue how this is used
-            subscriber: bool,           # Is user a channel subscriber?
-            tmi_sent_ts: int, #FIX THIS # Message timestamp
-            turbo: bool,                # Is user paying for Twitch Turbo?
-            user_id: int,               # Backend ID for sender
-            user_type: str,             # "", "admin", "global_mod", "staff"
-            vip: bool,                  # Is user a VIP in this channel?
-            channel: str,               # Twitch chat message was sent to
-            message_body: str,          # The body text of the message
-            bits: int = None,           # The amount of bits cheered w/ msg
-            reply_parent_msg_id: str = None, # The message replied to
-            reply_parent_user_login: str = None, # Login username of replied
-            reply_parent_display_name: str = None, # Shown name of replied
-            reply_parent_msg_body: str = None # Message text replied to
-            ) -> None:
-        self.badge_info = badge_info
-        self.badges = badges
-        self.color = color
-        self.display_name = display_name
-        self.emotes = emotes
-        self.first_msg = first_msg
-        self.message_id = message_id
-        self.mod = mod
-        self.returning_chatter = returning_chatter
-        self.room_id = room_id
-        self.subscriber = subscriber
-        self.tmi_sent_ts = tmi_sent_ts
-        self.turbo = turbo
-        self.user_id = user_id
-        self.user_type = user_type
-        self.vip = vip
-        self.channel = channel
-        self.message_body = message_body
-        self.bits = bits
-        self.reply_parent_msg_id = reply_parent_msg_id
-        self.reply_parent_user_login = reply_parent_user_login
-        self.reply_parent_display_name = reply_parent_display_name
-        self.reply_parent_msg_body = reply_parent_msg_body
+            self, tag_key: str, decode: Callable[[str], object],
+            default: object=None,
+            default_factory: Optional[Callable[[], object]]=None) -> None:
+        self.tag_key = tag_key
+        self.decode = decode
+        self.default = default
+        self.default_factory = default_factory
+        self.slot_name = None
 
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.slot_name = f"_{name}"
 
-def create_private_message_object_from(
-        twitch_irc_message: TwitchIRCMessage) -> PrivateMessageEvent:
-    tags = twitch_irc_message.tags
-    for optional_tag in OPTIONAL_PRIVMSG_TAGS:
-        if optional_tag not in tags:
-            tags[optional_tag] = None
-    badge_info = irc_badge_pairs_to_dict(tags["badge-info"])
-    badges = irc_badge_pairs_to_dict(tags["badges"])
-    color = tags["color"] if tags["color"] else None
-    display_name = tags["display-name"]
-    emotes = tags["emotes"]
-    first_msg = bool(int(tags["first-msg"]))
-    message_id = tags["id"]
-    mod = bool(int(tags["mod"]))
-    returning_chatter = bool(int(tags["returning-chatter"]))
-    room_id = int(tags["room-id"])
-    subscriber = bool(int(tags["subscriber"]))
-    # CONVERT THIS TO DATETIME
-    tmi_sent_ts = int(tags["tmi-sent-ts"])
-    turbo = bool(int(tags["turbo"]))
-    user_id = int(tags["user-id"])
-    user_type = tags["user-type"]
-    channel = twitch_irc_message.parameters[0][1:]
-    message_body = twitch_irc_message.parameters[1]
-    bits = int(tags["bits"]) if tags["bits"] is not None else None
-    reply_parent_msg_id = tags["reply_parent_msg_id"]
-    reply_parent_user_login = tags["reply_parent_user_login"]
-    reply_parent_display_name = tags["reply_parent_display_name"]
-    reply_parent_msg_body = tags["reply_parent_msg_body"]
-    vip = bool(int(tags["vip"])) if tags["vip"] is not None else None
-    return PrivateMessage(
-            badge_info, badges, color, display_name, emotes, first_msg,
-            message_id, mod, returning_chatter, room_id, subscriber,
-            tmi_sent_ts, turbo, user_id, user_type, vip, channel,
-            message_body, bits, reply_parent_msg_id,
-            reply_parent_user_login, reply_parent_display_name,
-            reply_parent_msg_body)
+    def __get__(self, instance: object, owner: type) -> object:
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot_name)
+        except AttributeError:
+            raw_value = instance.tags.get(self.tag_key)
+            if raw_value:
+                value = self.decode(raw_value)
+            elif self.default_factory is not None:
+                value = self.default_factory()
+            else:
+                value = self.default
+            setattr(instance, self.slot_name, value)
+            return value
 
 
 def irc_badge_pairs_to_dict(raw_badge_str: str) -> dict:
@@ -102,3 +51,94 @@ def irc_badge_pairs_to_dict(raw_badge_str: str) -> dict:
         if pair[0]:
             badges[pair[0]] = pair[1]
     return badges
+
+
+def parse_emote_ranges(raw_emotes_str: str) -> Tuple[Tuple[str, int, int]]:
+    # 'emotes' looks like "25:0-4,12-16/1902:6-10". Returns one
+    # (emote_id, start, end) per occurrence, in message order; 'end' is
+    # inclusive, as Twitch sends it.
+    emote_ranges = []
+    for emote_str in raw_emotes_str.split("/"):
+        emote_id, _, ranges_str = emote_str.partition(":")
+        for range_str in ranges_str.split(","):
+            start_str, _, end_str = range_str.partition("-")
+            emote_ranges.append((emote_id, int(start_str), int(end_str)))
+    emote_ranges.sort(key=lambda x: x[1])
+    return tuple(emote_ranges)
+
+
+def decode_flag(raw_value: str) -> bool:
+    return raw_value == "1"
+
+
+def decode_tmi_sent_ts(raw_value: str) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(
+            int(raw_value) / 1000, datetime.timezone.utc)
+
+
+def keep_str(raw_value: str) -> str:
+    return raw_value
+
+
+class TwitchPrivateMessage:
+    # A typed view of a Twitch PRIVMSG. Nothing is converted up front;
+    # each field is decoded from the IRCMessage's tags on first access.
+    __slots__ = (
+            "irc_message", "_badge_info", "_badges", "_color",
+            "_display_name", "_emotes", "_first_msg", "_message_id", "_mod",
+            "_returning_chatter", "_room_id", "_subscriber", "_tmi_sent_ts",
+            "_turbo", "_user_id", "_user_type", "_vip", "_bits",
+            "_reply_parent_msg_id", "_reply_parent_user_login",
+            "_reply_parent_display_name", "_reply_parent_msg_body")
+
+    badge_info: Dict[str, str] = DecodedTag(
+            "badge-info", irc_badge_pairs_to_dict, default_factory=dict)
+    badges: Dict[str, str] = DecodedTag(
+            "badges", irc_badge_pairs_to_dict, default_factory=dict)
+    color: Optional[str] = DecodedTag("color", keep_str)
+    display_name: str = DecodedTag("display-name", keep_str, "")
+    emotes: Tuple[Tuple[str, int, int]] = DecodedTag(
+            "emotes", parse_emote_ranges, ())
+    first_msg: bool = DecodedTag("first-msg", decode_flag, False)
+    message_id: Optional[str] = DecodedTag("id", keep_str)
+    mod: bool = DecodedTag("mod", decode_flag, False)
+    returning_chatter: bool = DecodedTag(
+            "returning-chatter", decode_flag, False)
+    room_id: Optional[int] = DecodedTag("room-id", int)
+    subscriber: bool = DecodedTag("subscriber", decode_flag, False)
+    tmi_sent_ts: Optional[datetime.datetime] = DecodedTag(
+            "tmi-sent-ts", decode_tmi_sent_ts)
+    turbo: bool = DecodedTag("turbo", decode_flag, False)
+    user_id: Optional[int] = DecodedTag("user-id", int)
+    user_type: str = DecodedTag("user-type", keep_str, "")
+    vip: bool = DecodedTag("vip", decode_flag, False)
+    bits: Optional[int] = DecodedTag("bits", int)
+    reply_parent_msg_id: Optional[str] = DecodedTag(
+            "reply-parent-msg-id", keep_str)
+    reply_parent_user_login: Optional[str] = DecodedTag(
+            "reply-parent-user-login", keep_str)
+    reply_parent_display_name: Optional[str] = DecodedTag(
+            "reply-parent-display-name", keep_str)
+    reply_parent_msg_body: Optional[str] = DecodedTag(
+            "reply-parent-msg-body", keep_str)
+
+    def __init__(self, irc_message: IRCMessage) -> None:
+        self.irc_message = irc_message
+
+    @property
+    def tags(self) -> IRCTags:
+        return self.irc_message.tags
+
+    @property
+    def channel(self) -> str:
+        return self.irc_message.parameters[0][1:]
+
+    @property
+    def message_body(self) -> str:
+        parameters = self.irc_message.parameters
+        return parameters[1] if len(parameters) > 1 else ""
+
+
+def create_private_message_object_from(
+        irc_message: IRCMessage) -> TwitchPrivateMessage:
+    return TwitchPrivateMessage(irc_message)
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import unittest
+
+from src.async_streambrain import AsyncHandler, AsyncStreamBrain
+from src.streambrain import PRIORITY_CRITICAL, Event, Handler, Listener
+
+
+class ChatEvent(Event):
+    __slots__ = ("channel_name",)
+
+    def __init__(self, message: object, channel_name: str="jazzy") -> None:
+        super().__init__(message)
+        self.channel_name = channel_name
+
+
+class CommandEvent(ChatEvent):
+    __slots__ = ()
+
+
+class RecordingAsyncHandler(AsyncHandler):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.handled = []
+        self.handled_all = asyncio.Event()
+        self.expected_count = 1
+
+    async def handle(self, streambrain_event: Event) -> None:
+        self.handled.append(streambrain_event.message)
+        if len(self.handled) >= self.expected_count:
+            self.handled_all.set()
+
+
+class RecordingHandler(Handler):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.handled = []
+        self.thread_ids = []
+        self.handled_event = threading.Event()
+
+    def handle(self, streambrain_event: Event) -> None:
+        self.handled.append(streambrain_event.message)
+        self.thread_ids.append(threading.get_ident())
+        self.handled_event.set()
+
+
+class FailingAsyncHandler(AsyncHandler):
+    async def handle(self, streambrain_event: Event) -> None:
+        raise RuntimeError("handler failed")
+
+
+class AsyncStreamBrainTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.brain = AsyncStreamBrain(executor_workers=2)
+        self.addAsyncCleanup(self.brain.stop)
+
+    async def wait_for(self, event: asyncio.Event) -> None:
+        await asyncio.wait_for(event.wait(), 5)
+
+    async def test_dispatches_to_subscribed_handlers(self) -> None:
+        chat_handler = RecordingAsyncHandler(ChatEvent)
+        chat_handler.expected_count = 2
+        jazzy_handler = RecordingAsyncHandler(
+                ChatEvent, {"channel_name": "jazzy"},
+                priority=PRIORITY_CRITICAL)
+        command_handler = RecordingAsyncHandler(CommandEvent)
+        for handler in (chat_handler, jazzy_handler, command_handler):
+            self.brain.activate_handler(handler)
+        self.brain.start_dispatching()
+        await self.brain.queue_event(ChatEvent("hi", "other"))
+        await self.brain.queue_event(CommandEvent("!jazzy"))
+        await self.wait_for(chat_handler.handled_all)
+        await self.wait_for(jazzy_handler.handled_all)
+        await self.wait_for(command_handler.handled_all)
+        self.assertEqual(chat_handler.handled, ["hi", "!jazzy"])
+        self.assertEqual(jazzy_handler.handled, ["!jazzy"])
+        self.assertEqual(command_handler.handled, ["!jazzy"])
+        # Filters are checked at dispatch, so both events went through
+        # the critical lane.
+        self.assertEqual(self.brain.lane_latencies()[
+                PRIORITY_CRITICAL]["count"], 2)
+
+    async def test_failing_handler_doesnt_stop_dispatch(self) -> None:
+        self.brain.activate_handler(FailingAsyncHandler(ChatEvent))
+        handler = RecordingAsyncHandler(ChatEvent)
+        handler.expected_count = 2
+        self.brain.activate_handler(handler)
+        self.brain.start_dispatching()
+        await self.brain.queue_event(ChatEvent("one"))
+        await self.brain.queue_event(ChatEvent("two"))
+        await self.wait_for(handler.handled_all)
+        self.assertEqual(handler.handled, ["one", "two"])
+
+    async def test_sync_handler_runs_on_executor(self) -> None:
+        handler = RecordingHandler(ChatEvent, {"channel_name": "jazzy"})
+        self.brain.activate_handler(handler)
+        self.brain.start_dispatching()
+        await self.brain.queue_event(ChatEvent("skipped", "other"))
+        await self.brain.queue_event(ChatEvent("hi"))
+        await asyncio.get_running_loop().run_in_executor(
+                None, handler.handled_event.wait, 5)
+        # The wrapped handler's filters carry over, and it runs off the
+        # event loop thread.
+        self.assertEqual(handler.handled, ["hi"])
+        self.assertNotEqual(handler.thread_ids[0], threading.get_ident())
+
+    async def test_sync_listener_runs_on_executor(self) -> None:
+        listened = iter([[ChatEvent("one"), ChatEvent("two")]])
+        listener = Listener(.01, lambda: next(listened, []))
+        handler = RecordingAsyncHandler(ChatEvent)
+        handler.expected_count = 2
+        self.brain.activate_handler(handler)
+        self.brain.start_listening(listener)
+        await self.wait_for(handler.handled_all)
+        self.assertEqual(handler.handled, ["one", "two"])
+
+    async def test_unknown_lane_is_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            self.brain.activate_handler(
+                    RecordingAsyncHandler(ChatEvent, priority=99))
+
+    async def test_stop_cancels_tasks_and_shuts_down_executor(self) -> None:
+        listen_task = self.brain.start_listening(Listener(.01, list))
+        dispatch_tasks = list(self.brain._dispatch_tasks)
+        await self.brain.stop()
+        self.assertTrue(listen_task.cancelled())
+        self.assertTrue(all(x.cancelled() for x in dispatch_tasks))
+        with self.assertRaises(RuntimeError):
+            self.brain._executor.submit(print)
+        # Stopping again is harmless.
+        await self.brain.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
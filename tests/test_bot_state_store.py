@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from src.bot_state_store import (
+        COMMIT_RETRY_SEC, MAX_COMMIT_ATTEMPTS, BotStateCommitError,
+        BotStateStore)
+
+
+class BotStateStoreMigrationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory = temporary_directory.name
+        self.database_path = os.path.join(self.directory, "bot_state.db")
+
+    def write_file(self, file_name: str, contents: str) -> str:
+        path = os.path.join(self.directory, file_name)
+        with open(path, "w") as state_file:
+            state_file.write(contents)
+        return path
+
+    def open_store(self) -> BotStateStore:
+        bot_state = BotStateStore(self.database_path, 0)
+        self.addCleanup(bot_state.close)
+        return bot_state
+
+    def test_text_files_are_imported_once(self) -> None:
+        channels_path = self.write_file("channels.txt", "jazzy\nsmash \n")
+        promo_optouts_path = self.write_file("optouts.txt", "smash\n")
+        giving_spaces_path = self.write_file("spaces.txt", "12\n34\n")
+        bot_state = self.open_store()
+        self.assertTrue(
+                bot_state.migrate_text_files(
+                        channels_path, promo_optouts_path,
+                        giving_spaces_path))
+        self.assertEqual(bot_state.channels, ["jazzy", "smash"])
+        self.assertEqual(bot_state.promo_optouts, {"smash"})
+        self.assertEqual(bot_state.processed_giving_space_ids, {12, 34})
+        self.assertTrue(bot_state.is_promo_optout("smash"))
+        self.assertFalse(
+                bot_state.migrate_text_files(
+                        channels_path, promo_optouts_path,
+                        giving_spaces_path))
+
+    def test_migration_persists_across_reopening(self) -> None:
+        channels_path = self.write_file("channels.txt", "jazzy\n")
+        bot_state = self.open_store()
+        bot_state.migrate_text_files(channels_path)
+        bot_state.add_channel("smash")
+        bot_state.close()
+        bot_state = self.open_store()
+        self.assertEqual(bot_state.channels, ["jazzy", "smash"])
+        self.assertFalse(bot_state.migrate_text_files(channels_path))
+
+    def test_missing_files_are_skipped(self) -> None:
+        bot_state = self.open_store()
+        self.assertTrue(
+                bot_state.migrate_text_files(
+                        os.path.join(self.directory, "missing.txt")))
+        self.assertEqual(bot_state.channels, [])
+        self.assertEqual(bot_state.processed_giving_space_ids, set())
+
+    def test_existing_state_is_kept(self) -> None:
+        channels_path = self.write_file("channels.txt", "smash\njazzy\n")
+        bot_state = self.open_store()
+        bot_state.add_channel("jazzy")
+        bot_state.migrate_text_files(channels_path)
+        self.assertEqual(bot_state.channels, ["jazzy", "smash"])
+
+
+
+class BotStateStoreCommitErrorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.database_path = os.path.join(
+                temporary_directory.name, "bot_state.db")
+        self.bot_state = BotStateStore(self.database_path, 0)
+        # Every write to 'channels' fails from here on.
+        other_connection = sqlite3.connect(self.database_path)
+        with other_connection:
+            other_connection.execute("DROP TABLE channels")
+        other_connection.close()
+
+    def test_failed_writes_are_given_up_and_reported(self) -> None:
+        self.bot_state.add_channel("jazzy")
+        started_at = time.monotonic()
+        with self.assertRaises(BotStateCommitError):
+            self.bot_state.flush()
+        self.assertLess(
+                time.monotonic() - started_at,
+                MAX_COMMIT_ATTEMPTS * COMMIT_RETRY_SEC + 1)
+        # The error is reported once, and other writes still commit.
+        self.bot_state.add_promo_optout("jazzy")
+        self.bot_state.flush()
+        self.bot_state.close()
+
+    def test_close_reports_failed_writes_and_stops(self) -> None:
+        self.bot_state.add_channel("jazzy")
+        with self.assertRaises(BotStateCommitError):
+            self.bot_state.close()
+        self.assertFalse(self.bot_state._writer_thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
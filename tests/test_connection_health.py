@@ -0,0 +1,58 @@
+import unittest
+
+from src.irc_client import ConnectionHealth
+
+
+class ConnectionHealthTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.health = ConnectionHealth(
+                ping_interval_sec=60, ping_timeout_sec=10)
+
+    def round_trip(self, sent_at: float, rtt_sec: float) -> None:
+        token = self.health.start_ping(sent_at)
+        self.assertTrue(self.health.observe_pong(token, sent_at + rtt_sec))
+
+    def test_percentiles(self) -> None:
+        self.assertIsNone(self.health.p50_rtt_sec)
+        for x in range(1, 101):
+            self.round_trip(x * 100, x / 1000)
+        self.assertAlmostEqual(self.health.p50_rtt_sec, .051)
+        self.assertAlmostEqual(self.health.p99_rtt_sec, .1)
+        self.assertAlmostEqual(self.health.rtt_percentile_sec(0), .001)
+
+    def test_rtt_window_rolls(self) -> None:
+        health = ConnectionHealth(60, 10, rtt_window_size=2)
+        for rtt_sec in (5, 1, 2):
+            token = health.start_ping(0)
+            health.observe_pong(token, rtt_sec)
+        self.assertEqual(list(health.rtts_sec), [1, 2])
+
+    def test_unknown_pong_is_ignored(self) -> None:
+        self.assertFalse(self.health.observe_pong("tmi.twitch.tv", 1))
+        self.assertEqual(len(self.health.rtts_sec), 0)
+
+    def test_dead_once_a_ping_times_out(self) -> None:
+        self.assertFalse(self.health.is_dead(1000))
+        self.health.start_ping(100)
+        self.assertFalse(self.health.is_dead(109.9))
+        self.assertTrue(self.health.is_dead(110))
+        self.assertEqual(self.health.missed_ping_count, 1)
+
+    def test_answered_ping_keeps_connection_alive(self) -> None:
+        self.round_trip(100, .5)
+        self.assertFalse(self.health.is_dead(1000))
+
+    def test_reset_forgets_outstanding_pings(self) -> None:
+        self.health.start_ping(100)
+        self.health.reset()
+        self.assertFalse(self.health.is_dead(1000))
+
+    def test_next_ping(self) -> None:
+        self.health.start_ping(100)
+        self.assertEqual(self.health.next_ping_in_sec(130), 30)
+        self.assertEqual(self.health.next_ping_in_sec(200), 0)
+        self.assertIsNone(ConnectionHealth(None, 10).next_ping_in_sec(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import threading
+import unittest
+
+from src.irc_client import IRCMessage
+from src.irc_client_listener import IRCClientPrivateMessageEvent
+from src.streambrain import (
+        OVERFLOW_COALESCE, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST,
+        PRIORITY_NORMAL, DispatchLane, Event, EventQueue)
+
+
+class ChatEvent(Event):
+    __slots__ = ("line",)
+
+    def __init__(self, line: str) -> None:
+        super().__init__(None)
+        self.line = line
+
+    def coalesce_key(self) -> str:
+        return self.line
+
+
+class UrgentChatEvent(ChatEvent):
+    __slots__ = ()
+
+
+def queued_lines(event_queue: EventQueue) -> list:
+    lines = []
+    while len(event_queue):
+        key, entry = event_queue.take()
+        event_queue.done(key)
+        lines.append(entry[0].line)
+    return lines
+
+
+class EventQueueOverflowTest(unittest.TestCase):
+    def test_drop_newest_sheds_the_incoming_event(self) -> None:
+        event_queue = EventQueue(2, OVERFLOW_DROP_NEWEST)
+        for line in ("a", "b", "c"):
+            event_queue.put((ChatEvent(line),))
+        self.assertEqual(queued_lines(event_queue), ["a", "b"])
+        self.assertEqual(event_queue.shed_counts["ChatEvent"], 1)
+
+    def test_drop_oldest_sheds_the_oldest_event(self) -> None:
+        event_queue = EventQueue(2, OVERFLOW_DROP_OLDEST)
+        for line in ("a", "b", "c"):
+            event_queue.put((ChatEvent(line),))
+        self.assertEqual(queued_lines(event_queue), ["b", "c"])
+
+    def test_coalesce_merges_into_a_queued_duplicate(self) -> None:
+        event_queue = EventQueue(2, OVERFLOW_COALESCE)
+        for line in ("a", "b", "a"):
+            event_queue.put((ChatEvent(line),))
+        self.assertEqual(queued_lines(event_queue), ["a", "b"])
+
+    def test_coalesce_without_a_duplicate_sheds_the_oldest(self) -> None:
+        event_queue = EventQueue(2, OVERFLOW_COALESCE)
+        for line in ("a", "b", "c"):
+            event_queue.put((ChatEvent(line),))
+        self.assertEqual(queued_lines(event_queue), ["b", "c"])
+
+    def test_policies_apply_to_subclasses(self) -> None:
+        event_queue = EventQueue(2)
+        event_queue.set_overflow_policy(ChatEvent, OVERFLOW_DROP_NEWEST)
+        self.assertEqual(
+                event_queue.overflow_policy_for(UrgentChatEvent),
+                OVERFLOW_DROP_NEWEST)
+        event_queue.set_overflow_policy(
+                UrgentChatEvent, OVERFLOW_DROP_OLDEST)
+        self.assertEqual(
+                event_queue.overflow_policy_for(UrgentChatEvent),
+                OVERFLOW_DROP_OLDEST)
+
+    def test_block_waits_for_room(self) -> None:
+        event_queue = EventQueue(1)
+        event_queue.put((ChatEvent("a"),))
+        put_thread = threading.Thread(
+                target=event_queue.put, args=((ChatEvent("b"),),))
+        put_thread.start()
+        put_thread.join(.1)
+        self.assertTrue(put_thread.is_alive())
+        key, _ = event_queue.take()
+        event_queue.done(key)
+        put_thread.join(1)
+        self.assertFalse(put_thread.is_alive())
+        self.assertEqual(queued_lines(event_queue), ["b"])
+
+
+def channel_of(chat_event: ChatEvent) -> str:
+    return chat_event.line.partition(":")[0]
+
+
+class EventQueuePartitionTest(unittest.TestCase):
+    def test_a_key_is_taken_once_until_done(self) -> None:
+        event_queue = EventQueue(key_function=channel_of)
+        for line in ("a:1", "a:2", "b:1"):
+            event_queue.put((ChatEvent(line),))
+        first_key, first_entry = event_queue.take()
+        second_key, second_entry = event_queue.take()
+        self.assertEqual(
+                (first_entry[0].line, second_entry[0].line), ("a:1", "b:1"))
+        self.assertEqual(event_queue.in_flight_key_count, 2)
+        event_queue.done(first_key)
+        _, third_entry = event_queue.take()
+        self.assertEqual(third_entry[0].line, "a:2")
+
+    def test_in_flight_keys_are_capped(self) -> None:
+        event_queue = EventQueue(key_function=channel_of, max_in_flight_keys=1)
+        for line in ("a:1", "b:1"):
+            event_queue.put((ChatEvent(line),))
+        first_key, _ = event_queue.take()
+        take_thread = threading.Thread(target=event_queue.take)
+        take_thread.start()
+        take_thread.join(.1)
+        self.assertTrue(take_thread.is_alive())
+        self.assertEqual(event_queue.in_flight_key_count, 1)
+        event_queue.done(first_key)
+        take_thread.join(1)
+        self.assertFalse(take_thread.is_alive())
+
+    def test_lane_caps_in_flight_keys_at_its_dispatcher_count(self) -> None:
+        dispatch_lane = DispatchLane(
+                PRIORITY_NORMAL, 16, 3, partition_key=channel_of)
+        self.assertEqual(dispatch_lane.event_queue.max_in_flight_keys, 3)
+        dispatch_lane = DispatchLane(
+                PRIORITY_NORMAL, 16, 3, partition_key=channel_of,
+                max_in_flight_keys=1)
+        self.assertEqual(dispatch_lane.event_queue.max_in_flight_keys, 1)
+
+
+class PrivateMessageCoalesceKeyTest(unittest.TestCase):
+    def test_same_line_from_different_senders_is_kept_apart(self) -> None:
+        irc_client = object()
+        first, second = (
+                IRCClientPrivateMessageEvent(
+                        irc_client,
+                        IRCMessage(f":{x}!{x}@{x} PRIVMSG #jazzy :!jazzybot"))
+                for x in ("alice", "bob"))
+        self.assertNotEqual(first.coalesce_key(), second.coalesce_key())
+
+    def test_repeated_line_from_one_sender_coalesces(self) -> None:
+        irc_client = object()
+        first, second = (
+                IRCClientPrivateMessageEvent(
+                        irc_client,
+                        IRCMessage(f":alice!alice@alice PRIVMSG #jazzy :{x}"))
+                for x in ("!jazzyevents", "!JazzyEvents "))
+        self.assertEqual(first.coalesce_key(), second.coalesce_key())
+
+
+if __name__ == "__main__":
+    unittest.main()
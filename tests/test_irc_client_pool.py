@@ -0,0 +1,89 @@
+import time
+import unittest
+
+from src.irc_client_handlers import TwitchChatLoginFailedHandler
+from src.irc_client_pool import IRCClientPool
+from src.irc_client_writer import IRCRateLimitProfile
+from src.irc_reactor import IRCReactor
+from src.streambrain import StreamBrain
+from src.twitch import TwitchOauthManager
+from tools.fake_twitch_server import INVALID_PASSWORD, FakeTwitchServer
+
+
+# Two channels a second may be joined, across every connection.
+TEST_RATE_LIMIT_PROFILE = IRCRateLimitProfile(
+        messages=100, messages_period_sec=30,
+        non_moderator_messages=20, non_moderator_messages_period_sec=30,
+        non_moderator_channel_messages=1,
+        non_moderator_channel_messages_period_sec=1,
+        joins=2, joins_period_sec=1)
+
+
+def wait_for(condition: callable, timeout_sec: float) -> bool:
+    deadline = time.monotonic() + timeout_sec
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.01)
+    return True
+
+
+class IRCClientPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.fake_twitch_server = FakeTwitchServer()
+        self.fake_twitch_server.start()
+        self.addCleanup(self.fake_twitch_server.stop)
+        self.streambrain = StreamBrain()
+        self.streambrain.start_dispatching()
+        self.addCleanup(self.streambrain.stop)
+        self.irc_reactor = IRCReactor()
+        self.irc_reactor.start(self.streambrain.queue_event)
+        self.addCleanup(self.irc_reactor.stop)
+        self.pool = IRCClientPool(
+                2, reactor=self.irc_reactor,
+                rate_limit_profile=TEST_RATE_LIMIT_PROFILE)
+        self.addCleanup(self.pool.disconnect)
+        host_name, host_port = self.fake_twitch_server.server_address
+        self.pool.connect(host_name, host_port)
+        self.pool.login("oauth:test", "jazzycircuitbot", None)
+
+    def joined_count(self) -> int:
+        return len(self.fake_twitch_server.joined_channel_names)
+
+    def test_connections_share_the_join_limit(self) -> None:
+        channel_names = [f"channel{x}" for x in range(6)]
+        started_at = time.monotonic()
+        self.pool.join_many(channel_names)
+        self.assertEqual(len(self.pool.connections), 3)
+        self.assertTrue(wait_for(lambda: self.joined_count() >= 2, 1))
+        # Each connection has budget for its own two channels, but the
+        # account only for two a second.
+        time.sleep(.3)
+        self.assertEqual(self.joined_count(), 2)
+        self.assertTrue(wait_for(lambda: self.joined_count() == 6, 5))
+        self.assertGreaterEqual(time.monotonic() - started_at, 1.8)
+
+    def test_moderator_status_applies_to_every_connection(self) -> None:
+        self.pool.join_many(["channel0", "channel1", "channel2"])
+        self.pool.set_channel_moderator("channel2", True)
+        for irc_client in self.pool.connections:
+            self.assertIn(
+                    "channel2",
+                    irc_client._writer.rate_limits.moderated_channels)
+
+    def test_failed_login_is_retried_with_the_new_password(self) -> None:
+        twitch_oauth_manager = TwitchOauthManager("test", "test", "test")
+        twitch_oauth_manager.access_token = "refreshed"
+        self.streambrain.activate_handler(
+                TwitchChatLoginFailedHandler(
+                        self.pool, twitch_oauth_manager))
+        self.pool.login(INVALID_PASSWORD, "jazzycircuitbot", None)
+        self.pool.join_many(["channel0"])
+        self.assertTrue(wait_for(lambda: self.joined_count() == 1, 5))
+        self.assertEqual(self.pool.saved_password, "oauth:refreshed")
+        self.assertEqual(
+                self.pool.connections[0].saved_password, "oauth:refreshed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import socket
+import time
+import unittest
+
+from src.irc_client import IRCClient
+from src.irc_client_writer import (
+        SEND_PRIORITY_MEMBERSHIP, SEND_PRIORITY_MESSAGE, SEND_PRIORITY_PONG,
+        SEND_PRIORITY_REGISTRATION, IRCOutboundWriter, IRCRateLimitProfile,
+        IRCRateLimits, TokenBucket)
+
+
+# Periods are long enough that no bucket refills during a test.
+TEST_RATE_LIMIT_PROFILE = IRCRateLimitProfile(
+        messages=2, messages_period_sec=60,
+        non_moderator_messages=20, non_moderator_messages_period_sec=60,
+        non_moderator_channel_messages=1,
+        non_moderator_channel_messages_period_sec=60,
+        joins=2, joins_period_sec=60)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_delay_until_refilled(self) -> None:
+        bucket = TokenBucket(2, 1)
+        now = time.monotonic()
+        self.assertEqual(bucket.delay_sec(now), 0)
+        bucket.take(2)
+        self.assertAlmostEqual(bucket.delay_sec(now), .5)
+        self.assertAlmostEqual(bucket.delay_sec(now, 2), 1)
+        self.assertEqual(bucket.delay_sec(now + .5), 0)
+
+    def test_more_than_capacity_waits_for_a_full_bucket(self) -> None:
+        bucket = TokenBucket(2, 1)
+        self.assertEqual(bucket.delay_sec(time.monotonic(), 5), 0)
+
+
+class IRCOutboundWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sent = []
+        self.writer = IRCOutboundWriter(
+                self.sent.append, TEST_RATE_LIMIT_PROFILE)
+
+    def sent_lines(self) -> list:
+        return b"".join(self.sent).decode().splitlines()
+
+    def moderate(self, *channel_names: str) -> None:
+        for channel_name in channel_names:
+            self.writer.set_channel_moderator(channel_name, True)
+
+    def test_lines_are_coalesced_into_one_send(self) -> None:
+        self.moderate("#a")
+        self.writer.enqueue("PRIVMSG #a :1", SEND_PRIORITY_MESSAGE, "#a")
+        self.writer.enqueue("JOIN #b", SEND_PRIORITY_MEMBERSHIP, join_count=1)
+        self.assertIsNone(self.writer.write_ready())
+        self.assertEqual(self.sent, [b"JOIN #b\r\nPRIVMSG #a :1\r\n"])
+
+    def test_message_limit_holds_back_the_rest(self) -> None:
+        self.moderate("#a")
+        futures = [
+                self.writer.enqueue(
+                        f"PRIVMSG #a :{x}", SEND_PRIORITY_MESSAGE, "#a")
+                for x in range(3)]
+        self.assertGreater(self.writer.write_ready(), 0)
+        self.assertEqual(self.sent_lines(), ["PRIVMSG #a :0", "PRIVMSG #a :1"])
+        self.assertEqual([x.done() for x in futures], [True, True, False])
+        self.assertEqual(len(self.writer), 1)
+
+    def test_non_moderator_channel_limit_keeps_channel_order(self) -> None:
+        for line, channel_name in (
+                ("PRIVMSG #a :1", "#a"), ("PRIVMSG #a :2", "#a"),
+                ("PRIVMSG #b :1", "#b")):
+            self.writer.enqueue(line, SEND_PRIORITY_MESSAGE, channel_name)
+        self.assertGreater(self.writer.write_ready(), 0)
+        self.assertEqual(self.sent_lines(), ["PRIVMSG #a :1", "PRIVMSG #b :1"])
+        self.assertEqual(len(self.writer), 1)
+
+    def test_join_count_is_taken_from_the_join_bucket(self) -> None:
+        self.writer.enqueue(
+                "JOIN #a,#b", SEND_PRIORITY_MEMBERSHIP, join_count=2)
+        self.writer.enqueue("JOIN #c", SEND_PRIORITY_MEMBERSHIP, join_count=1)
+        self.assertGreater(self.writer.write_ready(), 0)
+        self.assertEqual(self.sent_lines(), ["JOIN #a,#b"])
+
+    def test_pong_ignores_the_rate_limits(self) -> None:
+        self.moderate("#a")
+        for x in range(3):
+            self.writer.enqueue(
+                    f"PRIVMSG #a :{x}", SEND_PRIORITY_MESSAGE, "#a")
+        self.writer.write_ready()
+        self.writer.enqueue("PONG :tmi.twitch.tv", SEND_PRIORITY_PONG)
+        self.writer.write_ready()
+        self.assertEqual(self.sent[-1], b"PONG :tmi.twitch.tv\r\n")
+        self.assertEqual(len(self.writer), 1)
+
+    def test_registration_holds_everything_else(self) -> None:
+        self.moderate("#a")
+        self.writer.hold_for_registration()
+        self.writer.enqueue("PRIVMSG #a :hi", SEND_PRIORITY_MESSAGE, "#a")
+        self.writer.enqueue("PONG :tmi.twitch.tv", SEND_PRIORITY_PONG)
+        self.writer.enqueue("NICK jazzybot", SEND_PRIORITY_REGISTRATION)
+        self.assertIsNone(self.writer.write_ready())
+        self.assertEqual(self.sent_lines(), ["NICK jazzybot"])
+        self.writer.finish_registration()
+        self.writer.write_ready()
+        self.assertEqual(
+                self.sent_lines(),
+                ["NICK jazzybot", "PONG :tmi.twitch.tv", "PRIVMSG #a :hi"])
+
+    def test_failed_send_requeues_all_but_registration(self) -> None:
+        def fail(data: bytes) -> None:
+            raise OSError("connection reset")
+
+        self.moderate("#a")
+        self.writer._send = fail
+        nick_future = self.writer.enqueue(
+                "NICK jazzybot", SEND_PRIORITY_REGISTRATION)
+        message_future = self.writer.enqueue(
+                "PRIVMSG #a :hi", SEND_PRIORITY_MESSAGE, "#a")
+        with self.assertRaises(OSError):
+            self.writer.write_ready()
+        self.assertIsInstance(nick_future.exception(0), OSError)
+        self.assertFalse(message_future.done())
+        self.writer._send = self.sent.append
+        self.writer.write_ready()
+        self.assertEqual(self.sent_lines(), ["PRIVMSG #a :hi"])
+        self.assertTrue(message_future.done())
+
+
+class SharedRateLimitsTest(unittest.TestCase):
+    def test_writers_of_one_account_share_the_limits(self) -> None:
+        rate_limits = IRCRateLimits(TEST_RATE_LIMIT_PROFILE)
+        rate_limits.set_channel_moderator("#a", True)
+        rate_limits.set_channel_moderator("#b", True)
+        sent = []
+        writers = [
+                IRCOutboundWriter(sent.append, rate_limits=rate_limits)
+                for _ in range(2)]
+        for writer, channel_name in zip(writers, ("#a", "#b")):
+            for x in range(2):
+                writer.enqueue(
+                        f"PRIVMSG {channel_name} :{x}",
+                        SEND_PRIORITY_MESSAGE, channel_name)
+        for writer in writers:
+            writer.write_ready()
+        self.assertEqual(
+                b"".join(sent).decode().splitlines(),
+                ["PRIVMSG #a :0", "PRIVMSG #a :1"])
+        self.assertEqual(len(writers[1]), 2)
+
+
+class BufferedWriteTest(unittest.TestCase):
+    def test_futures_resolve_once_their_line_is_flushed(self) -> None:
+        irc_client = IRCClient(rate_limit_profile=TEST_RATE_LIMIT_PROFILE)
+        # The event loop owns the socket; the client only needs one.
+        irc_client._connection, peer_connection = socket.socketpair()
+        self.addCleanup(irc_client._connection.close)
+        self.addCleanup(peer_connection.close)
+        output_buffer = irc_client.attach_output_buffer(lambda: None)
+        writer = irc_client._writer
+        first_future = writer.enqueue("PONG :a", SEND_PRIORITY_PONG)
+        second_future = writer.enqueue("PONG :b", SEND_PRIORITY_PONG)
+        irc_client.write_queued()
+        self.assertEqual(bytes(output_buffer), b"PONG :a\r\nPONG :b\r\n")
+        self.assertFalse(first_future.done())
+        irc_client.mark_flushed(5)
+        self.assertFalse(first_future.done())
+        irc_client.mark_flushed(5)
+        self.assertTrue(first_future.done())
+        self.assertFalse(second_future.done())
+        irc_client.mark_flushed(9)
+        self.assertTrue(second_future.done())
+
+
+if __name__ == "__main__":
+    unittest.main()
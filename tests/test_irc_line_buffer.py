@@ -0,0 +1,82 @@
+import socket
+import unittest
+
+from src.irc_client import (
+        IRCClient, IRCLineBuffer, RemoteConnectionClosedError)
+
+
+class IRCLineBufferTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection, self.peer = socket.socketpair()
+        self.addCleanup(self.connection.close)
+        self.addCleanup(self.peer.close)
+
+    def receive(self, line_buffer: IRCLineBuffer, data: bytes) -> list:
+        self.peer.sendall(data)
+        received_count = 0
+        while received_count < len(data):
+            received_count += line_buffer.receive_from(self.connection)
+        return line_buffer.pop_lines()
+
+    def test_partial_line_waits_for_the_rest(self) -> None:
+        line_buffer = IRCLineBuffer()
+        self.assertEqual(
+                self.receive(line_buffer, b"PING :a\r\nPRIVMSG #jazzy :h"),
+                ["PING :a"])
+        self.assertEqual(self.receive(line_buffer, b"i\r"), [])
+        self.assertEqual(
+                self.receive(line_buffer, b"\nPING :b\r\n"),
+                ["PRIVMSG #jazzy :hi", "PING :b"])
+
+    def test_multibyte_character_split_across_reads(self) -> None:
+        line_buffer = IRCLineBuffer()
+        data = "PRIVMSG #jazzy :café \U0001f3b7\r\n".encode()
+        split_index = data.index(b"\xf0") + 2
+        self.assertEqual(self.receive(line_buffer, data[:split_index]), [])
+        self.assertEqual(
+                self.receive(line_buffer, data[split_index:]),
+                ["PRIVMSG #jazzy :café \U0001f3b7"])
+
+    def test_line_longer_than_the_receive_buffer(self) -> None:
+        line_buffer = IRCLineBuffer(16)
+        line = f"PRIVMSG #jazzy :{'x' * 100}"
+        self.assertEqual(
+                self.receive(line_buffer, f"{line}\r\nPING\r\n".encode()),
+                [line, "PING"])
+
+    def test_empty_lines_are_skipped(self) -> None:
+        line_buffer = IRCLineBuffer()
+        self.assertEqual(
+                self.receive(line_buffer, b"\r\nPING\r\n\r\n"), ["PING"])
+
+    def test_clear_drops_a_partial_line(self) -> None:
+        line_buffer = IRCLineBuffer()
+        self.receive(line_buffer, b"PRIVMSG #jazzy :stale")
+        line_buffer.clear()
+        self.assertEqual(self.receive(line_buffer, b"PING\r\n"), ["PING"])
+
+
+class IRCClientReadTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.irc_client = IRCClient()
+        self.irc_client._connection, self.peer = socket.socketpair()
+        self.addCleanup(self.irc_client._connection.close)
+        self.addCleanup(self.peer.close)
+
+    def test_lines_are_parsed(self) -> None:
+        self.peer.sendall(b":tmi.twitch.tv PING :tmi.twitch.tv\r\n")
+        irc_messages = self.irc_client.read_available_messages()
+        self.assertEqual(
+                [x.command for x in irc_messages], ["PING"])
+
+    def test_eof_raises_remote_connection_closed(self) -> None:
+        self.peer.sendall(b"PING :a\r\n")
+        self.peer.shutdown(socket.SHUT_WR)
+        self.assertEqual(
+                len(self.irc_client.read_available_messages()), 1)
+        with self.assertRaises(RemoteConnectionClosedError):
+            self.irc_client.read_available_messages()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from src.irc_client import IRCMessage
+
+
+class IRCMessageTest(unittest.TestCase):
+    def test_tags_prefix_command_and_parameters(self) -> None:
+        irc_message = IRCMessage(
+                "@badges=;display-name=Alice "
+                ":alice!alice@alice.tmi.twitch.tv PRIVMSG #jazzy :!jazzy")
+        self.assertEqual(irc_message.command, "PRIVMSG")
+        self.assertEqual(
+                irc_message.prefix, "alice!alice@alice.tmi.twitch.tv")
+        self.assertEqual(irc_message.parameters, ["#jazzy", "!jazzy"])
+        self.assertEqual(irc_message.tags["display-name"], "Alice")
+
+    def test_trailing_parameter_keeps_colons_and_spaces(self) -> None:
+        irc_message = IRCMessage(
+                ":alice!alice@alice PRIVMSG #jazzy "
+                ":see start.gg: doors at 10:30 :)")
+        self.assertEqual(
+                irc_message.parameters,
+                ["#jazzy", "see start.gg: doors at 10:30 :)"])
+
+    def test_trailing_parameter_starting_with_a_colon(self) -> None:
+        irc_message = IRCMessage(":alice!alice@alice PRIVMSG #jazzy ::)")
+        self.assertEqual(irc_message.parameters, ["#jazzy", ":)"])
+
+    def test_empty_trailing_parameter(self) -> None:
+        irc_message = IRCMessage(":alice!alice@alice PRIVMSG #jazzy :")
+        self.assertEqual(irc_message.parameters, ["#jazzy", ""])
+
+    def test_middle_parameter_with_a_colon_is_not_split(self) -> None:
+        # The regex parser split every parameter at its first colon.
+        irc_message = IRCMessage(
+                ":tmi.twitch.tv MODE #jazzy +k pass:word :done")
+        self.assertEqual(
+                irc_message.parameters, ["#jazzy", "+k", "pass:word", "done"])
+
+    def test_no_parameters(self) -> None:
+        for raw_message, prefix in (
+                ("PING", None), (":tmi.twitch.tv RECONNECT", "tmi.twitch.tv")):
+            irc_message = IRCMessage(raw_message)
+            self.assertEqual(irc_message.command, raw_message.split()[-1])
+            self.assertEqual(irc_message.prefix, prefix)
+            self.assertEqual(irc_message.parameters, [])
+            self.assertFalse(irc_message.trailing_starts_with("!"))
+
+    def test_tags_without_a_prefix(self) -> None:
+        irc_message = IRCMessage(
+                "@msg-id=host_on;room-id=1234 NOTICE #jazzy :Now hosting.")
+        self.assertIsNone(irc_message.prefix)
+        self.assertEqual(irc_message.command, "NOTICE")
+        self.assertEqual(irc_message.tags["msg-id"], "host_on")
+        self.assertEqual(irc_message.parameters, ["#jazzy", "Now hosting."])
+
+    def test_message_without_tags_has_empty_tags(self) -> None:
+        irc_message = IRCMessage(":tmi.twitch.tv PING :tmi.twitch.tv")
+        self.assertEqual(dict(irc_message.tags), {})
+        self.assertEqual(irc_message.parameters, ["tmi.twitch.tv"])
+
+    def test_repeated_spaces(self) -> None:
+        irc_message = IRCMessage(
+                "@mod=1  :alice!alice@alice  PRIVMSG   #jazzy  :hi  there ")
+        self.assertEqual(irc_message.tags["mod"], "1")
+        self.assertEqual(irc_message.prefix, "alice!alice@alice")
+        self.assertEqual(irc_message.command, "PRIVMSG")
+        self.assertEqual(irc_message.parameters, ["#jazzy", "hi  there "])
+
+    def test_trailing_starts_with(self) -> None:
+        raw_message = ":alice!alice@alice PRIVMSG #jazzy :!jazzy now"
+        irc_message = IRCMessage(raw_message)
+        self.assertTrue(irc_message.trailing_starts_with("!"))
+        self.assertFalse(IRCMessage(raw_message).trailing_starts_with("?"))
+        # Also once the parameters have been split.
+        irc_message.parameters
+        self.assertTrue(irc_message.trailing_starts_with("!jazzy"))
+        # A last parameter without a colon is the trailing one too.
+        irc_message = IRCMessage(":alice!alice@alice PRIVMSG #jazzy !jazzy")
+        self.assertTrue(irc_message.trailing_starts_with("!"))
+
+    def test_channel_names_are_shared(self) -> None:
+        first, second = (
+                IRCMessage(f":x!x@x PRIVMSG #jazzy :{x}")
+                for x in ("a", "b"))
+        self.assertIs(first.parameters[0], second.parameters[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
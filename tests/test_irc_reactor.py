@@ -0,0 +1,148 @@
+import socket
+import threading
+import time
+import unittest
+
+import main as jazzycircuitbot
+
+from src.irc_client import IRCClient
+from src.irc_client_listener import IRCClientJoinEvent
+from src.irc_reactor import IRCReactor
+from src.streambrain import Handler
+from src.streambrain_metrics import StreamBrainMetrics
+
+
+class ScriptedServer:
+    # One end of a real TCP connection that a test writes lines to and
+    # reads the client's lines from.
+    def __init__(self) -> None:
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.address = self._listener.getsockname()
+        self.connection = None
+        self._connections = []
+        self._received = b""
+
+    def accept(self) -> None:
+        # Takes the client's next connection; lines read from an earlier
+        # one are forgotten, but it stays open until close.
+        self._listener.settimeout(5)
+        self.connection, _ = self._listener.accept()
+        self._connections.append(self.connection)
+        self.connection.settimeout(5)
+        self._received = b""
+
+    def send_lines(self, lines: list) -> None:
+        self.connection.sendall(
+                "".join(f"{x}\r\n" for x in lines).encode())
+
+    def wait_for_line(self, prefix: str, timeout_sec: float=5) -> bool:
+        # Waits until the client has sent a line starting with 'prefix'.
+        deadline = time.monotonic() + timeout_sec
+        needle = f"\n{prefix}".encode()
+        while needle not in b"\n" + self._received:
+            remaining_sec = deadline - time.monotonic()
+            if remaining_sec <= 0:
+                return False
+            self.connection.settimeout(remaining_sec)
+            try:
+                data = self.connection.recv(65536)
+            except socket.timeout:
+                return False
+            if not data:
+                return False
+            self._received += data
+        return True
+
+    def close(self) -> None:
+        for connection in self._connections:
+            connection.close()
+        self._listener.close()
+
+
+class BlockingJoinHandler(Handler):
+    def __init__(self, release: threading.Event) -> None:
+        super().__init__(IRCClientJoinEvent)
+        self.release = release
+
+    def handle(self, event: IRCClientJoinEvent) -> None:
+        self.release.wait(10)
+
+
+class IRCReactorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ScriptedServer()
+        self.addCleanup(self.server.close)
+        self.irc_reactor = IRCReactor()
+
+    def start_client(
+            self, process_event: callable, **client_options) -> IRCClient:
+        self.irc_reactor.start(process_event)
+        self.addCleanup(self.irc_reactor.stop)
+        irc_client = IRCClient(**client_options)
+        self.irc_reactor.register(irc_client)
+        irc_client.connect(*self.server.address)
+        self.server.accept()
+        irc_client.login("oauth:test", "jazzycircuitbot", None)
+        self.assertTrue(self.server.wait_for_line("NICK jazzycircuitbot"))
+        return irc_client
+
+    def test_full_lane_doesnt_stall_pongs(self) -> None:
+        jazzycircuitbot_brain = jazzycircuitbot.create_brain(
+                StreamBrainMetrics())
+        release = threading.Event()
+        jazzycircuitbot_brain.activate_handler(BlockingJoinHandler(release))
+        jazzycircuitbot_brain.start_dispatching()
+        self.start_client(jazzycircuitbot_brain.queue_event)
+        # Cleanups run last first: unblock the handler, then the brain,
+        # then stop the reactor.
+        self.addCleanup(jazzycircuitbot_brain.stop)
+        self.addCleanup(release.set)
+        # Far more JOINs than the lane holds, all for the one channel
+        # whose handler is stuck.
+        self.server.send_lines([
+                f":viewer{x}!viewer{x}@viewer{x}.tmi.twitch.tv JOIN #jazzy"
+                for x in range(3000)])
+        self.server.send_lines(["PING :tmi.twitch.tv"])
+        self.assertTrue(self.server.wait_for_line("PONG "))
+        self.assertGreater(
+                jazzycircuitbot_brain.shed_counts()["IRCClientJoinEvent"], 0)
+
+    def test_reconnects_after_eof(self) -> None:
+        irc_client = self.start_client(
+                lambda event: None, default_retry_seconds=.05)
+        irc_client.join("jazzy")
+        self.assertTrue(self.server.wait_for_line("JOIN #jazzy"))
+        # The server hangs up; the reactor reads EOF and reconnects, then
+        # logs in and rejoins the channel on the new connection.
+        self.server.connection.shutdown(socket.SHUT_RDWR)
+        self.server.accept()
+        self.assertTrue(self.server.wait_for_line("NICK jazzycircuitbot"))
+        self.assertTrue(self.server.wait_for_line("JOIN #jazzy"))
+
+    def test_unanswered_ping_drops_connection(self) -> None:
+        irc_client = self.start_client(
+                lambda event: None, default_retry_seconds=.05,
+                ping_interval_sec=.1, ping_timeout_sec=.2)
+        # The server never answers, so the connection is shut down and
+        # the reactor reconnects.
+        self.assertTrue(self.server.wait_for_line("PING :rtt-"))
+        self.server.accept()
+        self.assertTrue(self.server.wait_for_line("NICK jazzycircuitbot"))
+        self.assertGreaterEqual(irc_client.health.missed_ping_count, 1)
+
+    def test_answered_pings_record_round_trips(self) -> None:
+        irc_client = self.start_client(
+                lambda event: None, ping_interval_sec=.05,
+                ping_timeout_sec=5)
+        self.assertTrue(self.server.wait_for_line("PING :rtt-0"))
+        self.server.send_lines([":tmi.twitch.tv PONG tmi.twitch.tv :rtt-0"])
+        deadline = time.monotonic() + 5
+        while irc_client.health.p50_rtt_sec is None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(.01)
+        self.assertLess(irc_client.health.p50_rtt_sec, 5)
+        self.assertEqual(irc_client.health.missed_ping_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
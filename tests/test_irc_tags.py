@@ -0,0 +1,64 @@
+import unittest
+
+from src.irc_client import IRCMessage, IRCTags, unescape_tag_value
+
+
+class UnescapeTagValueTest(unittest.TestCase):
+    def test_escapes(self) -> None:
+        self.assertEqual(
+                unescape_tag_value(r"a\:b\sc\\d\re\nf"),
+                "a;b c\\d\re\nf")
+
+    def test_unknown_escape_keeps_the_character(self) -> None:
+        self.assertEqual(unescape_tag_value(r"\a\b"), "ab")
+
+    def test_trailing_backslash_is_dropped(self) -> None:
+        self.assertEqual(unescape_tag_value("abc\\"), "abc")
+
+    def test_value_without_escapes_is_returned_as_is(self) -> None:
+        escaped_value = "plain"
+        self.assertIs(unescape_tag_value(escaped_value), escaped_value)
+
+
+class IRCTagsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.irc_message = IRCMessage(
+                r"@badges=moderator/1;emote-only;display-name=Jazzy\sBot;"
+                r"mod=1 :jazzybot!jazzybot@jazzybot PRIVMSG #jazzy :hi")
+        self.tags = self.irc_message.tags
+
+    def test_lookup(self) -> None:
+        self.assertEqual(self.tags["badges"], "moderator/1")
+        self.assertEqual(self.tags["display-name"], "Jazzy Bot")
+        self.assertEqual(self.tags["mod"], "1")
+
+    def test_valueless_tag_is_empty(self) -> None:
+        self.assertEqual(self.tags["emote-only"], "")
+
+    def test_missing_key(self) -> None:
+        with self.assertRaises(KeyError):
+            self.tags["subscriber"]
+        self.assertNotIn("subscriber", self.tags)
+        # A key that is only the start of another key isn't present.
+        self.assertNotIn("display", self.tags)
+        self.assertIn("emote-only", self.tags)
+
+    def test_mapping_view(self) -> None:
+        self.assertEqual(len(self.tags), 4)
+        self.assertEqual(
+                list(self.tags),
+                ["badges", "emote-only", "display-name", "mod"])
+        self.assertEqual(self.tags.get("turbo", "0"), "0")
+
+    def test_message_without_tags(self) -> None:
+        tags = IRCMessage(":tmi.twitch.tv PING :tmi.twitch.tv").tags
+        self.assertEqual(len(tags), 0)
+        self.assertEqual(dict(tags), {})
+
+    def test_slice_of_a_raw_line(self) -> None:
+        tags = IRCTags("xx;a=1;b=2 yy", 3, 10)
+        self.assertEqual(dict(tags), {"a": "1", "b": "2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
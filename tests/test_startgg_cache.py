@@ -0,0 +1,124 @@
+import threading
+import unittest
+
+from src.startgg_cache import REFRESH_RETRY_SEC, ResponseCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.cache = ResponseCache(60, self.clock)
+        self.fetch_count = 0
+
+    def fetch(self) -> str:
+        self.fetch_count += 1
+        return f"response {self.fetch_count}"
+
+    def test_fresh_response_is_reused(self) -> None:
+        self.assertEqual(self.cache.get("key", self.fetch, 10), "response 1")
+        self.clock.now += 9
+        self.assertEqual(self.cache.get("key", self.fetch, 10), "response 1")
+        self.assertEqual(self.fetch_count, 1)
+
+    def test_keys_are_cached_apart(self) -> None:
+        self.cache.get("a", self.fetch, 10)
+        self.assertEqual(self.cache.get("b", self.fetch, 10), "response 2")
+
+    def test_stale_response_is_served_while_refreshed(self) -> None:
+        refresh_started = threading.Event()
+        release_refresh = threading.Event()
+
+        def slow_fetch() -> str:
+            refresh_started.set()
+            release_refresh.wait(1)
+            return self.fetch()
+
+        self.cache.get("key", self.fetch, 10)
+        self.clock.now += 11
+        self.assertEqual(self.cache.get("key", slow_fetch, 10), "response 1")
+        self.assertTrue(refresh_started.wait(1))
+        refresh_future = self.cache._in_flight["key"]
+        # A second stale hit doesn't start another refresh.
+        self.assertEqual(self.cache.get("key", slow_fetch, 10), "response 1")
+        release_refresh.set()
+        refresh_future.result(1)
+        self.assertEqual(self.cache.get("key", self.fetch, 10), "response 2")
+        self.assertEqual(self.fetch_count, 2)
+
+    def test_too_stale_response_is_fetched_again(self) -> None:
+        self.cache.get("key", self.fetch, 10)
+        self.clock.now += 71
+        self.assertEqual(self.cache.get("key", self.fetch, 10), "response 2")
+
+    def test_failed_fetch_is_raised_and_not_cached(self) -> None:
+        def failing_fetch() -> str:
+            raise ConnectionError("start.gg is down")
+
+        with self.assertRaises(ConnectionError):
+            self.cache.get("key", failing_fetch, 10)
+        self.assertEqual(self.cache.get("key", self.fetch, 10), "response 1")
+
+    def test_failed_refresh_serves_stale_and_waits_to_retry(self) -> None:
+        refresh_failed = threading.Event()
+
+        def failing_fetch() -> str:
+            refresh_failed.set()
+            raise ConnectionError("start.gg is down")
+
+        self.cache.get("key", self.fetch, 10)
+        self.clock.now += 11
+        threads_before = set(threading.enumerate())
+        self.assertEqual(
+                self.cache.get("key", failing_fetch, 10), "response 1")
+        self.assertTrue(refresh_failed.wait(1))
+        # Let the refresh thread report its failure before going on.
+        for refresh_thread in set(threading.enumerate()) - threads_before:
+            refresh_thread.join(1)
+        self.clock.now += REFRESH_RETRY_SEC - 1
+        self.assertEqual(self.cache.get("key", self.fetch, 10), "response 1")
+        self.assertEqual(self.fetch_count, 1)
+
+    def test_concurrent_misses_share_one_fetch(self) -> None:
+        fetch_started = threading.Event()
+        release_fetch = threading.Event()
+
+        def slow_fetch() -> str:
+            fetch_started.set()
+            release_fetch.wait(1)
+            return self.fetch()
+
+        results = []
+        first_thread = threading.Thread(
+                target=lambda: results.append(
+                        self.cache.get("key", slow_fetch, 10)))
+        first_thread.start()
+        self.assertTrue(fetch_started.wait(1))
+        waiting_threads = [
+                threading.Thread(
+                        target=lambda: results.append(
+                                self.cache.get("key", slow_fetch, 10)))
+                for _ in range(4)]
+        for waiting_thread in waiting_threads:
+            waiting_thread.start()
+        release_fetch.set()
+        for thread in [first_thread] + waiting_threads:
+            thread.join(1)
+        self.assertEqual(results, ["response 1"] * 5)
+        self.assertEqual(self.fetch_count, 1)
+
+    def test_invalidate_drops_the_response(self) -> None:
+        self.cache.get("key", self.fetch, 10)
+        self.cache.invalidate("key")
+        self.assertEqual(self.cache.get("key", self.fetch, 10), "response 2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,249 @@
+import threading
+import time
+import unittest
+
+from src.bot_state_store import BotStateStore
+from src.irc_client import IRCMessage
+from src.irc_client_listener import IRCClientPrivateMessageEvent
+from src.twitch_chat_command_handler import (
+        MAX_QUEUED_COMMANDS_PER_WORKER, ChatCommand, ChatCommandCooldowns,
+        ChatCommandRegistry, TwitchChatCommandHandler, twitch_chat_commands)
+
+
+class RecordingIRCClient:
+    def __init__(self) -> None:
+        self.messages = []
+        self._condition = threading.Condition()
+
+    def private_message(self, channel: str, message: str) -> None:
+        with self._condition:
+            self.messages.append((channel, message))
+            self._condition.notify_all()
+
+    def wait_for_messages(self, count: int, timeout_sec: float=2) -> list:
+        with self._condition:
+            self._condition.wait_for(
+                    lambda: len(self.messages) >= count, timeout_sec)
+            return list(self.messages)
+
+
+test_chat_commands = ChatCommandRegistry()
+
+
+class SlowCommandHandler(TwitchChatCommandHandler):
+    chat_commands = test_chat_commands
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.release = threading.Event()
+
+    @test_chat_commands.command(
+            "!echo", "!say", channel_cooldown_sec=30, user_cooldown_sec=10)
+    def command_echo(self, channel: str, sender: str) -> None:
+        self._irc_client.private_message(channel, f"echo for {sender}")
+
+    @test_chat_commands.command("!slow", blocking=True)
+    def command_slow(self, channel: str, sender: str) -> str:
+        self.release.wait(2)
+        return f"slow for {sender}"
+
+    @test_chat_commands.command(
+            "!late", blocking=True, timeout_sec=.05, timeout_reply="late")
+    def command_late(self, channel: str, sender: str) -> str:
+        self.release.wait(2)
+        return "on time"
+
+    @test_chat_commands.command(
+            "!broken", blocking=True, timeout_reply="late",
+            failure_reply="broken")
+    def command_broken(self, channel: str, sender: str) -> str:
+        raise ConnectionError("start.gg is down")
+
+
+def chat_event(
+        irc_client: object, body: str,
+        sender: str="Alice") -> IRCClientPrivateMessageEvent:
+    login = sender.lower()
+    return IRCClientPrivateMessageEvent(
+            irc_client,
+            IRCMessage(
+                    f"@display-name={sender} :{login}!{login}@{login} "
+                    f"PRIVMSG #jazzy :{body}"))
+
+
+class BlockingCommandTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.irc_client = RecordingIRCClient()
+        bot_state = BotStateStore(":memory:")
+        self.addCleanup(bot_state.close)
+        self.handler = SlowCommandHandler(
+                self.irc_client, bot_state, "", command_cooldowns=False,
+                command_worker_count=1)
+        self.addCleanup(self.handler.stop)
+        self.addCleanup(self.handler.release.set)
+
+    def test_reply_is_sent_from_the_worker(self) -> None:
+        self.handler.release.set()
+        self.handler.handle(chat_event(self.irc_client, "!slow"))
+        self.assertEqual(
+                self.irc_client.wait_for_messages(1),
+                [("jazzy", "slow for alice")])
+
+    def test_handle_returns_before_the_command_finishes(self) -> None:
+        started_at = time.monotonic()
+        self.handler.handle(chat_event(self.irc_client, "!slow"))
+        self.assertLess(time.monotonic() - started_at, .5)
+        self.assertEqual(self.irc_client.messages, [])
+
+    def test_timeout_reply_is_sent_once(self) -> None:
+        self.handler.handle(chat_event(self.irc_client, "!late"))
+        self.assertEqual(
+                self.irc_client.wait_for_messages(1), [("jazzy", "late")])
+        self.handler.release.set()
+        self.assertEqual(
+                self.irc_client.wait_for_messages(2, .2), [("jazzy", "late")])
+
+    def test_failure_reply_is_sent_for_exceptions(self) -> None:
+        self.handler.handle(chat_event(self.irc_client, "!broken"))
+        self.assertEqual(
+                self.irc_client.wait_for_messages(1), [("jazzy", "broken")])
+
+    def test_commands_past_the_worker_slots_are_dropped(self) -> None:
+        for x in range(MAX_QUEUED_COMMANDS_PER_WORKER + 2):
+            self.handler.handle(
+                    chat_event(self.irc_client, "!slow", f"user{x}"))
+        self.handler.release.set()
+        messages = self.irc_client.wait_for_messages(
+                MAX_QUEUED_COMMANDS_PER_WORKER + 1, .5)
+        self.assertEqual(
+                messages,
+                [
+                        ("jazzy", f"slow for user{x}")
+                        for x in range(MAX_QUEUED_COMMANDS_PER_WORKER)])
+
+    def test_finished_commands_free_their_slots(self) -> None:
+        self.handler.release.set()
+        for x in range(MAX_QUEUED_COMMANDS_PER_WORKER + 2):
+            self.handler.handle(
+                    chat_event(self.irc_client, "!slow", f"user{x}"))
+            self.irc_client.wait_for_messages(x + 1)
+        self.assertEqual(
+                len(self.irc_client.messages),
+                MAX_QUEUED_COMMANDS_PER_WORKER + 2)
+
+
+
+class ChatCommandRegistryTest(unittest.TestCase):
+    def test_commands_are_found_by_name_and_alias(self) -> None:
+        echo_command = test_chat_commands.get("!echo")
+        self.assertEqual(echo_command.method_name, "command_echo")
+        self.assertIs(test_chat_commands.get("!say"), echo_command)
+        self.assertIsNone(test_chat_commands.get("!echoes"))
+        self.assertEqual(
+                [x.name for x in test_chat_commands.commands()],
+                ["!echo", "!slow", "!late", "!broken"])
+
+    def test_a_name_is_registered_once(self) -> None:
+        chat_commands = ChatCommandRegistry()
+        chat_commands.command("!echo")(lambda self, channel, sender: None)
+        with self.assertRaises(ValueError):
+            chat_commands.command("!say", "!echo")(
+                    lambda self, channel, sender: None)
+
+    def test_bot_answers_its_usual_commands(self) -> None:
+        self.assertEqual(
+                sorted(x.name for x in twitch_chat_commands.commands()),
+                [
+                        "!ggsjazzy", "!jazzy", "!jazzybot", "!jazzyevents",
+                        "!jazzygive", "!jazzypromosoff", "!jazzypromoson",
+                        "!jazzystandings"])
+        for command_word in ("!jazzyevent", "!jazzystanding"):
+            self.assertIsNone(twitch_chat_commands.get(command_word))
+
+
+class ChatCommandCooldownsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cooldowns = ChatCommandCooldowns()
+
+    def test_command_without_cooldowns_always_runs(self) -> None:
+        chat_command = ChatCommand("!echo", "command_echo")
+        for _ in range(3):
+            self.assertTrue(
+                    self.cooldowns.try_start(chat_command, "jazzy", "alice"))
+
+    def test_channel_cooldown_window(self) -> None:
+        chat_command = ChatCommand(
+                "!echo", "command_echo", channel_cooldown_sec=30)
+        try_start = self.cooldowns.try_start
+        self.assertTrue(try_start(chat_command, "jazzy", "alice", 100))
+        self.assertFalse(try_start(chat_command, "jazzy", "bob", 129))
+        self.assertTrue(try_start(chat_command, "smash", "bob", 129))
+        self.assertTrue(try_start(chat_command, "jazzy", "bob", 130))
+
+    def test_user_cooldown_spans_channels(self) -> None:
+        chat_command = ChatCommand(
+                "!echo", "command_echo", user_cooldown_sec=10)
+        try_start = self.cooldowns.try_start
+        self.assertTrue(try_start(chat_command, "jazzy", "alice", 100))
+        self.assertFalse(try_start(chat_command, "smash", "alice", 105))
+        self.assertTrue(try_start(chat_command, "smash", "bob", 105))
+
+    def test_global_cooldown(self) -> None:
+        chat_command = ChatCommand(
+                "!echo", "command_echo", global_cooldown_sec=5)
+        try_start = self.cooldowns.try_start
+        self.assertTrue(try_start(chat_command, "jazzy", "alice", 100))
+        self.assertFalse(try_start(chat_command, "smash", "bob", 104))
+        self.assertTrue(try_start(chat_command, "smash", "bob", 105))
+
+    def test_commands_cool_down_apart(self) -> None:
+        echo_command = ChatCommand(
+                "!echo", "command_echo", channel_cooldown_sec=30)
+        other_command = ChatCommand(
+                "!other", "command_other", channel_cooldown_sec=30)
+        try_start = self.cooldowns.try_start
+        self.assertTrue(try_start(echo_command, "jazzy", "alice", 100))
+        self.assertTrue(try_start(other_command, "jazzy", "alice", 100))
+
+
+class CommandDispatchTest(unittest.TestCase):
+    def create_handler(
+            self, command_cooldowns: bool) -> SlowCommandHandler:
+        bot_state = BotStateStore(":memory:")
+        self.addCleanup(bot_state.close)
+        handler = SlowCommandHandler(
+                self.irc_client, bot_state, "", command_cooldowns)
+        self.addCleanup(handler.stop)
+        return handler
+
+    def setUp(self) -> None:
+        self.irc_client = RecordingIRCClient()
+
+    def test_command_word_is_matched_case_insensitively(self) -> None:
+        handler = self.create_handler(False)
+        handler.handle(chat_event(self.irc_client, "!ECHO hello there"))
+        handler.handle(chat_event(self.irc_client, "echo !echo"))
+        handler.handle(chat_event(self.irc_client, "!echoes"))
+        self.assertEqual(
+                self.irc_client.messages, [("jazzy", "echo for alice")])
+
+    def test_repeats_within_the_cooldown_are_ignored(self) -> None:
+        handler = self.create_handler(True)
+        for sender in ("Alice", "Bob", "Alice"):
+            handler.handle(chat_event(self.irc_client, "!echo", sender))
+        self.assertEqual(
+                self.irc_client.messages, [("jazzy", "echo for alice")])
+
+    def test_disabled_cooldowns_let_every_command_run(self) -> None:
+        handler = self.create_handler(False)
+        for sender in ("Alice", "Bob", "Alice"):
+            handler.handle(chat_event(self.irc_client, "!say", sender))
+        self.assertEqual(
+                self.irc_client.messages,
+                [
+                        ("jazzy", "echo for alice"), ("jazzy", "echo for bob"),
+                        ("jazzy", "echo for alice")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from src.irc_client import IRCMessage
+from src.twitch_chat_private_message import TwitchPrivateMessage
+
+
+def private_message(tags: str) -> TwitchPrivateMessage:
+    return TwitchPrivateMessage(
+            IRCMessage(
+                    f"@{tags} :alice!alice@alice.tmi.twitch.tv "
+                    "PRIVMSG #jazzy :Kappa hi Kappa"))
+
+
+class TwitchPrivateMessageTest(unittest.TestCase):
+    def test_tags_are_decoded(self) -> None:
+        message = private_message(
+                "badge-info=subscriber/8;badges=moderator/1,subscriber/6;"
+                "emotes=25:0-4,12-16;mod=1;room-id=1234;display-name=Alice")
+        self.assertEqual(message.badge_info, {"subscriber": "8"})
+        self.assertEqual(
+                message.badges, {"moderator": "1", "subscriber": "6"})
+        self.assertEqual(message.emotes, (("25", 0, 4), ("25", 12, 16)))
+        self.assertTrue(message.mod)
+        self.assertEqual(message.room_id, 1234)
+        self.assertEqual(message.display_name, "Alice")
+        self.assertEqual(message.channel, "jazzy")
+        self.assertEqual(message.message_body, "Kappa hi Kappa")
+
+    def test_missing_tags_read_as_defaults(self) -> None:
+        message = private_message("badges=;display-name=Alice")
+        self.assertEqual(message.badges, {})
+        self.assertEqual(message.badge_info, {})
+        self.assertEqual(message.emotes, ())
+        self.assertFalse(message.mod)
+        self.assertIsNone(message.room_id)
+
+    def test_empty_badges_are_not_shared(self) -> None:
+        first, second = (
+                private_message("badges=;badge-info=") for _ in range(2))
+        first.badges["moderator"] = "1"
+        first.badge_info["subscriber"] = "1"
+        self.assertEqual(second.badges, {})
+        self.assertEqual(second.badge_info, {})
+        self.assertIs(first.badges, first.badges)
+
+
+if __name__ == "__main__":
+    unittest.main()
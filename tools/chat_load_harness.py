@@ -0,0 +1,175 @@
+import argparse
+import os
+import tempfile
+import time
+
+from typing import List, Optional
+
+import main as jazzycircuitbot
+
+from src.bot_state_store import BotStateStore
+from src.irc_client_listener import (
+        IRCClientPrivateMessageEvent, PrivateMessagePrefilter)
+from src.irc_client_writer import (
+        TWITCH_RATE_LIMIT_PROFILE, IRCRateLimitProfile)
+from src.streambrain import Handler
+from src.streambrain_metrics import StreamBrainMetrics
+from src.twitch import TwitchOauthManager
+from tools.fake_twitch_server import FakeTwitchServer
+
+
+# Run from the repository root:
+#   python -m tools.chat_load_harness [--rate 500] [--duration 30]
+# Drives the same wiring main.py uses against a local FakeTwitchServer.
+# The default command mix only contains commands that reply without
+# calling out to start.gg or Twitch, and each is expected to produce
+# exactly one reply, which is how replies are matched to commands. For
+# the same reason command cooldowns are off unless --cooldowns is given.
+
+HARNESS_NICKNAME = "jazzycircuitbot"
+UNLIMITED_RATE_LIMIT_PROFILE = IRCRateLimitProfile(
+        messages=10**9, messages_period_sec=1,
+        non_moderator_messages=10**9, non_moderator_messages_period_sec=1,
+        non_moderator_channel_messages=10**9,
+        non_moderator_channel_messages_period_sec=1,
+        joins=10**9, joins_period_sec=1)
+
+
+class CountChatHandler(Handler):
+    def __init__(self, irc_client: object) -> None:
+        super().__init__(
+                IRCClientPrivateMessageEvent, {"irc_client": irc_client})
+        self.handled_count = 0
+
+    def handle(self, event: IRCClientPrivateMessageEvent) -> None:
+        self.handled_count += 1
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def format_ms(value_sec: Optional[float]) -> str:
+    if value_sec is None:
+        return "    n/a"
+    return f"{value_sec * 1000:7.1f}"
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--channels", type=int, default=100)
+    argument_parser.add_argument(
+            "--rate", type=float, default=500,
+            help="chat lines per second across all channels")
+    argument_parser.add_argument("--command-ratio", type=float, default=.05)
+    argument_parser.add_argument(
+            "--commands", nargs="+", default=["!jazzy"], metavar="COMMAND")
+    argument_parser.add_argument("--duration", type=float, default=30)
+    argument_parser.add_argument(
+            "--unlimited-writes", action="store_true",
+            help="lift Twitch's rate limits on the bot's replies")
+    argument_parser.add_argument(
+            "--cooldowns", action="store_true",
+            help="let command cooldowns collapse repeated commands")
+    argument_parser.add_argument(
+            "--no-prefilter", action="store_true",
+            help="dispatch ordinary chat as well as commands")
+    arguments = argument_parser.parse_args()
+
+    fake_twitch_server = FakeTwitchServer()
+    fake_twitch_server.start()
+    host_name, host_port = fake_twitch_server.server_address
+    if arguments.unlimited_writes:
+        rate_limit_profile = UNLIMITED_RATE_LIMIT_PROFILE
+    else:
+        rate_limit_profile = TWITCH_RATE_LIMIT_PROFILE
+
+    with tempfile.TemporaryDirectory() as state_path:
+        bot_state = BotStateStore(
+                os.path.join(state_path, "jazzycircuitbot_state.sqlite3"))
+        for channel_number in range(arguments.channels):
+            bot_state.add_channel(f"channel{channel_number}")
+
+        if arguments.no_prefilter:
+            privmsg_prefilter = None
+        else:
+            privmsg_prefilter = PrivateMessagePrefilter()
+        irc_reactor, twitch_chat = jazzycircuitbot.create_twitch_chat(
+                rate_limit_profile, privmsg_prefilter)
+        streambrain_metrics = StreamBrainMetrics()
+        jazzycircuitbot_brain = jazzycircuitbot.create_brain(
+                streambrain_metrics)
+        # Login failures never happen against the fake server, so the
+        # OAuth manager is never asked to refresh.
+        twitch_oauth_manager = TwitchOauthManager(
+                "harness", "harness", "harness")
+        twitch_oauth_manager.access_token = "harness"
+        jazzycircuitbot.activate_chat_handlers(
+                jazzycircuitbot_brain, twitch_chat, twitch_oauth_manager,
+                "harness", bot_state, arguments.cooldowns)
+        count_chat_handler = CountChatHandler(twitch_chat)
+        jazzycircuitbot_brain.activate_handler(count_chat_handler)
+        jazzycircuitbot_brain.start_dispatching()
+        irc_reactor.start(jazzycircuitbot_brain.queue_event)
+
+        join_progress = jazzycircuitbot.log_in_to_twitch_chat(
+                twitch_chat, "oauth:harness", HARNESS_NICKNAME,
+                bot_state.channels, host_name, host_port)
+        join_progress.wait()
+        print(
+                f"Joined {arguments.channels} channels over "
+                f"{len(twitch_chat.connections)} connections in "
+                f"{join_progress.time_to_joined_sec:.2f}s.")
+
+        fake_twitch_server.start_traffic(
+                arguments.rate, arguments.command_ratio, arguments.commands)
+        started_at = time.monotonic()
+        time.sleep(arguments.duration)
+        fake_twitch_server.stop_traffic()
+        # Chat the prefilter drops counts as handled; no handler would
+        # have done anything with it.
+        handled_count = count_chat_handler.handled_count
+        if privmsg_prefilter is not None:
+            handled_count += privmsg_prefilter.filtered_count
+        elapsed_sec = time.monotonic() - started_at
+        # Let replies already in flight arrive before reporting.
+        time.sleep(1)
+
+        irc_reactor.stop()
+        jazzycircuitbot_brain.stop()
+        fake_twitch_server.stop()
+        bot_state.close()
+
+    stats = fake_twitch_server.stats
+    reply_latencies_sec = stats.reply_latencies_sec
+    print(
+            f"offered {stats.chat_lines_sent / elapsed_sec:8.1f} lines/s, "
+            f"handled {handled_count / elapsed_sec:8.1f} lines/s")
+    print(
+            f"commands: {stats.command_lines_sent} sent, "
+            f"{len(reply_latencies_sec)} answered, "
+            f"{stats.unmatched_reply_count} unmatched replies")
+    print(
+            "command-to-reply ms: "
+            f"p50 {format_ms(percentile(reply_latencies_sec, .5))}  "
+            f"p90 {format_ms(percentile(reply_latencies_sec, .9))}  "
+            f"p99 {format_ms(percentile(reply_latencies_sec, .99))}  "
+            f"max {format_ms(percentile(reply_latencies_sec, 1))}")
+    print(
+            f"server PINGs: {stats.pings_sent} sent, "
+            f"{stats.late_pong_count} late PONGs, "
+            f"{stats.dropped_pong_count} dropped PONGs")
+    if privmsg_prefilter is not None:
+        print(
+                f"prefilter: {privmsg_prefilter.filtered_count} filtered, "
+                f"{privmsg_prefilter.passed_count} passed")
+    shed_counts = jazzycircuitbot_brain.shed_counts()
+    if shed_counts:
+        print(f"shed events: {dict(shed_counts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import collections
+import random
+import socketserver
+import threading
+import time
+
+from typing import Dict, List, Sequence
+
+from benchmarks.corpus import synthetic_privmsg_line
+
+
+# A local stand-in for irc.chat.twitch.tv that speaks the subset of the
+# protocol IRCClient uses, and can flood the channels it's asked to join
+# with synthetic chat. See tools/chat_load_harness.py.
+
+INVALID_PASSWORD = "oauth:invalid"
+SERVER_PING_TOKEN = "tmi.twitch.tv"
+
+
+class FakeTwitchStats:
+    def __init__(self) -> None:
+        self.chat_lines_sent = 0
+        self.command_lines_sent = 0
+        self.reply_latencies_sec = []
+        self.unmatched_reply_count = 0
+        self.pings_sent = 0
+        self.pong_latencies_sec = []
+        self.late_pong_count = 0
+        self.dropped_pong_count = 0
+
+
+class FakeTwitchConnection(socketserver.StreamRequestHandler):
+    def setup(self) -> None:
+        super().setup()
+        self.nickname = None
+        self.pending_ping_at = None
+        self._write_lock = threading.Lock()
+
+    def send_line(self, line: str) -> None:
+        with self._write_lock:
+            self.wfile.write(f"{line}\r\n".encode())
+            self.wfile.flush()
+
+    def handle(self) -> None:
+        self.server.add_connection(self)
+        try:
+            for raw_line in self.rfile:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if not self.handle_line(line):
+                    return
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.server.remove_connection(self)
+
+    def handle_line(self, line: str) -> bool:
+        # Returns False once the connection should close.
+        command, _, parameters_str = line.partition(" ")
+        if command == "PASS":
+            if parameters_str == INVALID_PASSWORD:
+                self.send_line(
+                        ":tmi.twitch.tv NOTICE * "
+                        ":Login authentication failed")
+                return False
+        elif command == "NICK":
+            self.nickname = parameters_str.lower()
+            self.send_line(
+                    f":tmi.twitch.tv 001 {self.nickname} :Welcome, GLHF!")
+        elif command == "CAP":
+            capability_name = parameters_str.partition(":")[2]
+            self.send_line(f":tmi.twitch.tv CAP * ACK :{capability_name}")
+        elif command == "JOIN":
+            for target in parameters_str.split(","):
+                channel_name = target.strip().lstrip("#")
+                self.server.join(self, channel_name)
+                self.send_line(
+                        f":{self.nickname}!{self.nickname}@"
+                        f"{self.nickname}.tmi.twitch.tv "
+                        f"JOIN #{channel_name}")
+                self.send_line(
+                        f"@badge-info=;badges=moderator/1;color=;"
+                        f"display-name={self.server.bot_display_name};"
+                        f"emote-sets=0;mod=1;subscriber=0;user-type=mod "
+                        f":tmi.twitch.tv USERSTATE #{channel_name}")
+        elif command == "PART":
+            channel_name = parameters_str.strip().lstrip("#")
+            self.server.part(self, channel_name)
+            self.send_line(
+                    f":{self.nickname}!{self.nickname}@"
+                    f"{self.nickname}.tmi.twitch.tv PART #{channel_name}")
+        elif command == "PRIVMSG":
+            channel_name = parameters_str.partition(" ")[0].lstrip("#")
+            self.server.observe_reply(channel_name)
+        elif command == "PING":
+            token = parameters_str.lstrip(":")
+            self.send_line(f":tmi.twitch.tv PONG tmi.twitch.tv :{token}")
+        elif command == "PONG":
+            self.server.observe_pong(self)
+        return True
+
+
+class FakeTwitchServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+            self, host: str="127.0.0.1", port: int=0,
+            bot_display_name: str="JazzyCircuitBot",
+            ping_interval_sec: float=5, late_pong_sec: float=1,
+            dropped_pong_sec: float=10) -> None:
+        super().__init__((host, port), FakeTwitchConnection)
+        self.bot_display_name = bot_display_name
+        self.ping_interval_sec = ping_interval_sec
+        self.late_pong_sec = late_pong_sec
+        self.dropped_pong_sec = dropped_pong_sec
+        self.stats = FakeTwitchStats()
+        self._connections = []
+        self._channel_connections: Dict[str, FakeTwitchConnection] = {}
+        # When each chat command still waiting for a reply was sent, per
+        # channel. Every command is assumed to get exactly one reply.
+        self._pending_commands = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._is_running = False
+        self._is_flooding = False
+        self._worker_threads = []
+
+    def add_connection(self, connection: FakeTwitchConnection) -> None:
+        with self._lock:
+            self._connections.append(connection)
+
+    def remove_connection(self, connection: FakeTwitchConnection) -> None:
+        with self._lock:
+            self._connections.remove(connection)
+            for channel_name, owner in list(
+                    self._channel_connections.items()):
+                if owner is connection:
+                    del self._channel_connections[channel_name]
+
+    def join(
+            self, connection: FakeTwitchConnection,
+            channel_name: str) -> None:
+        with self._lock:
+            self._channel_connections[channel_name] = connection
+
+    def part(
+            self, connection: FakeTwitchConnection,
+            channel_name: str) -> None:
+        with self._lock:
+            if self._channel_connections.get(channel_name) is connection:
+                del self._channel_connections[channel_name]
+
+    @property
+    def joined_channel_names(self) -> List[str]:
+        with self._lock:
+            return list(self._channel_connections)
+
+    def observe_reply(self, channel_name: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            pending_commands = self._pending_commands[channel_name]
+            if not pending_commands:
+                self.stats.unmatched_reply_count += 1
+                return
+            sent_at = pending_commands.popleft()
+            self.stats.reply_latencies_sec.append(now - sent_at)
+
+    def observe_pong(self, connection: FakeTwitchConnection) -> None:
+        if connection.pending_ping_at is None:
+            return
+        latency_sec = time.monotonic() - connection.pending_ping_at
+        connection.pending_ping_at = None
+        with self._lock:
+            self.stats.pong_latencies_sec.append(latency_sec)
+            if latency_sec > self.late_pong_sec:
+                self.stats.late_pong_count += 1
+
+    def start(self) -> None:
+        self._is_running = True
+        for target in (self.serve_forever, self._ping_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._worker_threads.append(thread)
+
+    def stop(self) -> None:
+        self._is_running = False
+        self._is_flooding = False
+        self.shutdown()
+        self.server_close()
+
+    def start_traffic(
+            self, messages_per_sec: float, command_ratio: float,
+            chat_commands: Sequence[str], seed: int=3) -> None:
+        self._is_flooding = True
+        thread = threading.Thread(
+                target=self._flood_loop,
+                args=(messages_per_sec, command_ratio, chat_commands, seed),
+                daemon=True)
+        thread.start()
+        self._worker_threads.append(thread)
+
+    def stop_traffic(self) -> None:
+        self._is_flooding = False
+
+    def _flood_loop(
+            self, messages_per_sec: float, command_ratio: float,
+            chat_commands: Sequence[str], seed: int) -> None:
+        rng = random.Random(seed)
+        started_at = time.monotonic()
+        sent_count = 0
+        while self._is_flooding:
+            due_count = int((time.monotonic() - started_at) * messages_per_sec)
+            with self._lock:
+                channel_connections = list(
+                        self._channel_connections.items())
+            if not channel_connections:
+                time.sleep(.01)
+                continue
+            while sent_count < due_count:
+                channel_name, connection = rng.choice(channel_connections)
+                line = synthetic_privmsg_line(
+                        rng, channel_name, command_ratio, chat_commands)
+                body = line.split(f"PRIVMSG #{channel_name} :", 1)[1]
+                with self._lock:
+                    if body.startswith("!"):
+                        self._pending_commands[channel_name].append(
+                                time.monotonic())
+                        self.stats.command_lines_sent += 1
+                    self.stats.chat_lines_sent += 1
+                try:
+                    connection.send_line(line)
+                except (ConnectionError, ValueError):
+                    pass
+                sent_count += 1
+            time.sleep(.005)
+
+    def _ping_loop(self) -> None:
+        while self._is_running:
+            time.sleep(self.ping_interval_sec)
+            now = time.monotonic()
+            with self._lock:
+                connections = list(self._connections)
+            for connection in connections:
+                pending_ping_at = connection.pending_ping_at
+                if pending_ping_at is not None:
+                    if now - pending_ping_at < self.dropped_pong_sec:
+                        continue
+                    with self._lock:
+                        self.stats.dropped_pong_count += 1
+                connection.pending_ping_at = now
+                with self._lock:
+                    self.stats.pings_sent += 1
+                try:
+                    connection.send_line(f"PING :{SERVER_PING_TOKEN}")
+                except (ConnectionError, ValueError):
+                    pass
@@ -0,0 +1,99 @@
+import argparse
+import time
+
+import main as jazzycircuitbot
+
+from src.bot_state_store import BotStateStore
+from src.event_journal import JournalReplayListener, ReplayIRCClient
+from src.irc_client_handlers import (
+        ConfirmJoinHandler, LeaveIfNotModdedHandler, ReportTimeoutHandler)
+from src.streambrain_metrics import StreamBrainMetrics
+from src.twitch_chat_command_handler import (
+        TwitchChatCommandHandler, twitch_chat_commands)
+
+
+# Run from the repository root:
+#   python -m tools.replay_journal PATH [--speed 10] [--cooldowns]
+# Feeds a journal recorded with 'main.py --record-journal' through the
+# same StreamBrain setup main.py uses, with handlers that never touch the
+# network: replies land in a ReplayIRCClient, commands that would ask
+# start.gg answer with a placeholder, and bot state lives in memory.
+# Login failure notices and Givebutter donations are replayed but not
+# handled, since handling them means calling Twitch. By default the
+# journal is replayed as fast as the brain takes it.
+
+OFFLINE_REPLY = "(replayed without calling start.gg)"
+
+
+class OfflineCommandHandler(TwitchChatCommandHandler):
+    # Blocking commands are the ones that wait on start.gg; they still go
+    # through the worker pool, but reply at once.
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        for chat_command in twitch_chat_commands.commands():
+            if chat_command.blocking:
+                setattr(self, chat_command.method_name, self.offline_command)
+
+    def offline_command(self, channel: str, sender: str) -> str:
+        return OFFLINE_REPLY
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("journal_path", metavar="PATH")
+    argument_parser.add_argument(
+            "--speed", type=float,
+            help="replay N times faster than recorded instead of unpaced")
+    argument_parser.add_argument(
+            "--cooldowns", action="store_true",
+            help="let command cooldowns collapse repeated commands")
+    arguments = argument_parser.parse_args()
+
+    replay_irc_client = ReplayIRCClient()
+    bot_state = BotStateStore(":memory:")
+    streambrain_metrics = StreamBrainMetrics()
+    jazzycircuitbot_brain = jazzycircuitbot.create_brain(streambrain_metrics)
+    command_handler = OfflineCommandHandler(
+            replay_irc_client, bot_state, "replay", arguments.cooldowns)
+    jazzycircuitbot_brain.activate_handler(command_handler)
+    jazzycircuitbot_brain.activate_handler(
+            LeaveIfNotModdedHandler(replay_irc_client, bot_state))
+    jazzycircuitbot_brain.activate_handler(
+            ConfirmJoinHandler(replay_irc_client))
+    jazzycircuitbot_brain.activate_handler(ReportTimeoutHandler())
+
+    journal_replay_listener = JournalReplayListener(
+            arguments.journal_path, replay_irc_client, arguments.speed, 0)
+    started_at = time.monotonic()
+    jazzycircuitbot_brain.start_listening(journal_replay_listener)
+    while (
+            not journal_replay_listener.is_finished
+            or jazzycircuitbot_brain.queue_depth):
+        time.sleep(.01)
+    elapsed_sec = time.monotonic() - started_at
+    jazzycircuitbot_brain.stop()
+    command_handler.stop()
+    bot_state.close()
+
+    replayed_count = journal_replay_listener.replayed_count
+    reply_count = sum(
+            1 for x in replay_irc_client.sent_lines
+            if x.startswith("PRIVMSG "))
+    print(
+            f"replayed {replayed_count} events in {elapsed_sec:.2f}s: "
+            f"{replayed_count / elapsed_sec:10.1f} events/s")
+    print(
+            f"sent {len(replay_irc_client.sent_lines)} lines, "
+            f"{reply_count} of them chat messages")
+    for priority, latency in jazzycircuitbot_brain.lane_latencies().items():
+        print(
+                f"lane {priority}: {latency['count']} events, queue delay "
+                f"mean {latency['mean_sec'] * 1000:.1f} ms, "
+                f"max {latency['max_sec'] * 1000:.1f} ms")
+    shed_counts = jazzycircuitbot_brain.shed_counts()
+    if shed_counts:
+        print(f"shed events: {shed_counts}")
+
+
+if __name__ == "__main__":
+    main()